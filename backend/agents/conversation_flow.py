@@ -0,0 +1,148 @@
+"""
+Conversation state machine
+The stages of a loan conversation and the transitions allowed out of each, in one table.
+MasterAgent registers a handler per stage with @FLOW.handles(stage) (and, for stages that
+wait on I/O, a coroutine with @FLOW.handles_async(stage)) and moves between
+stages only through FLOW.transition, which checks the move against the table, records
+it in loan_stage_transitions_total and the time spent in the stage left in
+loan_stage_dwell_seconds, then calls the on_transition hooks (persistence, funnel
+analytics) with the fields the stage left behind. validate() runs at import, so a
+missing handler or an unreachable stage fails at startup rather than mid-conversation.
+
+Adding a stage: a row in STAGES, a handler registered for it, and transitions into it
+from the stages that lead there.
+"""
+from collections import namedtuple
+
+from utils.metrics import STAGE_TRANSITIONS, STAGE_DWELL_SECONDS
+
+# records: conversation_state fields a stage's handler fills in before moving on
+Stage = namedtuple('Stage', ['name', 'transitions', 'records'], defaults=((),))
+
+INITIAL_STAGE = 'initial'
+
+STAGES = (
+    Stage('initial', ('awaiting_phone',)),
+    Stage('awaiting_phone', ('awaiting_loan_amount',), ('customer_data',)),
+    Stage('awaiting_loan_amount', ('awaiting_tenure',), ('loan_amount',)),
+    Stage('awaiting_tenure', ('reviewing_terms',), ('tenure_months', 'loan_terms')),
+    # "No" to the terms goes back to choosing the amount
+    Stage('reviewing_terms', ('processing_underwriting', 'awaiting_loan_amount')),
+    Stage('awaiting_salary_slip', ('processing_underwriting',), ('uploaded_salary_slip',)),
+    Stage('processing_underwriting', ('generating_sanction', 'awaiting_salary_slip', 'completed'),
+          ('underwriting_result',)),
+    Stage('generating_sanction', ('completed',), ('sanction_result',)),
+    Stage('completed', ()),
+)
+
+class IllegalTransition(RuntimeError):
+    """A handler tried a stage change that the table does not allow"""
+
+def _adapt(stage, fn, takes):
+    """Call fn(agent, ...) with the one argument it takes out of (message, context)"""
+    if takes == 'message':
+        return lambda agent, message, context: fn(agent, message)
+    if takes == 'context':
+        return lambda agent, message, context: fn(agent, context)
+    if takes is None:
+        return lambda agent, message, context: fn(agent)
+    raise ValueError(f"Unknown handler argument {takes!r} for stage {stage}")
+
+class ConversationFlow:
+    def __init__(self, stages, initial=INITIAL_STAGE):
+        self.initial = initial
+        self.stages = {stage.name: stage for stage in stages}
+        # Staying in a stage is always allowed
+        self._allowed = {stage.name: frozenset(stage.transitions) | {stage.name} for stage in stages}
+        self._records = {stage.name: stage.records for stage in stages}
+        self._handlers = {}
+        self._async_handlers = {}
+        self._hooks = []
+
+    def handles(self, stage, takes=None):
+        """
+        Register the decorated MasterAgent method as the handler for stage; takes is
+        'message', 'context' or None for the one argument it is called with
+        """
+        def register(fn):
+            self._handlers[stage] = _adapt(stage, fn, takes)
+            return fn
+        return register
+
+    def handles_async(self, stage, takes=None):
+        """
+        Register a coroutine method as the handler process_message_async uses for stage
+        Only stages whose handlers wait on I/O need one; the sync handler serves the rest
+        """
+        def register(fn):
+            self._async_handlers[stage] = _adapt(stage, fn, takes)
+            return fn
+        return register
+
+    def handler(self, stage):
+        """Handler for stage, or None when the stage is unknown"""
+        return self._handlers.get(stage)
+
+    def async_handler(self, stage):
+        """Coroutine handler for stage, or None when the sync handler serves it"""
+        return self._async_handlers.get(stage)
+
+    def on_transition(self, hook):
+        """hook(agent, from_stage, to_stage, changes) runs after every transition and reset"""
+        self._hooks.append(hook)
+        return hook
+
+    def transition(self, agent, target):
+        state = agent.conversation_state
+        source = state['stage']
+        if target not in self._allowed.get(source, ()):
+            raise IllegalTransition(f"{source} -> {target}")
+        now = agent.runtime.clock.time()
+        entered = state.get('stage_entered_at')
+        if entered is not None:
+            STAGE_DWELL_SECONDS.observe(now - entered, source)
+        STAGE_TRANSITIONS.inc(source, target)
+        state['stage'] = target
+        state['stage_entered_at'] = now
+        if self._hooks:
+            changes = {field: state.get(field) for field in self._records[source]}
+            for hook in self._hooks:
+                hook(agent, source, target, changes)
+
+    def reset(self, agent, state):
+        """Start the conversation over with a fresh state (not a transition: allowed from anywhere)"""
+        source = agent.conversation_state['stage']
+        state['stage'] = self.initial
+        state['stage_entered_at'] = agent.runtime.clock.time()
+        agent.conversation_state = state
+        for hook in self._hooks:
+            hook(agent, source, self.initial, {})
+
+    def validate(self):
+        """Raise ValueError when the table and the registered handlers do not fit together"""
+        problems = []
+        if self.initial not in self.stages:
+            problems.append(f"initial stage {self.initial} is not in the table")
+        for name, stage in self.stages.items():
+            if name not in self._handlers:
+                problems.append(f"no handler for stage {name}")
+            for target in stage.transitions:
+                if target not in self.stages:
+                    problems.append(f"{name} -> {target}: unknown stage")
+        for name in list(self._handlers) + list(self._async_handlers):
+            if name not in self.stages:
+                problems.append(f"handler registered for unknown stage {name}")
+        reachable, frontier = set(), [self.initial]
+        while frontier:
+            name = frontier.pop()
+            if name in reachable or name not in self.stages:
+                continue
+            reachable.add(name)
+            frontier.extend(self.stages[name].transitions)
+        for name in self.stages:
+            if name not in reachable:
+                problems.append(f"stage {name} is unreachable from {self.initial}")
+        if problems:
+            raise ValueError("Invalid conversation flow: " + "; ".join(problems))
+
+FLOW = ConversationFlow(STAGES)
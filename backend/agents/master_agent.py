@@ -1,24 +1,39 @@
+import logging
+
 from agents.verification_agent import VerificationAgent
 from agents.sales_agent import SalesAgent
 from agents.underwriting_agent import UnderwritingAgent
 from agents.sanction_agent import SanctionAgent
+from agents.conversation_flow import FLOW
 from utils.nlp_processor import NLPProcessor
+from utils.metrics import STAGE_SECONDS, ACTIONS, UNDERWRITING_DECISIONS
+from utils.tracing import span, set_session
+from utils.runtime import default_runtime
+from utils import event_log, letter_prerender, transcripts
+
+logger = logging.getLogger(__name__)
 
 class MasterAgent:
     """
     Main Orchestrator: Manages conversation flow and coordinates worker agents
     """
 
-    def __init__(self):
+    def __init__(self, session_id=None, runtime=None):
         self.name = "Master Agent"
+        self.session_id = session_id
+        # Clock, RNG and simulated latencies; AgentRuntime.virtual(seed) for fast deterministic replays
+        self.runtime = runtime or default_runtime()
 
         # Initialize worker agents
         self.verification_agent = VerificationAgent()
         self.sales_agent = SalesAgent()
-        self.underwriting_agent = UnderwritingAgent()
-        self.sanction_agent = SanctionAgent()
+        self.underwriting_agent = UnderwritingAgent(self.runtime)
+        self.sanction_agent = SanctionAgent(self.runtime)
         self.nlp = NLPProcessor()
 
+        # Progress callback for the message being processed (see process_message)
+        self._progress = None
+
         # Conversation state
         self.conversation_state = {
             'stage': 'initial',
@@ -28,50 +43,69 @@ class MasterAgent:
             'loan_terms': None,
             'uploaded_salary_slip': None,
             'underwriting_result': None,
-            'sanction_result': None
+            'sanction_result': None,
+            'stage_entered_at': None
         }
 
-    def process_message(self, user_message, context=None):
+    def process_message(self, user_message, context=None, progress=None):
         """
         Main orchestration logic
         Determines which agent to invoke based on conversation stage
+        progress(event, message, data) is called as long-running steps start and finish
+        """
+        stage, underwriting_before = self._begin_turn(progress)
+        try:
+            with STAGE_SECONDS.time(stage), span(f"master.{stage}"):
+                response = self._dispatch(user_message, context)
+        finally:
+            self._progress = None
+        self._end_turn(stage, user_message, context, response, underwriting_before)
+        return response
+
+    async def process_message_async(self, user_message, context=None, progress=None):
+        """
+        process_message for asyncio callers: the credit pull, salary extraction and letter
+        writing are awaited, so a conversation waiting on them holds no thread. Same
+        state, replies and transition hooks as process_message, which stays the sync API.
         """
+        stage, underwriting_before = self._begin_turn(progress)
+        try:
+            with STAGE_SECONDS.time(stage), span(f"master.{stage}"):
+                response = await self._dispatch_async(user_message, context)
+        finally:
+            self._progress = None
+        self._end_turn(stage, user_message, context, response, underwriting_before)
+        return response
+
+    def _begin_turn(self, progress):
+        self._progress = progress
+        set_session(self.session_id)
+        return self.conversation_state['stage'], self.conversation_state.get('underwriting_result')
+
+    def _end_turn(self, stage, user_message, context, response, underwriting_before):
+        ACTIONS.inc(str(response.get('action')))
+        if response.get('stage') != self.conversation_state['stage']:
+            logger.warning("Reply stage %s differs from stored stage %s", response.get('stage'),
+                           self.conversation_state['stage'], extra={'session_id': self.session_id})
+        if transcripts.ENABLED:
+            transcripts.record_turn(self, stage, user_message, context, response, underwriting_before)
+
+    def _report(self, event, message, **data):
+        if self._progress:
+            self._progress(event, message, data)
+
+    def _dispatch(self, user_message, context):
         stage = self.conversation_state['stage']
         
-        print(f"\n[Master Agent] Processing message at stage: {stage}")
-        print(f"[Master Agent] User message: {user_message}")
-        print(f"[Master Agent] Context: {context}")
-
-        if stage == 'initial':
-            return self._handle_initial_greeting()
-
-        elif stage == 'awaiting_phone':
-            return self._handle_phone_verification(user_message)
-
-        elif stage == 'awaiting_loan_amount':
-            return self._handle_loan_amount(user_message)
-
-        elif stage == 'awaiting_tenure':
-            return self._handle_tenure_selection(user_message)
-
-        elif stage == 'reviewing_terms':
-            return self._handle_terms_review(user_message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing message", extra={
+                'session_id': self.session_id, 'stage': stage,
+                'user_message': user_message, 'context': context
+            })
 
-        elif stage == 'awaiting_salary_slip':
-            return self._handle_salary_slip_upload(context)
-
-        elif stage == 'processing_underwriting':
-            return self._handle_underwriting()
-
-        elif stage == 'generating_sanction':
-            return self._handle_sanction_generation()
-
-        elif stage == 'completed':
-            return {
-                'response': "Your loan has been processed! Is there anything else I can help you with?",
-                'stage': 'completed',
-                'action': None
-            }
+        handler = FLOW.handler(stage)
+        if handler is not None:
+            return handler(self, user_message, context)
 
         # fallback
         return {
@@ -80,28 +114,41 @@ class MasterAgent:
             'action': 'error'
         }
 
+    async def _dispatch_async(self, user_message, context):
+        handler = FLOW.async_handler(self.conversation_state['stage'])
+        if handler is not None:
+            return await handler(self, user_message, context)
+        # Stages that do no I/O are handled the same either way
+        return self._dispatch(user_message, context)
+
+    def _transition(self, stage):
+        """Move to stage; checked against the table in agents/conversation_flow.py and recorded"""
+        FLOW.transition(self, stage)
+
+    @FLOW.handles('initial')
     def _handle_initial_greeting(self):
         """Initial greeting and lead capture"""
-        self.conversation_state['stage'] = 'awaiting_phone'
+        self._transition('awaiting_phone')
         return {
             'response': "Hi! 👋 Welcome to Tata Capital. I'm here to help you get a personal loan approved quickly. May I have your mobile number to get started?",
             'stage': 'awaiting_phone',
             'action': 'request_phone'
         }
 
+    @FLOW.handles('awaiting_phone', takes='message')
     def _handle_phone_verification(self, phone_number):
         """Delegate to Verification Agent with NLP processing"""
         # Use NLP to clean phone number
         cleaned_phone = self.nlp.clean_phone_number(phone_number)
 
-        print(f"[Master Agent] Processing phone: {phone_number} -> {cleaned_phone}")
+        logger.debug("Processing phone %s -> %s", phone_number, cleaned_phone, extra={'session_id': self.session_id})
 
         result = self.verification_agent.verify_customer(cleaned_phone)
 
         if result.get('verified'):
             customer = result.get('customer')
             self.conversation_state['customer_data'] = customer
-            self.conversation_state['stage'] = 'awaiting_loan_amount'
+            self._transition('awaiting_loan_amount')
 
             pre_approved = customer.get('pre_approved_limit', 0)
 
@@ -120,6 +167,7 @@ class MasterAgent:
                 'action': 'retry_phone'
             }
 
+    @FLOW.handles('awaiting_loan_amount', takes='message')
     def _handle_loan_amount(self, amount_text):
         """Parse and validate loan amount using NLP"""
         try:
@@ -127,7 +175,7 @@ class MasterAgent:
         except ValueError:
             amount = None
 
-        print(f"[Master Agent] Extracted amount from '{amount_text}': {amount}")
+        logger.debug("Extracted amount from %r: %s", amount_text, amount, extra={'session_id': self.session_id})
 
         if amount is None:
             return {
@@ -151,7 +199,7 @@ class MasterAgent:
             }
 
         self.conversation_state['loan_amount'] = amount
-        self.conversation_state['stage'] = 'awaiting_tenure'
+        self._transition('awaiting_tenure')
 
         # Get tenure suggestions from Sales Agent
         customer = self.conversation_state['customer_data']
@@ -173,6 +221,7 @@ class MasterAgent:
             'suggestions': suggestions.get('all_options')
         }
 
+    @FLOW.handles('awaiting_tenure', takes='message')
     def _handle_tenure_selection(self, tenure_text):
         """Parse tenure and show loan terms using NLP"""
         try:
@@ -180,7 +229,7 @@ class MasterAgent:
         except ValueError:
             tenure = None
 
-        print(f"[Master Agent] Extracted tenure from '{tenure_text}': {tenure}")
+        logger.debug("Extracted tenure from %r: %s", tenure_text, tenure, extra={'session_id': self.session_id})
 
         if tenure is None:
             return {
@@ -203,7 +252,7 @@ class MasterAgent:
         amount = self.conversation_state['loan_amount']
         loan_terms = self.sales_agent.discuss_loan_terms(customer, amount, tenure)
         self.conversation_state['loan_terms'] = loan_terms
-        self.conversation_state['stage'] = 'reviewing_terms'
+        self._transition('reviewing_terms')
 
         response = (
             f"Excellent choice! Here's your loan summary:\n\n"
@@ -224,16 +273,28 @@ class MasterAgent:
             'loan_terms': loan_terms
         }
 
+    @FLOW.handles('reviewing_terms', takes='message')
     def _handle_terms_review(self, user_response):
         """Handle customer's acceptance or negotiation using NLP"""
+        reply = self._review_terms(user_response)
+        return reply if reply is not None else self._handle_underwriting()
+
+    @FLOW.handles_async('reviewing_terms', takes='message')
+    async def _handle_terms_review_async(self, user_response):
+        reply = self._review_terms(user_response)
+        return reply if reply is not None else await self._handle_underwriting_async()
+
+    def _review_terms(self, user_response):
+        """Reply to the customer's answer, or None once they accept and underwriting should run"""
         if self.nlp.is_affirmative(user_response):
             # Move to underwriting
-            self.conversation_state['stage'] = 'processing_underwriting'
-            return self._handle_underwriting()
+            self._transition('processing_underwriting')
+            return None
 
         elif self.nlp.is_negative(user_response):
+            self._transition('awaiting_loan_amount')
             return {
-                'response': "No problem! What would you like to adjust? The amount or the tenure?",
+                'response': "No problem! Let's adjust the terms. How much would you like to borrow? You can pick a different tenure next.",
                 'stage': 'awaiting_loan_amount',
                 'action': 'restart_terms'
             }
@@ -245,33 +306,59 @@ class MasterAgent:
                 'action': 'clarify_acceptance'
             }
 
+    @FLOW.handles('processing_underwriting')
     def _handle_underwriting(self):
         """Delegate to Underwriting Agent"""
-        customer = self.conversation_state['customer_data']
-        amount = self.conversation_state['loan_amount']
-        tenure = self.conversation_state['tenure_months']
-        loan_terms = self.conversation_state.get('loan_terms')
-        salary_slip = self.conversation_state.get('uploaded_salary_slip')
-
-        print(f"[Master Agent] Calling underwriting with salary_slip: {salary_slip}")
-
-        result = self.underwriting_agent.evaluate_eligibility(
-            customer, amount, tenure, loan_terms.get('interest_rate'), salary_slip
+        self._report('underwriting_started', "Checking your eligibility")
+        result = self.underwriting_agent.evaluate_eligibility(*self._underwriting_inputs(), progress=self._progress)
+        reply = self._underwriting_reply(result)
+        return reply if reply is not None else self._handle_sanction_generation()
+
+    @FLOW.handles_async('processing_underwriting')
+    async def _handle_underwriting_async(self):
+        self._report('underwriting_started', "Checking your eligibility")
+        result = await self.underwriting_agent.evaluate_eligibility_async(
+            *self._underwriting_inputs(), progress=self._progress
         )
-
-        print(f"[Master Agent] Underwriting result: {result}")
+        reply = self._underwriting_reply(result)
+        return reply if reply is not None else await self._handle_sanction_generation_async()
+
+    def _underwriting_inputs(self):
+        """Customer, amount, tenure, interest rate and salary slip, as evaluate_eligibility takes them"""
+        state = self.conversation_state
+        return (state['customer_data'], state['loan_amount'], state['tenure_months'],
+                state.get('loan_terms').get('interest_rate'), state.get('uploaded_salary_slip'))
+
+    def _underwriting_reply(self, result):
+        """Record the decision and reply to it, or None once approved and the letter should be generated"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Underwriting result", extra={
+                'session_id': self.session_id, 'salary_slip': self.conversation_state.get('uploaded_salary_slip'),
+                'underwriting': result
+            })
+
+        if result.get('retry'):
+            # No decision yet: stay in processing_underwriting, the next message runs it again
+            UNDERWRITING_DECISIONS.inc(result.get('reason'), 'false')
+            logger.warning("Underwriting incomplete", extra={'session_id': self.session_id, 'reason': result.get('reason')})
+            return {
+                'response': result['message'],
+                'stage': 'processing_underwriting',
+                'action': 'underwriting_retry'
+            }
 
         self.conversation_state['underwriting_result'] = result
+        UNDERWRITING_DECISIONS.inc(result.get('reason'), str(bool(result.get('approved'))).lower())
 
         if result.get('approved'):
-            print(f"[Master Agent] ✅ Loan APPROVED by underwriting!")
+            logger.info("Underwriting approved", extra={'session_id': self.session_id})
             # Proceed to sanction
-            self.conversation_state['stage'] = 'generating_sanction'
-            return self._handle_sanction_generation()
+            self._transition('generating_sanction')
+            return None
 
         elif result.get('needs_salary_slip'):
-            print(f"[Master Agent] 📄 Salary slip needed")
-            self.conversation_state['stage'] = 'awaiting_salary_slip'
+            logger.info("Underwriting needs salary slip", extra={'session_id': self.session_id})
+            self._transition('awaiting_salary_slip')
             return {
                 'response': result.get('message', "We need additional documents.") + "\n\nPlease upload your latest salary slip to continue.",
                 'stage': 'awaiting_salary_slip',
@@ -280,9 +367,9 @@ class MasterAgent:
             }
 
         else:
-            print(f"[Master Agent] ❌ Loan REJECTED by underwriting")
+            logger.info("Underwriting rejected", extra={'session_id': self.session_id, 'reason': result.get('reason')})
             # Loan rejected
-            self.conversation_state['stage'] = 'completed'
+            self._transition('completed')
             rejection_msg = result.get('message', "We are unable to approve your loan at this time.") + "\n\n"
             if result.get('reason') == 'exceeds_limit':
                 rejection_msg += f"However, you can apply for up to ₹{result.get('max_eligible_amount', 0):,}. Would you like to revise your application?"
@@ -296,45 +383,69 @@ class MasterAgent:
                 'rejection_reason': result.get('reason')
             }
 
+    @FLOW.handles('awaiting_salary_slip', takes='context')
     def _handle_salary_slip_upload(self, context):
         """Handle salary slip upload"""
-        print(f"[Master Agent] _handle_salary_slip_upload called with context: {context}")
-        
+        reply = self._receive_salary_slip(context)
+        return reply if reply is not None else self._handle_underwriting()
+
+    @FLOW.handles_async('awaiting_salary_slip', takes='context')
+    async def _handle_salary_slip_upload_async(self, context):
+        reply = self._receive_salary_slip(context)
+        return reply if reply is not None else await self._handle_underwriting_async()
+
+    def _receive_salary_slip(self, context):
+        """Record an uploaded slip and return None so underwriting runs, or ask for the upload again"""
         if context and context.get('file_uploaded'):
             file_path = context.get('file_path') or context.get('file_name')
-            self.conversation_state['uploaded_salary_slip'] = file_path
+            self.conversation_state['uploaded_salary_slip'] = {
+                'path': file_path,
+                'name': context.get('file_name'),
+                'content_hash': context.get('content_hash')
+            }
 
-            print(f"[Master Agent] ✅ Salary slip uploaded: {file_path}")
-            print(f"[Master Agent] Triggering underwriting process...")
+            logger.info("Salary slip uploaded, running underwriting", extra={
+                'session_id': self.session_id, 'content_hash': (context.get('content_hash') or '')[:12]
+            })
 
-            self.conversation_state['stage'] = 'processing_underwriting'
-            
-            # Call underwriting directly
-            return self._handle_underwriting()
+            self._transition('processing_underwriting')
+            return None
         else:
-            print(f"[Master Agent] ❌ No file in context")
+            logger.warning("Salary slip step without a file", extra={'session_id': self.session_id})
             return {
                 'response': "I haven't received the document yet. Please upload your salary slip (PDF, JPG, or PNG).",
                 'stage': 'awaiting_salary_slip',
                 'action': 'awaiting_upload'
             }
 
+    @FLOW.handles('generating_sanction')
     def _handle_sanction_generation(self):
         """Delegate to Sanction Agent to generate letter"""
-        customer = self.conversation_state['customer_data']
-        loan_terms = self.conversation_state['loan_terms']
-        underwriting_result = self.conversation_state['underwriting_result']
-
-        print(f"[Master Agent] Generating sanction letter...")
-
         sanction_result = self.sanction_agent.generate_sanction_letter(
-            customer, loan_terms, underwriting_result.get('credit_info')
+            *self._sanction_inputs(), session_id=self.session_id, progress=self._progress
         )
+        return self._sanction_reply(sanction_result)
 
-        print(f"[Master Agent] Sanction result: {sanction_result}")
+    @FLOW.handles_async('generating_sanction')
+    async def _handle_sanction_generation_async(self):
+        sanction_result = await self.sanction_agent.generate_sanction_letter_async(
+            *self._sanction_inputs(), session_id=self.session_id, progress=self._progress
+        )
+        return self._sanction_reply(sanction_result)
+
+    def _sanction_inputs(self):
+        state = self.conversation_state
+        return state['customer_data'], state['loan_terms'], state['underwriting_result'].get('credit_info')
+
+    def _sanction_reply(self, sanction_result):
+        logger.info("Sanction stage completed", extra={
+            'session_id': self.session_id,
+            'loan_reference_number': sanction_result.get('loan_reference_number'),
+            'success': sanction_result.get('success')
+        })
 
         self.conversation_state['sanction_result'] = sanction_result
-        self.conversation_state['stage'] = 'completed'
+        self._transition('completed')
 
         summary = self.sanction_agent.get_sanction_summary(sanction_result)
 
@@ -347,9 +458,17 @@ class MasterAgent:
             'pdf_path': sanction_result.get('pdf_filename', sanction_result.get('pdf_path'))
         }
 
+    @FLOW.handles('completed')
+    def _handle_completed(self):
+        return {
+            'response': "Your loan has been processed! Is there anything else I can help you with?",
+            'stage': 'completed',
+            'action': None
+        }
+
     def reset_conversation(self):
         """Reset conversation state for new session"""
-        self.conversation_state = {
+        FLOW.reset(self, {
             'stage': 'initial',
             'customer_data': None,
             'loan_amount': None,
@@ -357,5 +476,15 @@ class MasterAgent:
             'loan_terms': None,
             'uploaded_salary_slip': None,
             'underwriting_result': None,
-            'sanction_result': None
-        }
\ No newline at end of file
+            'sanction_result': None,
+            'stage_entered_at': None
+        })
+
+# Every stage has a handler and is reachable; fails at import otherwise
+FLOW.validate()
+
+if event_log.ENABLED:
+    FLOW.on_transition(event_log.record_transition)
+
+if letter_prerender.ENABLED:
+    FLOW.on_transition(letter_prerender.on_transition)
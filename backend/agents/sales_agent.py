@@ -1,4 +1,5 @@
 from data.offers import get_interest_rate, calculate_emi, calculate_processing_fee
+from utils.metrics import instrumented
 
 class SalesAgent:
     """Worker Agent: Handles sales negotiation and loan terms discussion"""
@@ -6,6 +7,7 @@ class SalesAgent:
     def __init__(self):
         self.name = "Sales Agent"
     
+    @instrumented('sales')
     def discuss_loan_terms(self, customer_data, requested_amount, tenure_months):
         """
         Discuss loan terms with customer
@@ -28,6 +30,7 @@ class SalesAgent:
             'total_payable': round(total_payable, 2)
         }
     
+    @instrumented('sales')
     def suggest_optimal_tenure(self, customer_data, loan_amount):
         """
         Suggest optimal tenure based on customer's salary
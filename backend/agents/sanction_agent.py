@@ -1,24 +1,84 @@
-from datetime import datetime, timedelta
+import asyncio
+import logging
+import os
+from datetime import timedelta
 from utils.pdf_generator import generate_sanction_letter_pdf
+from utils.runtime import default_runtime
+from utils.metrics import instrumented
+from utils import letter_prerender
+
+logger = logging.getLogger(__name__)
 
 class SanctionAgent:
     """Worker Agent: Generates sanction letter once loan is approved"""
     
-    def __init__(self):
+    def __init__(self, runtime=None):
         self.name = "Sanction Agent"
+        self.runtime = runtime or default_runtime()
     
-    def generate_sanction_letter(self, customer_data, loan_terms, credit_info):
+    @instrumented('sanction')
+    def generate_sanction_letter(self, customer_data, loan_terms, credit_info, session_id=None, progress=None):
         """
         Generate PDF sanction letter with all loan details
+        progress(event, message, data) is told when rendering starts and the letter is ready
         """
-        print(f"\n[Sanction Agent] Generating sanction letter for {customer_data['name']}...")
+        if progress:
+            progress('generating_letter', "Preparing your sanction letter", {})
+        
+        sanction_details = self.build_sanction_details(customer_data, loan_terms, credit_info)
         
-        # Generate loan reference number
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        loan_ref_number = f"TCPL{timestamp[-10:]}"
+        # A letter pre-rendered while the customer reviewed the terms only needs stamping
+        pdf_bytes = letter_prerender.claim(session_id, sanction_details) if session_id else None
+        
+        # Generate PDF
+        pdf_path = generate_sanction_letter_pdf(sanction_details, session_id=session_id, pdf_bytes=pdf_bytes)
+        return self._letter_result(sanction_details, loan_terms, pdf_path, session_id, progress)
+    
+    @instrumented('sanction')
+    async def generate_sanction_letter_async(self, customer_data, loan_terms, credit_info, session_id=None,
+                                             progress=None):
+        """generate_sanction_letter for coroutines: the PDF is rendered and written on a thread"""
+        if progress:
+            progress('generating_letter', "Preparing your sanction letter", {})
+        
+        sanction_details = self.build_sanction_details(customer_data, loan_terms, credit_info)
+        pdf_bytes = letter_prerender.claim(session_id, sanction_details) if session_id else None
+        pdf_path = await asyncio.to_thread(generate_sanction_letter_pdf, sanction_details,
+                                           session_id=session_id, pdf_bytes=pdf_bytes)
+        return self._letter_result(sanction_details, loan_terms, pdf_path, session_id, progress)
+    
+    def _letter_result(self, sanction_details, loan_terms, pdf_path, session_id, progress):
+        loan_ref_number = sanction_details['loan_reference_number']
+        
+        # Get just the filename for frontend
+        pdf_filename = os.path.basename(pdf_path)
+        
+        logger.info("Sanction letter generated", extra={
+            'session_id': session_id, 'loan_reference_number': loan_ref_number, 'pdf_filename': pdf_filename
+        })
+        if progress:
+            progress('letter_ready', "Your sanction letter is ready",
+                     {'loan_reference_number': loan_ref_number, 'pdf_filename': pdf_filename})
+        
+        return {
+            'success': True,
+            'loan_reference_number': loan_ref_number,
+            'pdf_path': pdf_path,
+            'pdf_filename': pdf_filename,
+            'sanction_details': sanction_details,
+            'message': f"Congratulations! Your loan of ₹{loan_terms['loan_amount']:,} has been sanctioned."
+        }
+    
+    def build_sanction_details(self, customer_data, loan_terms, credit_info):
+        """
+        Assemble everything printed on the sanction letter
+        Kept separate from PDF rendering so batch runs can render in worker processes
+        """
+        # Generate loan reference number (unique even for approvals in the same instant)
+        loan_ref_number = self.runtime.new_loan_reference()
         
         # Calculate validity and disbursal dates
-        sanction_date = datetime.now()
+        sanction_date = self.runtime.clock.now()
         validity_date = sanction_date + timedelta(days=30)
         expected_disbursal = sanction_date + timedelta(days=3)
         
@@ -28,6 +88,20 @@ class SanctionAgent:
             'validity_date': validity_date.strftime("%d %B %Y"),
             'expected_disbursal_date': expected_disbursal.strftime("%d %B %Y"),
             
+            # Credit details
+            'credit_score': credit_info['credit_score'],
+            'credit_bureau': credit_info['bureau'],
+        }
+        sanction_details.update(self.build_letter_body(customer_data, loan_terms))
+        
+        return sanction_details
+    
+    def build_letter_body(self, customer_data, loan_terms):
+        """
+        The part of the sanction details known once terms are shown: customer, loan,
+        terms and documents. Reference, dates and credit fields are added at approval.
+        """
+        return {
             # Customer details
             'customer_name': customer_data['name'],
             'customer_address': customer_data['address'],
@@ -43,35 +117,12 @@ class SanctionAgent:
             'total_interest': loan_terms['total_interest'],
             'total_payable': loan_terms['total_payable'],
             
-            # Credit details
-            'credit_score': credit_info['credit_score'],
-            'credit_bureau': credit_info['bureau'],
-            
             # Terms and conditions
             'terms': self._generate_terms_and_conditions(),
             
             # Documents required
             'documents_required': self._get_required_documents()
         }
-        
-        # Generate PDF
-        pdf_path = generate_sanction_letter_pdf(sanction_details)
-        
-        # Get just the filename for frontend
-        import os
-        pdf_filename = os.path.basename(pdf_path)
-        
-        print(f"[Sanction Agent] PDF generated: {pdf_path}")
-        print(f"[Sanction Agent] Filename: {pdf_filename}")
-        
-        return {
-            'success': True,
-            'loan_reference_number': loan_ref_number,
-            'pdf_path': pdf_path,
-            'pdf_filename': pdf_filename,
-            'sanction_details': sanction_details,
-            'message': f"Congratulations! Your loan of ₹{loan_terms['loan_amount']:,} has been sanctioned."
-        }
     
     def _generate_terms_and_conditions(self):
         """Standard terms and conditions"""
@@ -1,39 +1,63 @@
-import random
+import logging
+import os
 import re
 from data.offers import calculate_emi
+from utils.salary_extractor import extract_salary, extract_salary_async
+from utils.metrics import instrumented
+from utils.runtime import default_runtime
+from utils.fanout import fan_out, fan_out_async, StepTimeout
+
+logger = logging.getLogger(__name__)
+
+# Seconds each underwriting step may take before the turn stops waiting for it
+BUREAU_TIMEOUT = float(os.environ.get('UNDERWRITING_BUREAU_TIMEOUT', 5))
+SALARY_SLIP_TIMEOUT = float(os.environ.get('UNDERWRITING_SLIP_TIMEOUT', 10))
+
+BUREAU = 'CIBIL'
 
 class UnderwritingAgent:
     """Worker Agent: Handles credit evaluation and eligibility"""
     
-    def __init__(self):
+    def __init__(self, runtime=None):
         self.name = "Underwriting Agent"
         self.min_credit_score = 700
+        self.runtime = runtime or default_runtime()
     
+    @instrumented('underwriting')
     def fetch_credit_score(self, customer_data):
         """
         Fetch credit score from mock credit bureau API
         Simulates real-time API call to CIBIL/Experian
         """
-        print(f"[Underwriting Agent] Fetching credit score for {customer_data['name']}...")
-        
-        base_score = customer_data['credit_score']
-        
         # Simulate API delay and variation
-        import time
-        time.sleep(0.5)  # Simulate network delay
-        
-        variation = random.randint(-5, 5)
+        self.runtime.wait('credit_bureau')
+        return self._bureau_report(customer_data)
+    
+    @instrumented('underwriting')
+    async def fetch_credit_score_async(self, customer_data):
+        """fetch_credit_score for coroutines: the bureau call is awaited"""
+        await self.runtime.wait_async('credit_bureau')
+        return self._bureau_report(customer_data)
+    
+    def _bureau_report(self, customer_data):
+        base_score = customer_data['credit_score']
+        variation = self.runtime.rng.randint(-5, 5)
         final_score = max(300, min(900, base_score + variation))
         
-        print(f"[Underwriting Agent] Credit score retrieved: {final_score}/900")
+        logger.debug("Credit score retrieved: %d/900", final_score)
         
         return {
             'credit_score': final_score,
             'score_band': self._get_score_band(final_score),
-            'bureau': 'CIBIL',
+            'bureau': BUREAU,
             'fetched_at': 'Mock API Call'
         }
     
+    def ping_bureau(self):
+        """Connectivity check against the credit bureau; pulls (and pays for) no report"""
+        self.runtime.wait('credit_bureau_ping')
+        return BUREAU
+    
     def _get_score_band(self, score):
         """Categorize credit score into bands"""
         if score >= 800:
@@ -47,30 +71,66 @@ class UnderwritingAgent:
         else:
             return 'Poor'
     
-    def extract_salary_from_slip(self, salary_slip_path):
+    @instrumented('underwriting')
+    def extract_salary_from_slip(self, salary_slip):
         """
         Extract salary from uploaded slip
-        In real scenario, use OCR (Tesseract/AWS Textract)
-        For demo, we extract from filename or use customer's stored salary
+        Digital PDFs are read from their text layer; images go through the slower
+        OCR path. Results are cached by content hash, so a slip is processed once.
+        salary_slip is a path or a dict with 'path', 'name' and 'content_hash'
         """
-        print(f"[Underwriting Agent] Analyzing salary slip: {salary_slip_path}")
+        slip_path, slip_name, content_hash = self._slip_source(salary_slip)
+        result = extract_salary(slip_path, slip_name, content_hash, image_extractor=self._extract_salary_from_image)
         
+        # None means we fall back to the customer's stored salary
+        return self._extracted_salary(result)
+    
+    @instrumented('underwriting')
+    async def extract_salary_from_slip_async(self, salary_slip):
+        """extract_salary_from_slip for coroutines: file reads run on threads and OCR is awaited"""
+        result = await extract_salary_async(*self._slip_source(salary_slip),
+                                            image_extractor=self._extract_salary_from_image_async)
+        return self._extracted_salary(result)
+    
+    def _slip_source(self, salary_slip):
+        """(path, name, content_hash) of a slip given as a path or an upload dict"""
+        if isinstance(salary_slip, dict):
+            slip_path = salary_slip.get('path')
+            return slip_path, salary_slip.get('name') or os.path.basename(slip_path or ''), salary_slip.get('content_hash')
+        return salary_slip, os.path.basename(salary_slip), None
+    
+    def _extracted_salary(self, result):
+        logger.info("Salary extracted", extra={
+            'method': result['method'], 'cached': result.get('cached', False),
+            'ms': round(result['seconds'] * 1000, 1), 'found': result['salary'] is not None
+        })
+        return result['salary']
+    
+    def _extract_salary_from_image(self, slip_path, slip_name):
+        """
+        Slow path for images and PDFs without a text layer
+        In real scenario, use OCR (Tesseract/AWS Textract)
+        For demo, we extract from the uploaded file name
+        """
         # Simulate OCR processing
-        import time
-        time.sleep(1)
-        
-        # Try to extract salary from filename (for demo)
-        # Example: salary_slip_85000.pdf
-        match = re.search(r'(\d{5,})', salary_slip_path)
+        self.runtime.wait('ocr')
+        return self._salary_from_name(slip_name)
+    
+    async def _extract_salary_from_image_async(self, slip_path, slip_name):
+        await self.runtime.wait_async('ocr')
+        return self._salary_from_name(slip_name)
+    
+    def _salary_from_name(self, slip_name):
+        # Example: salary_slip_85000.png
+        match = re.search(r'(\d{5,})', slip_name)
         if match:
-            extracted_salary = int(match.group(1))
-            print(f"[Underwriting Agent] Extracted salary: ₹{extracted_salary}")
-            return extracted_salary
+            return int(match.group(1))
         
-        # If no salary in filename, return None (will use customer data)
         return None
     
-    def evaluate_eligibility(self, customer_data, loan_amount, tenure_months, interest_rate, uploaded_salary_slip=None):
+    @instrumented('underwriting')
+    def evaluate_eligibility(self, customer_data, loan_amount, tenure_months, interest_rate, uploaded_salary_slip=None,
+                             progress=None):
         """
         Evaluate loan eligibility based on business rules
         
@@ -79,22 +139,93 @@ class UnderwritingAgent:
         2. If amount <= pre-approved limit: Instant approval
         3. If amount <= 2x pre-approved limit: Need salary slip, EMI <= 50% salary
         4. If amount > 2x pre-approved limit: Reject
+        
+        The credit pull and the salary-slip extraction do not depend on each other, so they
+        run concurrently (see utils/fanout.py), each with a timeout; _decide applies the
+        rules to their results.
+        
+        progress(event, message, data) is told as the credit pull and salary extraction run
         """
-        print(f"\n[Underwriting Agent] Starting eligibility evaluation...")
-        print(f"[Underwriting Agent] Loan Amount: ₹{loan_amount:,}")
-        print(f"[Underwriting Agent] Tenure: {tenure_months} months")
+        report = progress or (lambda event, message, data: None)
+        pre_approved = customer_data['pre_approved_limit']
         
-        credit_info = self.fetch_credit_score(customer_data)
-        credit_score = credit_info['credit_score']
+        def pull_credit_score():
+            info = self.fetch_credit_score(customer_data)
+            report('credit_score_received', "Credit score received",
+                   {'credit_score': info['credit_score'], 'score_band': info['score_band']})
+            return info
+        
+        def read_salary_slip():
+            salary = self.extract_salary_from_slip(uploaded_salary_slip)
+            report('salary_extracted', "Salary slip processed", {'found': salary is not None})
+            return salary
+        
+        report('fetching_credit_score', "Fetching your credit score", {})
+        steps = {'credit_score': (pull_credit_score, BUREAU_TIMEOUT)}
+        # Only Rule 3 reads the slip, and whether it applies does not depend on the score
+        if uploaded_salary_slip and pre_approved < loan_amount <= 2 * pre_approved:
+            report('extracting_salary', "Reading your salary slip", {})
+            steps['salary'] = (read_salary_slip, SALARY_SLIP_TIMEOUT)
+        # Virtual time gains nothing from threads, and inline keeps RNG draws in a fixed order
+        results = fan_out(steps, concurrent=not self.runtime.is_virtual)
+        return self._decide(customer_data, loan_amount, tenure_months, interest_rate, uploaded_salary_slip, results)
+    
+    @instrumented('underwriting')
+    async def evaluate_eligibility_async(self, customer_data, loan_amount, tenure_months, interest_rate,
+                                         uploaded_salary_slip=None, progress=None):
+        """
+        evaluate_eligibility for coroutines: the same rules, with the credit pull and the
+        salary-slip extraction awaited concurrently on the running event loop
+        """
+        report = progress or (lambda event, message, data: None)
+        pre_approved = customer_data['pre_approved_limit']
+        
+        async def pull_credit_score():
+            info = await self.fetch_credit_score_async(customer_data)
+            report('credit_score_received', "Credit score received",
+                   {'credit_score': info['credit_score'], 'score_band': info['score_band']})
+            return info
+        
+        async def read_salary_slip():
+            salary = await self.extract_salary_from_slip_async(uploaded_salary_slip)
+            report('salary_extracted', "Salary slip processed", {'found': salary is not None})
+            return salary
+        
+        report('fetching_credit_score', "Fetching your credit score", {})
+        steps = {'credit_score': (pull_credit_score, BUREAU_TIMEOUT)}
+        if uploaded_salary_slip and pre_approved < loan_amount <= 2 * pre_approved:
+            report('extracting_salary', "Reading your salary slip", {})
+            steps['salary'] = (read_salary_slip, SALARY_SLIP_TIMEOUT)
+        results = await fan_out_async(steps, concurrent=not self.runtime.is_virtual)
+        return self._decide(customer_data, loan_amount, tenure_months, interest_rate, uploaded_salary_slip, results)
+    
+    def _decide(self, customer_data, loan_amount, tenure_months, interest_rate, uploaded_salary_slip, results):
+        """Apply the rules to the credit pull and salary extraction results (values or exceptions)"""
         pre_approved = customer_data['pre_approved_limit']
         monthly_salary = customer_data['monthly_salary']
         
-        print(f"[Underwriting Agent] Pre-approved limit: ₹{pre_approved:,}")
-        print(f"[Underwriting Agent] Monthly salary: ₹{monthly_salary:,}")
+        credit_info = results['credit_score']
+        if isinstance(credit_info, StepTimeout):
+            logger.warning("Credit bureau timed out after %ss", BUREAU_TIMEOUT)
+            return {
+                'approved': False,
+                'reason': 'bureau_timeout',
+                'retry': True,
+                'message': "We couldn't reach the credit bureau just now. Please send any message in a moment and I'll try again.",
+                'needs_salary_slip': False
+            }
+        if isinstance(credit_info, Exception):
+            raise credit_info
+        credit_score = credit_info['credit_score']
+        
+        logger.debug("Evaluating eligibility", extra={
+            'loan_amount': loan_amount, 'tenure_months': tenure_months, 'credit_score': credit_score,
+            'pre_approved_limit': pre_approved, 'monthly_salary': monthly_salary
+        })
         
         # Rule 1: Check credit score
         if credit_score < self.min_credit_score:
-            print(f"[Underwriting Agent] ❌ Rejected - Credit score {credit_score} < {self.min_credit_score}")
+            logger.info("Rejected: credit score %d < %d", credit_score, self.min_credit_score)
             return {
                 'approved': False,
                 'reason': 'credit_score_low',
@@ -105,11 +236,10 @@ class UnderwritingAgent:
         
         # Calculate EMI for eligibility check
         emi_amount = calculate_emi(loan_amount, interest_rate, tenure_months)
-        print(f"[Underwriting Agent] Calculated EMI: ₹{emi_amount:,.2f}")
         
         # Rule 2: Within pre-approved limit
         if loan_amount <= pre_approved:
-            print(f"[Underwriting Agent] ✅ Approved - Within pre-approved limit")
+            logger.info("Approved: within pre-approved limit")
             return {
                 'approved': True,
                 'reason': 'within_pre_approved',
@@ -121,11 +251,9 @@ class UnderwritingAgent:
         
         # Rule 3: Between 1x and 2x pre-approved limit
         elif loan_amount <= (2 * pre_approved):
-            print(f"[Underwriting Agent] ⚠️ Requires salary verification (amount > pre-approved)")
-            
             # Check if salary slip is needed
             if not uploaded_salary_slip:
-                print(f"[Underwriting Agent] 📄 Requesting salary slip...")
+                logger.info("Salary slip required: amount above pre-approved limit")
                 return {
                     'approved': False,
                     'reason': 'salary_slip_required',
@@ -135,21 +263,22 @@ class UnderwritingAgent:
                 }
             
             # Salary slip uploaded - verify EMI
-            print(f"[Underwriting Agent] 📄 Salary slip received, verifying...")
-            
-            # Try to extract salary from slip
-            extracted_salary = self.extract_salary_from_slip(uploaded_salary_slip)
+            extracted_salary = results['salary']
+            if isinstance(extracted_salary, StepTimeout):
+                # Same as a slip we could not read: fall back to the stored salary
+                logger.warning("Salary extraction timed out after %ss; using the stored salary", SALARY_SLIP_TIMEOUT)
+                extracted_salary = None
+            elif isinstance(extracted_salary, Exception):
+                raise extracted_salary
             if extracted_salary:
                 monthly_salary = extracted_salary
-                print(f"[Underwriting Agent] Using extracted salary: ₹{monthly_salary:,}")
-            else:
-                print(f"[Underwriting Agent] Using stored salary: ₹{monthly_salary:,}")
             
             emi_to_salary_ratio = (emi_amount / monthly_salary) * 100
-            print(f"[Underwriting Agent] EMI to Salary Ratio: {emi_to_salary_ratio:.2f}%")
+            logger.debug("EMI %.2f is %.2f%% of salary (%s)", emi_amount, emi_to_salary_ratio,
+                         'extracted' if extracted_salary else 'stored')
             
             if emi_to_salary_ratio <= 50:
-                print(f"[Underwriting Agent] ✅ Approved - EMI within 50% of salary")
+                logger.info("Approved: EMI ratio %.1f%% within 50%%", emi_to_salary_ratio)
                 return {
                     'approved': True,
                     'reason': 'salary_verified',
@@ -161,7 +290,7 @@ class UnderwritingAgent:
                     'needs_salary_slip': False
                 }
             else:
-                print(f"[Underwriting Agent] ❌ Rejected - EMI ratio {emi_to_salary_ratio:.1f}% > 50%")
+                logger.info("Rejected: EMI ratio %.1f%% > 50%%", emi_to_salary_ratio)
                 return {
                     'approved': False,
                     'reason': 'high_emi_ratio',
@@ -175,7 +304,7 @@ class UnderwritingAgent:
         # Rule 4: More than 2x pre-approved limit
         else:
             max_eligible = pre_approved * 2
-            print(f"[Underwriting Agent] ❌ Rejected - Amount exceeds 2x pre-approved limit")
+            logger.info("Rejected: amount exceeds 2x pre-approved limit")
             return {
                 'approved': False,
                 'reason': 'exceeds_limit',
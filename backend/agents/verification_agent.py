@@ -1,4 +1,5 @@
 from data.customers import get_customer_by_phone
+from utils.metrics import instrumented
 
 class VerificationAgent:
     """Worker Agent: Handles KYC verification"""
@@ -6,6 +7,7 @@ class VerificationAgent:
     def __init__(self):
         self.name = "Verification Agent"
     
+    @instrumented('verification')
     def verify_customer(self, phone_number):
         """
         Verify customer KYC details from CRM
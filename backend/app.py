@@ -1,13 +1,99 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context, g
+import hashlib
+import json
+import logging
 import os
-import traceback
+import time
+from werkzeug.exceptions import RequestEntityTooLarge
 from functools import wraps
 from agents.master_agent import MasterAgent
+from utils.batch_sanction import stream_sanction_zip
+from utils.storage import get_store, FileTooLarge
+from utils.image_normalizer import schedule_normalization, normalization_stats
+from utils.worker_pools import all_pools, PoolSaturated
+from utils.logging_config import configure_logging
+from utils.session_store import create_session_store, SESSION_TTL_SECONDS
+from utils.chat_v2 import build_response, state_response, static_block
+from utils.json_codec import dumps
+from utils.sse import stream_job, HEADERS as SSE_HEADERS
+from utils.idempotency import create_idempotency_store, InProgress, KeyReused, StoredResponse, MAX_KEY_LENGTH
+from utils.rate_limit import create_admission_controller, client_ip, Rejected, UNDERWRITING_STAGES
+from utils import event_log, health, metrics, profiling, tracing
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Store active sessions
-active_sessions = {}
+# Most letters /api/debug/pdf-status lists per page, and traces /api/debug/trace returns
+MAX_PDF_STATUS_LIMIT = 1000
+MAX_TRACE_LIMIT = 100
+
+# Hard cap on request bodies; Werkzeug rejects anything larger with 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', 15)) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024  # room for the multipart envelope
+
+# Conversation sessions: in memory for the dev server, shared SQLite under gunicorn
+sessions = create_session_store(MasterAgent)
+if event_log.ENABLED and sessions.backend == 'memory':
+    # After a restart, conversations come back from the event log's snapshot and tail
+    event_log.restore_sessions(sessions, MasterAgent, SESSION_TTL_SECONDS)
+
+# Token-bucket limits on the expensive endpoints and overload shedding (see utils/rate_limit.py)
+admission = create_admission_controller()
+
+# Responses kept per (session, Idempotency-Key) so client retries do not repeat a turn
+idempotency = create_idempotency_store()
+
+# Gauges read when /metrics is scraped
+metrics.Gauge('loan_active_sessions', "Conversation sessions held by the session store", sessions.count,
+              shared=sessions.backend != 'memory')
+metrics.Gauge('loan_pool_queued', "Jobs waiting in each worker pool",
+              lambda: {(pool.name,): pool.queued for pool in all_pools()}, ('pool',))
+metrics.Gauge('loan_pool_active', "Jobs running in each worker pool",
+              lambda: {(pool.name,): pool.active for pool in all_pools()}, ('pool',))
+
+@app.before_request
+def _start_timer():
+    request.environ['loan.started'] = time.perf_counter()
+    if request.path.startswith('/api/') and not request.path.startswith('/api/debug/'):
+        g.trace, g.trace_token = tracing.start_trace(f"{request.method} {request.path}",
+                                                     request.headers.get('X-Trace-Id'))
+    mode = request.headers.get('X-Debug-Profile')
+    if mode in profiling.MODES and profiling.authorized(request.headers.get('X-Debug-Token')):
+        capture = profiling.RequestProfile(mode)
+        if capture.start():
+            g.profile = capture
+
+@app.after_request
+def _record_latency(response):
+    started = request.environ.get('loan.started')
+    if started is not None and request.url_rule is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.url_rule.rule,
+                                             request.method, str(response.status_code))
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Trace-Id'] = trace.trace_id
+    capture = g.pop('profile', None)
+    if capture is not None:
+        response.headers['X-Profile-Id'] = capture.stop()
+    return response
+
+@app.teardown_request
+def _finish_trace(error=None):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.finish_trace(trace, g.pop('trace_token', None))
+
+@app.teardown_request
+def _finish_profile(error=None):
+    # after_request is skipped when the request fails; the profiler must not outlive it
+    capture = g.pop('profile', None)
+    if capture is not None:
+        try:
+            capture.stop()
+        except Exception:
+            logger.exception("Stopping a request profile failed")
 
 # ✅ Manual CORS decorator (no flask-cors needed)
 def add_cors_headers(f):
@@ -17,34 +103,173 @@ def add_cors_headers(f):
         if request.method == 'OPTIONS':
             response = make_response('', 204)
         else:
-            response = make_response(f(*args, **kwargs))
+            # ensure_sync runs an async def view on an event loop, as Flask does for undecorated ones
+            response = make_response(app.ensure_sync(f)(*args, **kwargs))
         
         # Add CORS headers to every response
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Trace-Id, Idempotency-Key, X-Debug-Token'
+        response.headers['Access-Control-Expose-Headers'] = 'X-Trace-Id, Retry-After, Idempotent-Replayed'
         response.headers['Access-Control-Max-Age'] = '3600'
         
         return response
     return decorated_function
 
+def _rejected(rejection):
+    metrics.ADMISSION_REJECTED.inc(rejection.rule)
+    logger.warning("%s rejected: %s", request.path, rejection, extra={'client_ip': client_ip(request)})
+    if rejection.status == 503:
+        body = {'error': 'Server busy, please retry', 'retry_after': rejection.retry_after}
+    else:
+        body = {'error': 'Too many requests', 'retry_after': rejection.retry_after}
+    response = jsonify(body)
+    response.headers['Retry-After'] = str(rejection.retry_after)
+    return response, rejection.status
+
+def _request_session_id():
+    if request.method == 'GET':
+        return request.args.get('session_id')
+    if request.mimetype == 'multipart/form-data':
+        return request.form.get('session_id')
+    return (request.get_json(silent=True) or {}).get('session_id', 'default_session')
+
+def _request_fingerprint():
+    """Hash of method, path and body; uploads hash their fields and file contents, as the multipart boundary changes on a retry"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    if request.mimetype == 'multipart/form-data':
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f"{name}={value}\n".encode())
+        for name, upload in request.files.items(multi=True):
+            digest.update(f"{name}:{upload.filename}\n".encode())
+            for chunk in iter(lambda: upload.stream.read(1024 * 1024), b''):
+                digest.update(chunk)
+            upload.stream.seek(0)
+    else:
+        body = request.get_json(silent=True)
+        digest.update(request.get_data() if body is None else json.dumps(body, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def admit(route, starts_session=False):
+    """
+    Admission control for an expensive endpoint: charges the route's per-IP and
+    per-session buckets and counts the request in flight. While overloaded, requests that
+    would start a conversation are shed so sessions already under way keep going.
+    Goes under @add_cors_headers so preflights are not charged and refusals carry CORS headers.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            session_id = _request_session_id()
+            try:
+                admission.check(f'{route}.ip', client_ip(request))
+                admission.check(f'{route}.session', session_id)
+                new_session = starts_session or (admission.overloaded() and session_id not in sessions)
+                admission.enter(new_session)
+            except Rejected as rejection:
+                return _rejected(rejection)
+            streaming = False
+            try:
+                response = app.ensure_sync(f)(*args, **kwargs)
+                # A streamed body is produced after the view returns: in flight until it is closed
+                streaming = isinstance(response, Response) and response.is_streamed
+                if streaming:
+                    response.call_on_close(admission.leave)
+                return response
+            finally:
+                if not streaming:
+                    admission.leave()
+        return decorated_function
+    return decorator
+
+def idempotent(f):
+    """
+    Replay the stored response for a repeated Idempotency-Key instead of running the turn
+    again; a duplicate arriving while the first is running waits for its response, and a
+    key reused with a different body gets 422.
+    Goes above @admit so a retry of a completed request is not charged or shed.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return app.ensure_sync(f)(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key longer than {MAX_KEY_LENGTH} characters'}), 400
+        session_id = _request_session_id()
+        # A key reused on another endpoint must not replay this one's response
+        key = f"{request.path} {key}"
+        try:
+            stored = idempotency.claim(session_id, key, _request_fingerprint())
+        except InProgress:
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        except KeyReused:
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if stored is not None:
+            logger.info("%s replayed", request.path, extra={'session_id': session_id})
+            response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        completed = False
+        try:
+            response = make_response(app.ensure_sync(f)(*args, **kwargs))
+            if 200 <= response.status_code < 300:
+                idempotency.complete(session_id, key, StoredResponse(
+                    response.status_code, response.get_data(), response.content_type))
+                completed = True
+            return response
+        finally:
+            if not completed:
+                idempotency.release(session_id, key)
+    return decorated_function
+
+def _admit_turn(master):
+    """429 response when this turn can run underwriting and the client is over its budget, else None"""
+    if master.conversation_state['stage'] not in UNDERWRITING_STAGES:
+        return None
+    try:
+        admission.check('underwriting.ip', client_ip(request))
+    except Rejected as rejection:
+        return _rejected(rejection)
+    return None
+
+# Set by the upload routes from the stored file only; from a client they would name any
+# path on the server or another customer's upload
+UPLOAD_CONTEXT_KEYS = ('file_uploaded', 'file_name', 'file_path', 'content_hash')
+
+def _client_context(data):
+    """The context a chat request sent, without the keys only an upload sets"""
+    context = data.get('context')
+    if not isinstance(context, dict):
+        return {}
+    return {key: value for key, value in context.items() if key not in UPLOAD_CONTEXT_KEYS}
+
 @app.route('/api/health', methods=['GET', 'OPTIONS'])
+@app.route('/api/health/live', methods=['GET', 'OPTIONS'])
 @add_cors_headers
 def health_check():
-    """Health check endpoint"""
+    """Liveness: the process is up and answering"""
     return jsonify({'status': 'healthy', 'message': 'BFSI Loan Chatbot API is running'})
 
+@app.route('/api/health/ready', methods=['GET', 'OPTIONS'])
+@add_cors_headers
+def readiness_check():
+    """Readiness: latest dependency probe report; 503 while starting or when a critical dependency is down"""
+    report = health.get_monitor(sessions).report()
+    return jsonify(report), 503 if report['status'] in (health.DOWN, health.STARTING) else 200
+
 @app.route('/api/chat/start', methods=['POST', 'OPTIONS'])
 @add_cors_headers
+@idempotent
+@admit('chat', starts_session=True)
 def start_chat():
     """Initialize a new chat session"""
     try:
         session_id = request.json.get('session_id', 'default_session')
         
-        master = MasterAgent()
-        active_sessions[session_id] = master
-        
+        master = MasterAgent(session_id=session_id)
         response = master.process_message('start', None)
+        sessions.save(master)
         
         return jsonify({
             'session_id': session_id,
@@ -53,145 +278,204 @@ def start_chat():
             'action': response.get('action')
         })
     except Exception as e:
-        print(f"[API /chat/start] ERROR: {e}")
-        traceback.print_exc()
+        logger.exception("/chat/start failed")
         return jsonify({'error': str(e)}), 500
 
+def _chat_api_response(session_id, response):
+    """v1 payload for one agent turn"""
+    return {
+        'session_id': session_id,
+        'response': response['response'],
+        'stage': response['stage'],
+        'action': response.get('action'),
+        'pdf_available': response.get('pdf_available', False),
+        'pdf_path': response.get('pdf_path'),
+        'sanction_result': response.get('sanction_result'),
+        'data': {
+            'customer_data': response.get('customer_data'),
+            'loan_terms': response.get('loan_terms'),
+            'suggestions': response.get('suggestions'),
+            'credit_info': response.get('credit_info'),
+            'pdf_available': response.get('pdf_available', False),
+            'pdf_path': response.get('pdf_path'),
+            'sanction_result': response.get('sanction_result'),
+            'loan_amount': response.get('loan_amount'),
+            'rejection_reason': response.get('rejection_reason'),
+        }
+    }
+
 @app.route('/api/chat/message', methods=['POST', 'OPTIONS'])
 @add_cors_headers
+@idempotent
+@admit('chat')
 def send_message():
     """Process user message"""
     try:
         data = request.json
         session_id = data.get('session_id', 'default_session')
         user_message = data.get('message', '')
-        context = data.get('context', {})
-        
-        print(f"\n[API /chat/message] Session: {session_id}")
-        print(f"[API /chat/message] Message: {user_message}")
+        context = _client_context(data)
         
-        if session_id not in active_sessions:
-            active_sessions[session_id] = MasterAgent()
+        logger.debug("/chat/message received", extra={'session_id': session_id, 'user_message': user_message})
         
-        master = active_sessions[session_id]
+        master = sessions.get(session_id) or MasterAgent(session_id=session_id)
+        rejected = _admit_turn(master)
+        if rejected:
+            return rejected
         response = master.process_message(user_message, context)
+        sessions.save(master)
         
-        api_response = {
-            'session_id': session_id,
-            'response': response['response'],
-            'stage': response['stage'],
-            'action': response.get('action'),
-            'pdf_available': response.get('pdf_available', False),
-            'pdf_path': response.get('pdf_path'),
-            'sanction_result': response.get('sanction_result'),
-            'data': {
-                'customer_data': response.get('customer_data'),
-                'loan_terms': response.get('loan_terms'),
-                'suggestions': response.get('suggestions'),
-                'credit_info': response.get('credit_info'),
-                'pdf_available': response.get('pdf_available', False),
-                'pdf_path': response.get('pdf_path'),
-                'sanction_result': response.get('sanction_result'),
-                'loan_amount': response.get('loan_amount'),
-                'rejection_reason': response.get('rejection_reason'),
-            }
-        }
+        api_response = _chat_api_response(session_id, response)
         
-        print(f"[API /chat/message] Response action: {api_response['action']}")
-        print(f"[API /chat/message] Response stage: {api_response['stage']}")
+        logger.info("/chat/message handled", extra={
+            'session_id': session_id, 'action': api_response['action'], 'stage': api_response['stage']
+        })
         
         return jsonify(api_response)
         
     except Exception as e:
-        print(f"[API /chat/message] ERROR: {e}")
-        traceback.print_exc()
+        logger.exception("/chat/message failed")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['GET', 'POST', 'OPTIONS'])
+@add_cors_headers
+@admit('chat')
+def stream_message():
+    """
+    Process user message, streaming agent progress as Server-Sent Events
+    POST takes the /chat/message body; GET takes session_id and message query
+    parameters so the browser's EventSource can be used directly
+    """
+    if request.method == 'GET':
+        data = request.args
+        context = {}
+    else:
+        data = request.json or {}
+        context = _client_context(data)
+    session_id = data.get('session_id', 'default_session')
+    user_message = data.get('message', '')
+    
+    master = sessions.get(session_id) or MasterAgent(session_id=session_id)
+    rejected = _admit_turn(master)
+    if rejected:
+        return rejected
+    
+    def turn(progress):
+        response = master.process_message(user_message, context, progress=progress)
+        sessions.save(master)
+        logger.info("/chat/stream handled", extra={
+            'session_id': session_id, 'action': response.get('action'), 'stage': response['stage']
+        })
+        return _chat_api_response(session_id, response)
+    
+    try:
+        events = stream_job(turn, accepted={'session_id': session_id})
+    except PoolSaturated:
+        logger.warning("/chat/stream rejected: pool saturated", extra={'session_id': session_id})
+        return jsonify({'error': 'Server busy, please retry'}), 503
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def _receive_upload(route):
+    """
+    Validate an uploaded salary slip, check its session and store it
+    Returns (master, upload, None) or (None, None, error_response)
+    """
+    session_id = request.form.get('session_id')
+    logger.debug("%s received", route, extra={
+        'session_id': session_id, 'content_type': request.content_type,
+        'form_keys': list(request.form.keys()), 'file_keys': list(request.files.keys())
+    })
+    
+    if not session_id:
+        logger.warning("%s rejected: no session_id", route)
+        return None, None, (jsonify({'error': 'No session_id provided'}), 400)
+    
+    if 'file' not in request.files:
+        logger.warning("%s rejected: no file", route, extra={'session_id': session_id})
+        return None, None, (jsonify({'error': 'No file provided'}), 400)
+    
+    file = request.files['file']
+    if file.filename == '':
+        logger.warning("%s rejected: empty filename", route, extra={'session_id': session_id})
+        return None, None, (jsonify({'error': 'Empty filename'}), 400)
+    
+    # Validate file type
+    allowed_extensions = {'.pdf', '.jpg', '.jpeg', '.png'}
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    if file_ext not in allowed_extensions:
+        logger.warning("%s rejected: invalid file type", route, extra={'session_id': session_id, 'file_ext': file_ext})
+        return None, None, (jsonify({'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'}), 400)
+    
+    # Check the session before storing anything
+    master = sessions.get(session_id)
+    if master is None:
+        logger.warning("%s rejected: session not found", route, extra={'session_id': session_id})
+        return None, None, (jsonify({'error': 'Session not found. Please start a new chat.'}), 404)
+    rejected = _admit_turn(master)
+    if rejected:
+        return None, None, rejected
+    
+    # Stream to disk in chunks, hashing as we go; identical files are stored once
+    filename = file.filename
+    try:
+        record, deduplicated = get_store('uploads').put_stream(
+            file.stream, extension=file_ext, session_id=session_id,
+            name=filename, max_bytes=MAX_UPLOAD_BYTES
+        )
+    except FileTooLarge as e:
+        logger.warning("%s rejected: %s", route, e, extra={'session_id': session_id})
+        return None, None, (jsonify({'error': str(e)}), 413)
+    
+    content_hash = record['content_hash']
+    
+    # Downscale/grayscale image slips in the background; extraction picks up the copy
+    schedule_normalization(record)
+    logger.info("%s stored", route, extra={
+        'session_id': session_id, 'file_name': filename, 'size': record['size'],
+        'content_hash': content_hash[:12], 'deduplicated': deduplicated
+    })
+    
+    upload = {
+        'session_id': session_id,
+        'filename': filename,
+        'content_hash': content_hash,
+        'deduplicated': deduplicated,
+        # Context for the master agent
+        'context': {
+            'file_uploaded': True,
+            'file_name': filename,
+            'file_path': record['path'],
+            'content_hash': content_hash
+        }
+    }
+    return master, upload, None
+
 @app.route('/api/chat/upload', methods=['POST', 'OPTIONS'])
 @add_cors_headers
+@idempotent
+@admit('upload')
 def upload_document():
     """Handle document upload (salary slip)"""
     try:
-        print("\n" + "="*60)
-        print("[API /chat/upload] ===== UPLOAD REQUEST RECEIVED =====")
-        print("="*60)
-        
-        # Print request info
-        print(f"[API /chat/upload] Request method: {request.method}")
-        print(f"[API /chat/upload] Content type: {request.content_type}")
-        print(f"[API /chat/upload] Form keys: {list(request.form.keys())}")
-        print(f"[API /chat/upload] Files keys: {list(request.files.keys())}")
-        
-        session_id = request.form.get('session_id')
-        print(f"[API /chat/upload] Session ID: {session_id}")
-        
-        if not session_id:
-            print("[API /chat/upload] ERROR: No session_id provided")
-            return jsonify({'error': 'No session_id provided'}), 400
-        
-        if 'file' not in request.files:
-            print("[API /chat/upload] ERROR: No file in request")
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        print(f"[API /chat/upload] File: {file.filename}")
-        
-        if file.filename == '':
-            print("[API /chat/upload] ERROR: Empty filename")
-            return jsonify({'error': 'Empty filename'}), 400
-        
-        # Validate file type
-        allowed_extensions = {'.pdf', '.jpg', '.jpeg', '.png'}
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            print(f"[API /chat/upload] ERROR: Invalid file type: {file_ext}")
-            return jsonify({'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'}), 400
-        
-        # Save file
-        upload_folder = 'uploads'
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        filename = f"{session_id}_{file.filename}"
-        filepath = os.path.join(upload_folder, filename)
-        
-        print(f"[API /chat/upload] Saving to: {filepath}")
-        file.save(filepath)
-        
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            print(f"[API /chat/upload] ✅ Saved! Size: {file_size} bytes")
-        else:
-            print(f"[API /chat/upload] ❌ File NOT saved!")
-            return jsonify({'error': 'Failed to save file'}), 500
+        master, upload, error = _receive_upload('/chat/upload')
+        if error:
+            return error
         
-        # Get master agent
-        if session_id not in active_sessions:
-            print(f"[API /chat/upload] ERROR: Session not found")
-            return jsonify({'error': 'Session not found. Please start a new chat.'}), 404
-        
-        master = active_sessions[session_id]
-        
-        # Process with context
-        context = {
-            'file_uploaded': True,
-            'file_name': filename,
-            'file_path': filepath
-        }
+        session_id = upload['session_id']
+        filename = upload['filename']
+        content_hash = upload['content_hash']
+        deduplicated = upload['deduplicated']
+        context = upload['context']
         
-        print(f"[API /chat/upload] Processing...")
         response = master.process_message('', context)
-        
-        print(f"\n[API /chat/upload] ===== MASTER RESPONSE =====")
-        print(f"[API /chat/upload] Action: {response.get('action')}")
-        print(f"[API /chat/upload] Stage: {response.get('stage')}")
-        print(f"[API /chat/upload] PDF Available: {response.get('pdf_available')}")
-        print(f"[API /chat/upload] PDF Path: {response.get('pdf_path')}")
-        print(f"[API /chat/upload] ===========================\n")
+        sessions.save(master)
         
         api_response = {
             'session_id': session_id,
             'file_uploaded': True,
             'filename': filename,
+            'content_hash': content_hash,
+            'deduplicated': deduplicated,
             'response': response['response'],
             'stage': response['stage'],
             'action': response.get('action'),
@@ -208,14 +492,17 @@ def upload_document():
             }
         }
         
-        print(f"[API /chat/upload] Returning response with action: {api_response['action']}")
+        logger.info("/chat/upload handled", extra={
+            'session_id': session_id, 'action': api_response['action'], 'stage': api_response['stage'],
+            'pdf_available': api_response['pdf_available']
+        })
         
         return jsonify(api_response)
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        print(f"\n[API /chat/upload] ❌ ERROR: {e}")
-        print(f"[API /chat/upload] Type: {type(e).__name__}")
-        traceback.print_exc()
+        logger.exception("/chat/upload failed")
         return jsonify({'error': str(e), 'type': type(e).__name__}), 500
 
 @app.route('/api/download/<path:filename>', methods=['GET', 'OPTIONS'])
@@ -223,32 +510,77 @@ def upload_document():
 def download_file(filename):
     """Download generated sanction letter"""
     try:
-        print(f"\n[API /download] Requested: {filename}")
+        # Only ever serve letters by name, never an arbitrary path
+        name = os.path.basename(filename)
+        record = get_store('letters').find_by_name(name)
         
-        if filename.startswith('generated_letters'):
-            filepath = filename
+        if record:
+            filepath = record['path']
         else:
-            filepath = os.path.join('generated_letters', filename)
+            # Letters written before the sharded layout still sit flat in the folder
+            filepath = os.path.join(get_store('letters').root, name)
         
         abs_filepath = os.path.abspath(filepath)
-        print(f"[API /download] Looking for: {abs_filepath}")
-        
         if not os.path.exists(abs_filepath):
-            print(f"[API /download] ❌ File not found!")
+            logger.warning("/download not found", extra={'file_name': name})
             return jsonify({'error': 'File not found'}), 404
         
-        print(f"[API /download] ✅ Sending file")
+        logger.info("/download sending", extra={'file_name': name})
         
         return send_file(
             abs_filepath,
             as_attachment=True,
-            download_name=os.path.basename(filename),
+            download_name=name,
             mimetype='application/pdf'
         )
         
     except Exception as e:
-        print(f"[API /download] ❌ Error: {e}")
-        traceback.print_exc()
+        logger.exception("/download failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sanction/batch', methods=['POST', 'OPTIONS'])
+@add_cors_headers
+@admit('batch')
+def batch_sanction():
+    """Generate sanction letters for a batch of approved applications as a streamed ZIP; needs the X-Debug-Token header"""
+    if not profiling.authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not authorized'}), 403
+    try:
+        data = request.json or {}
+        applications = data.get('applications')
+        
+        if not isinstance(applications, list) or not applications:
+            return jsonify({'error': 'applications must be a non-empty list'}), 400
+        
+        max_batch = int(os.environ.get('MAX_BATCH_SIZE', 10000))
+        if len(applications) > max_batch:
+            return jsonify({'error': f'Batch too large. Maximum is {max_batch} applications'}), 400
+        
+        workers = data.get('workers')
+        if workers is not None:
+            try:
+                workers = int(workers)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'workers must be a positive integer'}), 400
+            if workers < 1:
+                return jsonify({'error': 'workers must be a positive integer'}), 400
+            workers = min(workers, os.cpu_count() or 1)
+        
+        logger.info("/sanction/batch generating %d letters", len(applications))
+        
+        def report_progress(done, total, failed):
+            if done == total or done % 100 == 0:
+                logger.info("/sanction/batch progress %d/%d (%d failed)", done, total, failed)
+        
+        response = Response(
+            stream_with_context(stream_sanction_zip(applications, workers, report_progress)),
+            mimetype='application/zip'
+        )
+        response.headers['Content-Disposition'] = 'attachment; filename=sanction_letters.zip'
+        return response
+        
+    except Exception as e:
+        logger.exception("/sanction/batch failed")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/chat/reset', methods=['POST', 'OPTIONS'])
@@ -258,18 +590,134 @@ def reset_chat():
     try:
         session_id = request.json.get('session_id', 'default_session')
         
-        if session_id in active_sessions:
-            active_sessions[session_id].reset_conversation()
+        master = sessions.get(session_id)
+        if master is not None:
+            master.reset_conversation()
+            sessions.save(master)
         
         return jsonify({
             'session_id': session_id,
             'message': 'Conversation reset successfully'
         })
     except Exception as e:
-        print(f"[API /chat/reset] ERROR: {e}")
-        traceback.print_exc()
+        logger.exception("/chat/reset failed")
         return jsonify({'error': str(e)}), 500
 
+# ---- v2 chat API: each field once, deltas since the client's version ----
+
+def _v2_json(payload, status=200):
+    # Serialized with orjson when available (see utils/json_codec.py)
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+@app.route('/api/v2/chat/start', methods=['POST', 'OPTIONS'])
+@add_cors_headers
+@idempotent
+@admit('chat', starts_session=True)
+def start_chat_v2():
+    """Initialize a new chat session; the response carries the full view"""
+    try:
+        session_id = (request.json or {}).get('session_id', 'default_session')
+        
+        master = MasterAgent(session_id=session_id)
+        response = master.process_message('start', None)
+        payload = build_response(session_id, master.conversation_state, response)
+        sessions.save(master)
+        
+        return _v2_json(payload)
+    except Exception as e:
+        logger.exception("/v2/chat/start failed")
+        return _v2_json({'error': str(e)}, 500)
+
+@app.route('/api/v2/chat/message', methods=['POST', 'OPTIONS'])
+@add_cors_headers
+@idempotent
+@admit('chat')
+async def send_message_v2():
+    """
+    Process a user message; returns only the fields changed since known_version
+    Runs process_message_async: the credit pull, salary extraction and letter writing are awaited
+    """
+    try:
+        data = request.json or {}
+        session_id = data.get('session_id', 'default_session')
+        
+        master = sessions.get(session_id) or MasterAgent(session_id=session_id)
+        rejected = _admit_turn(master)
+        if rejected:
+            return rejected
+        response = await master.process_message_async(data.get('message', ''), _client_context(data))
+        payload = build_response(session_id, master.conversation_state, response, data.get('known_version'))
+        sessions.save(master)
+        
+        logger.info("/v2/chat/message handled", extra={
+            'session_id': session_id, 'action': payload['action'], 'version': payload['version']
+        })
+        return _v2_json(payload)
+    except Exception as e:
+        logger.exception("/v2/chat/message failed")
+        return _v2_json({'error': str(e)}, 500)
+
+@app.route('/api/v2/chat/upload', methods=['POST', 'OPTIONS'])
+@add_cors_headers
+@idempotent
+@admit('upload')
+async def upload_document_v2():
+    """Handle a salary slip upload; form fields session_id, file and known_version"""
+    try:
+        master, upload, error = _receive_upload('/v2/chat/upload')
+        if error:
+            return error
+        
+        session_id = upload['session_id']
+        response = await master.process_message_async('', upload['context'])
+        payload = build_response(
+            session_id, master.conversation_state, response, request.form.get('known_version'),
+            file={'filename': upload['filename'], 'content_hash': upload['content_hash'],
+                  'deduplicated': upload['deduplicated']}
+        )
+        sessions.save(master)
+        
+        return _v2_json(payload)
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        logger.exception("/v2/chat/upload failed")
+        return _v2_json({'error': str(e), 'type': type(e).__name__}, 500)
+
+@app.route('/api/v2/chat/state', methods=['GET', 'OPTIONS'])
+@add_cors_headers
+def chat_state_v2():
+    """Resync: fields changed since known_version (everything when it is unknown)"""
+    try:
+        session_id = request.args.get('session_id', 'default_session')
+        master = sessions.get(session_id)
+        if master is None:
+            return _v2_json({'error': 'Session not found. Please start a new chat.'}, 404)
+        
+        payload = state_response(session_id, master.conversation_state, request.args.get('known_version'))
+        sessions.save(master)
+        return _v2_json(payload)
+    except Exception as e:
+        logger.exception("/v2/chat/state failed")
+        return _v2_json({'error': str(e)}, 500)
+
+@app.route('/api/v2/static/<ref>', methods=['GET', 'OPTIONS'])
+@add_cors_headers
+def static_block_v2(ref):
+    """Static blocks (terms, documents) by content-addressed reference; cacheable forever"""
+    body = static_block(ref)
+    if body is None:
+        return _v2_json({'error': 'Unknown reference'}, 404)
+    
+    etag = f'"{ref}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 @app.route('/api/customers', methods=['GET', 'OPTIONS'])
 @add_cors_headers
 def get_test_customers():
@@ -288,53 +736,98 @@ def get_test_customers():
         
         return jsonify({'customers': test_customers})
     except Exception as e:
-        print(f"[API /customers] ERROR: {e}")
-        traceback.print_exc()
+        logger.exception("/customers failed")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/debug/pdf-status', methods=['GET', 'OPTIONS'])
 @add_cors_headers
 def pdf_status():
-    """Debug: Check PDF generation status"""
+    """Debug: Check PDF generation status (read from the storage index)"""
     try:
-        pdf_dir = 'generated_letters'
-        
-        if not os.path.exists(pdf_dir):
-            return jsonify({
-                'exists': False,
-                'message': 'Directory does not exist'
-            })
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset not negative'}), 400
+    limit = min(limit, MAX_PDF_STATUS_LIMIT)
+    try:
+        letters = get_store('letters')
         
-        files = os.listdir(pdf_dir)
-        
-        file_details = []
-        for f in files:
-            fpath = os.path.join(pdf_dir, f)
-            file_details.append({
-                'name': f,
-                'size': os.path.getsize(fpath)
-            })
+        stats = letters.stats()
+        files = letters.list(limit=limit, offset=offset)
         
         return jsonify({
             'exists': True,
-            'count': len(files),
-            'files': file_details
+            'count': stats['count'],
+            'total_bytes': stats['total_bytes'],
+            'files': [{'name': f['name'], 'size': f['size'], 'created_at': f['created_at']} for f in files]
         })
     except Exception as e:
-        print(f"[API /debug/pdf-status] ERROR: {e}")
-        traceback.print_exc()
+        logger.exception("/debug/pdf-status failed")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/debug/trace/<session_id>', methods=['GET', 'OPTIONS'])
+@add_cors_headers
+def session_traces(session_id):
+    """Debug: recent request traces of a session (this worker's ring buffer), newest first; needs the X-Debug-Token header"""
+    if not profiling.authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not authorized'}), 403
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    limit = min(limit, MAX_TRACE_LIMIT)
+    traces = tracing.traces_for_session(session_id, limit)
+    if not traces:
+        return jsonify({'error': 'No traces for this session', 'session_id': session_id}), 404
+    return jsonify({'session_id': session_id, 'traces': traces})
+
+@app.route('/api/debug/profile/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Debug: download a per-request profile; needs the X-Debug-Token header"""
+    if not profiling.authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not authorized'}), 403
+    path = profiling.profile_path(profile_id)
+    if not path or not os.path.exists(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@app.route('/api/storage/stats', methods=['GET', 'OPTIONS'])
+@add_cors_headers
+def storage_stats():
+    """Per-store file counts and sizes from the storage index, plus normalization savings"""
+    try:
+        stats = {kind: get_store(kind).stats() for kind in ('letters', 'uploads')}
+        stats['normalization'] = normalization_stats()
+        stats['pools'] = [pool.stats() for pool in all_pools()]
+        return jsonify(stats)
+    except Exception as e:
+        logger.exception("/storage/stats failed")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage, agent-call and request latencies, outcome counters, gauges"""
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(error):
     response = jsonify({'error': 'Not found'})
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response, 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    response = jsonify({'error': f'File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'})
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response, 413
+
 @app.errorhandler(500)
 def internal_error(error):
-    print(f"[API] Internal Server Error: {error}")
-    traceback.print_exc()
+    logger.error("Internal server error: %s", error, exc_info=getattr(error, 'original_exception', None))
     response = jsonify({'error': 'Internal server error'})
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response, 500
@@ -362,5 +855,7 @@ if __name__ == '__main__':
     print("✅ Manual CORS enabled")
     print("="*60 + "\n")
     
+    health.get_monitor(sessions)
+    
     # Disable debug in production
     app.run(debug=not is_production, port=port, threaded=True, host=host)
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+Response size per turn: v1 vs v2 chat API
+Plays the same scripted conversations against both APIs through the Flask test
+client and reports response bytes per turn. The v2 client sends its known version
+and fetches each static block (terms, documents) once, as a browser cache would.
+
+Usage (from the backend directory):
+    python -m benchmarks.api_payload
+"""
+import argparse
+import json
+import os
+import tempfile
+
+# Scripted conversations: (phone, turns); a turn is a message or ('upload', salary)
+CONVERSATIONS = {
+    'instant_approval': ('9876543210', ['300000', '36', 'yes']),
+    'salary_slip': ('9123456789', ['8 lakh', '60', 'yes', ('upload', 150000)]),
+    'rejected_exceeds_limit': ('7890123456', ['15 lakh', '48', 'yes']),
+    'rejected_credit_score': ('8765432109', ['100000', '24', 'yes']),
+    'tenure_retry': ('9876543210', ['2 lakh', '7 months', '2 years', 'no']),
+}
+
+def _slip_pdf(salary):
+    import random
+    from benchmarks.salary_extraction import _pdf_slip
+    return _pdf_slip(random.Random(salary), salary, int(salary * 1.2))
+
+def _upload(client, path, session_id, salary, known_version=None):
+    import io
+    data = {'session_id': session_id, 'file': (io.BytesIO(_slip_pdf(salary)), 'salary_slip.pdf')}
+    if known_version:
+        data['known_version'] = known_version
+    return client.post(path, data=data, content_type='multipart/form-data')
+
+def run_v1(client, name, phone, turns):
+    session_id = f"v1_{name}"
+    sizes = [len(client.post('/api/chat/start', json={'session_id': session_id}).data)]
+    for turn in [phone] + turns:
+        if isinstance(turn, tuple):
+            response = _upload(client, '/api/chat/upload', session_id, turn[1])
+        else:
+            response = client.post('/api/chat/message', json={'session_id': session_id, 'message': turn})
+        sizes.append(len(response.data))
+    return sizes, 0, response.get_json()['action']
+
+def run_v2(client, name, phone, turns, static_cache):
+    session_id = f"v2_{name}"
+    response = client.post('/api/v2/chat/start', json={'session_id': session_id})
+    sizes = [len(response.data)]
+    version = response.get_json()['version']
+    static_bytes = 0
+    for turn in [phone] + turns:
+        if isinstance(turn, tuple):
+            response = _upload(client, '/api/v2/chat/upload', session_id, turn[1], version)
+        else:
+            response = client.post('/api/v2/chat/message',
+                                   json={'session_id': session_id, 'message': turn, 'known_version': version})
+        sizes.append(len(response.data))
+        payload = response.get_json()
+        version = payload['version']
+        details = (payload['changes'].get('sanction') or {}).get('details') or {}
+        for key in ('terms_ref', 'documents_ref'):
+            ref = details.get(key)
+            if ref and ref not in static_cache:
+                static_cache[ref] = client.get(f'/api/v2/static/{ref}').data
+                static_bytes += len(static_cache[ref])
+    return sizes, static_bytes, payload['action']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bytes per turn for the v1 and v2 chat APIs")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for key, name in (('STORAGE_INDEX_PATH', 'index.sqlite3'), ('LETTERS_DIR', 'letters'),
+                          ('UPLOADS_DIR', 'uploads'), ('SESSION_DB_PATH', 'sessions.sqlite3')):
+            os.environ[key] = os.path.join(scratch, name)
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        from app import app
+        from utils.json_codec import encoder_name
+
+        client = app.test_client()
+        static_cache = {}
+        report = {'encoder': encoder_name(), 'conversations': {}}
+        totals = {'v1': 0, 'v2': 0, 'turns': 0}
+        for name, (phone, turns) in CONVERSATIONS.items():
+            v1_sizes, _, v1_action = run_v1(client, name, phone, turns)
+            v2_sizes, static_bytes, v2_action = run_v2(client, name, phone, turns, static_cache)
+            assert v1_action == v2_action, (name, v1_action, v2_action)
+            report['conversations'][name] = {
+                'final_action': v1_action,
+                'v1_bytes_per_turn': v1_sizes,
+                'v2_bytes_per_turn': v2_sizes,
+                'v2_static_bytes_fetched': static_bytes,
+            }
+            totals['v1'] += sum(v1_sizes)
+            totals['v2'] += sum(v2_sizes) + static_bytes
+            totals['turns'] += len(v1_sizes)
+
+    report['total'] = {
+        'turns': totals['turns'],
+        'v1_bytes': totals['v1'],
+        'v2_bytes': totals['v2'],
+        'v1_avg_per_turn': round(totals['v1'] / totals['turns']),
+        'v2_avg_per_turn': round(totals['v2'] / totals['turns']),
+        'reduction': round(1 - totals['v2'] / totals['v1'], 3),
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"encoder: {report['encoder']}")
+    print(f"{'conversation':<24} {'turn':>4} {'v1 bytes':>9} {'v2 bytes':>9}")
+    for name, entry in report['conversations'].items():
+        for turn, (v1, v2) in enumerate(zip(entry['v1_bytes_per_turn'], entry['v2_bytes_per_turn'])):
+            print(f"{name if turn == 0 else '':<24} {turn:>4} {v1:>9} {v2:>9}")
+        if entry['v2_static_bytes_fetched']:
+            print(f"{'':<24} {'ref':>4} {'':>9} {entry['v2_static_bytes_fetched']:>9}  (static blocks, fetched once)")
+    total = report['total']
+    print(f"\n{total['turns']} turns: v1 {total['v1_bytes']} bytes (avg {total['v1_avg_per_turn']}), "
+          f"v2 {total['v2_bytes']} bytes (avg {total['v2_avg_per_turn']}), {total['reduction']:.1%} smaller")
+
+if __name__ == '__main__':
+    main()
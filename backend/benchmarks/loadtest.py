@@ -0,0 +1,440 @@
+"""
+End-to-end conversation load test
+Drives complete synthetic conversations (start -> phone -> amount -> tenure -> yes ->
+optional salary-slip upload -> letter download) with concurrent clients, in-process
+through the Flask test client or over HTTP, and reports p50/p95/p99 latency per
+endpoint and per conversation step plus sustained sessions/sec. --transport asyncio
+plays them on MasterAgent.process_message_async, every client a task on one event
+loop, and reports how many underwriting turns were in flight at once against the
+number of threads the process used. Personas come from
+data/customers.py; the outcome mix decides which persona and amount each session uses.
+
+Usage (from the backend directory):
+    python -m benchmarks.loadtest                                     # in-process, default mix
+    python -m benchmarks.loadtest --sessions 500 --clients 32 --mix approve=0.5,reject=0.3,slip=0.2
+    python -m benchmarks.loadtest --transport http --server gunicorn  # spawn a server
+    python -m benchmarks.loadtest --transport http --url http://127.0.0.1:5002
+    python -m benchmarks.loadtest --transport asyncio --sessions 1000 --clients 500
+    python -m benchmarks.loadtest --json > baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from data.customers import CUSTOMER_DATABASE
+
+DEFAULT_MIX = {'approve': 0.6, 'reject': 0.2, 'slip': 0.2}
+TENURES = [12, 24, 36, 48, 60]
+
+# The mock bureau varies scores by up to 5 points either way
+SCORE_MARGIN = 5
+MIN_CREDIT_SCORE = 700
+
+def _eligible(customer):
+    return customer['credit_score'] - SCORE_MARGIN >= MIN_CREDIT_SCORE
+
+def plan_conversation(outcome, rng):
+    """Persona, messages and expected final action for one synthetic session"""
+    customers = list(CUSTOMER_DATABASE.items())
+    if outcome == 'reject':
+        low_score = [(p, c) for p, c in customers if c['credit_score'] + SCORE_MARGIN < MIN_CREDIT_SCORE]
+        if low_score and rng.random() < 0.5:
+            phone, customer = rng.choice(low_score)
+            amount = rng.randint(5, 15) * 10000
+        else:
+            phone, customer = rng.choice([(p, c) for p, c in customers if 2.2 * c['pre_approved_limit'] <= 2000000])
+            amount = min(2000000, int(customer['pre_approved_limit'] * rng.uniform(2.2, 3.0)) // 10000 * 10000)
+        return {'outcome': outcome, 'phone': phone, 'amount': amount, 'tenure': rng.choice(TENURES),
+                'upload_salary': None, 'expected_action': 'loan_rejected'}
+
+    phone, customer = rng.choice([(p, c) for p, c in customers if _eligible(c)])
+    limit = customer['pre_approved_limit']
+    if outcome == 'slip':
+        amount = int(limit * rng.uniform(1.1, 1.6)) // 10000 * 10000
+        # Long tenures keep the EMI well under half of the persona's salary
+        return {'outcome': outcome, 'phone': phone, 'amount': amount, 'tenure': rng.choice([48, 60]),
+                'upload_salary': customer['monthly_salary'], 'expected_action': 'loan_approved'}
+    amount = max(50000, int(limit * rng.uniform(0.3, 1.0)) // 10000 * 10000)
+    return {'outcome': outcome, 'phone': phone, 'amount': amount, 'tenure': rng.choice(TENURES),
+            'upload_salary': None, 'expected_action': 'loan_approved'}
+
+_slips = {}
+_slips_lock = threading.Lock()
+
+def _slip_pdf(salary):
+    with _slips_lock:
+        if salary not in _slips:
+            from benchmarks.salary_extraction import _pdf_slip
+            _slips[salary] = _pdf_slip(random.Random(salary), salary, int(salary * 1.2))
+        return _slips[salary]
+
+class InProcessTransport:
+    """Flask test client; measures the app itself without sockets"""
+    name = 'inprocess'
+
+    def __init__(self):
+        from app import app
+        self.client = app.test_client()
+
+    def post_json(self, path, body):
+        response = self.client.post(path, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def upload(self, path, session_id, filename, content):
+        response = self.client.post(path, data={'session_id': session_id, 'file': (io.BytesIO(content), filename)},
+                                    content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True)
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, len(response.data)
+
+class HttpTransport:
+    name = 'http'
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def _send(self, req):
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post_json(self, path, body):
+        req = urllib.request.Request(self.base_url + path, data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        status, data = self._send(req)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    def upload(self, path, session_id, filename, content):
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="session_id"\r\n\r\n{session_id}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'
+        ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+        req = urllib.request.Request(self.base_url + path, data=body,
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        status, data = self._send(req)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, None
+
+    def get(self, path):
+        status, data = self._send(urllib.request.Request(self.base_url + path))
+        return status, len(data)
+
+class Recorder:
+    """Latency samples keyed by endpoint and by conversation step"""
+
+    def __init__(self):
+        self.by_endpoint = {}
+        self.by_step = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, step, seconds, ok):
+        with self._lock:
+            self.by_endpoint.setdefault(endpoint, []).append(seconds)
+            self.by_step.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'p50_ms': round(pick(0.50) * 1000, 2),
+        'p95_ms': round(pick(0.95) * 1000, 2),
+        'p99_ms': round(pick(0.99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+def run_conversation(transport, recorder, plan, session_id):
+    """Play one planned conversation; returns the final action"""
+    def timed(endpoint, step, call):
+        started = time.perf_counter()
+        status, payload = call()
+        ok = 200 <= status < 300
+        recorder.record(endpoint, step, time.perf_counter() - started, ok)
+        if not ok:
+            raise RuntimeError(f"{step}: HTTP {status}")
+        return payload
+
+    message = lambda text: lambda: transport.post_json('/api/chat/message', {'session_id': session_id, 'message': text})
+    timed('/api/chat/start', 'start', lambda: transport.post_json('/api/chat/start', {'session_id': session_id}))
+    timed('/api/chat/message', 'phone', message(plan['phone']))
+    timed('/api/chat/message', 'amount', message(str(plan['amount'])))
+    timed('/api/chat/message', 'tenure', message(f"{plan['tenure']} months"))
+    payload = timed('/api/chat/message', 'confirm', message('yes'))
+
+    if payload.get('action') == 'request_document' and plan['upload_salary']:
+        content = _slip_pdf(plan['upload_salary'])
+        payload = timed('/api/chat/upload', 'upload',
+                        lambda: transport.upload('/api/chat/upload', session_id, 'salary_slip.pdf', content))
+
+    if payload.get('pdf_available') and payload.get('pdf_path'):
+        timed('/api/download/<filename>', 'download', lambda: transport.get(f"/api/download/{payload['pdf_path']}"))
+    return payload.get('action')
+
+def run_load(transport, sessions, clients, mix, seed=0):
+    rng = random.Random(seed)
+    outcomes = list(mix)
+    weights = [mix[o] for o in outcomes]
+    plans = [plan_conversation(rng.choices(outcomes, weights)[0], rng) for _ in range(sessions)]
+    run_id = uuid.uuid4().hex[:8]
+
+    recorder = Recorder()
+    results = {'completed': 0, 'failed': 0, 'unexpected': 0}
+    per_outcome = {o: 0 for o in outcomes}
+    next_index = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                index = next_index[0]
+                if index >= len(plans):
+                    return
+                next_index[0] += 1
+            plan = plans[index]
+            try:
+                action = run_conversation(transport, recorder, plan, f"load_{run_id}_{index}")
+            except Exception:
+                with lock:
+                    results['failed'] += 1
+                continue
+            with lock:
+                results['completed'] += 1
+                per_outcome[plan['outcome']] += 1
+                if action != plan['expected_action']:
+                    results['unexpected'] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'transport': transport.name,
+        'sessions': sessions,
+        'clients': clients,
+        'seed': seed,
+        'mix': mix,
+        'wall_seconds': round(wall, 2),
+        'sessions_per_sec': round(results['completed'] / wall, 2),
+        'requests': sum(len(s) for s in recorder.by_endpoint.values()),
+        'completed': results['completed'],
+        'failed': results['failed'],
+        'unexpected_outcomes': results['unexpected'],
+        'outcomes': per_outcome,
+        'errors_by_step': recorder.errors,
+        'endpoints': {k: _percentiles(v) for k, v in sorted(recorder.by_endpoint.items())},
+        'steps': {k: _percentiles(v) for k, v in recorder.by_step.items()},
+    }
+
+async def _play_async(recorder, plan, session_id, gauge):
+    """run_conversation on process_message_async; the upload is stored the way the app stores it"""
+    from agents.master_agent import MasterAgent
+    from utils.storage import get_store
+    master = MasterAgent(session_id=session_id)
+
+    async def timed(step, message, context=None):
+        # confirm and upload are the turns that run underwriting
+        underwriting = step in ('confirm', 'upload')
+        gauge.enter(underwriting)
+        started = time.perf_counter()
+        ok = False
+        try:
+            payload = await master.process_message_async(message, context)
+            ok = True
+            return payload
+        finally:
+            recorder.record('process_message_async', step, time.perf_counter() - started, ok)
+            gauge.leave(underwriting)
+
+    await timed('start', 'start')
+    await timed('phone', plan['phone'])
+    await timed('amount', str(plan['amount']))
+    await timed('tenure', f"{plan['tenure']} months")
+    payload = await timed('confirm', 'yes')
+
+    if payload.get('action') == 'request_document' and plan['upload_salary']:
+        content = _slip_pdf(plan['upload_salary'])
+        record, _ = await asyncio.to_thread(
+            get_store('uploads').put_stream, io.BytesIO(content), extension='.pdf', session_id=session_id,
+            name='salary_slip.pdf')
+        payload = await timed('upload', '', {'file_uploaded': True, 'file_name': 'salary_slip.pdf',
+                                             'file_path': record['path'], 'content_hash': record['content_hash']})
+    return payload.get('action')
+
+class InFlightGauge:
+    """Peak concurrent underwriting turns, and peak threads in the process, seen by the asyncio clients"""
+
+    def __init__(self):
+        self.underwriting = 0
+        self.peak_underwriting = 0
+        self.peak_threads = threading.active_count()
+
+    def enter(self, underwriting):
+        if underwriting:
+            self.underwriting += 1
+            self.peak_underwriting = max(self.peak_underwriting, self.underwriting)
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def leave(self, underwriting):
+        if underwriting:
+            self.underwriting -= 1
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+def run_load_async(sessions, clients, mix, seed=0):
+    """run_load with each client an asyncio task calling the agents directly (no HTTP layer)"""
+    rng = random.Random(seed)
+    outcomes = list(mix)
+    weights = [mix[o] for o in outcomes]
+    plans = [plan_conversation(rng.choices(outcomes, weights)[0], rng) for _ in range(sessions)]
+    run_id = uuid.uuid4().hex[:8]
+
+    recorder = Recorder()
+    gauge = InFlightGauge()
+    results = {'completed': 0, 'failed': 0, 'unexpected': 0}
+    per_outcome = {o: 0 for o in outcomes}
+    pending = iter(enumerate(plans))
+
+    async def client():
+        for index, plan in pending:
+            try:
+                action = await _play_async(recorder, plan, f"load_{run_id}_{index}", gauge)
+            except Exception:
+                results['failed'] += 1
+                continue
+            results['completed'] += 1
+            per_outcome[plan['outcome']] += 1
+            if action != plan['expected_action']:
+                results['unexpected'] += 1
+
+    async def play():
+        await asyncio.gather(*(client() for _ in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(play())
+    wall = time.perf_counter() - started
+
+    return {
+        'transport': 'asyncio',
+        'sessions': sessions,
+        'clients': clients,
+        'seed': seed,
+        'mix': mix,
+        'wall_seconds': round(wall, 2),
+        'sessions_per_sec': round(results['completed'] / wall, 2),
+        'requests': sum(len(s) for s in recorder.by_endpoint.values()),
+        'completed': results['completed'],
+        'failed': results['failed'],
+        'unexpected_outcomes': results['unexpected'],
+        'outcomes': per_outcome,
+        'errors_by_step': recorder.errors,
+        'peak_in_flight_underwriting': gauge.peak_underwriting,
+        'peak_threads': gauge.peak_threads,
+        'endpoints': {k: _percentiles(v) for k, v in sorted(recorder.by_endpoint.items())},
+        'steps': {k: _percentiles(v) for k, v in recorder.by_step.items()},
+    }
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown outcome {name!r} (use {', '.join(DEFAULT_MIX)})")
+        mix[name.strip()] = float(weight)
+    return mix
+
+def _scratch_env(scratch):
+    for key, name in (('STORAGE_INDEX_PATH', 'index.sqlite3'), ('LETTERS_DIR', 'letters'),
+                      ('UPLOADS_DIR', 'uploads'), ('SESSION_DB_PATH', 'sessions.sqlite3'),
+                      ('RATE_LIMIT_DB_PATH', 'rate_limits.sqlite3'), ('IDEMPOTENCY_DB_PATH', 'idempotency.sqlite3'),
+                      ('EVENT_LOG_DIR', 'event_log')):
+        os.environ[key] = os.path.join(scratch, name)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Every client comes from one address; measure capacity, not the per-IP limits
+    os.environ.setdefault('RATE_LIMITS', 'off')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test with complete synthetic loan conversations")
+    parser.add_argument('--transport', choices=['inprocess', 'http', 'asyncio'], default='inprocess')
+    parser.add_argument('--url', help="Existing server for --transport http")
+    parser.add_argument('--server', default='dev', help="Server to spawn for --transport http without --url")
+    parser.add_argument('--sessions', type=int, default=100, help="Conversations to play")
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent conversations")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="e.g. approve=0.6,reject=0.2,slip=0.2")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        _scratch_env(scratch)
+        process = None
+        if args.transport == 'inprocess':
+            transport = InProcessTransport()
+        elif args.transport == 'asyncio':
+            transport = None  # clients call the agents directly
+        elif args.url:
+            transport = HttpTransport(args.url)
+        else:
+            from benchmarks.serving import SERVERS, BACKEND_DIR, _free_port, _wait_until_ready
+            port = _free_port()
+            env = dict(os.environ, PORT=str(port), HOST='127.0.0.1')
+            process = subprocess.Popen(SERVERS[args.server](port), cwd=BACKEND_DIR, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_until_ready(base_url, process)
+            transport = HttpTransport(base_url)
+        try:
+            if transport is None:
+                report = run_load_async(args.sessions, args.clients, args.mix, args.seed)
+            else:
+                report = run_load(transport, args.sessions, args.clients, args.mix, args.seed)
+        finally:
+            if process:
+                process.terminate()
+                process.wait(timeout=60)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0 if not report['failed'] else 1
+
+    print(f"{report['transport']}: {report['completed']}/{report['sessions']} sessions in {report['wall_seconds']} s "
+          f"with {report['clients']} clients -> {report['sessions_per_sec']} sessions/s "
+          f"({report['failed']} failed, {report['unexpected_outcomes']} unexpected outcomes)")
+    if 'peak_threads' in report:
+        print(f"peak {report['peak_in_flight_underwriting']} underwriting turns in flight "
+              f"on {report['peak_threads']} threads")
+    for title, rows in (('endpoint', report['endpoints']), ('step', report['steps'])):
+        print(f"\n{title:<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, row in rows.items():
+            print(f"{name:<28} {row['count']:>6} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+    return 0 if not report['failed'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Salary extraction corpus benchmark
+Reports accuracy and latency per extraction path (PDF text layer vs image fallback)
+
+Usage (from the backend directory):
+    python -m benchmarks.salary_extraction                   # synthetic corpus
+    python -m benchmarks.salary_extraction --corpus slips/   # slips/manifest.json maps file -> salary
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from agents.underwriting_agent import UnderwritingAgent
+from utils.salary_extractor import extract_salary
+
+NET_LABELS = ['Net Pay', 'Net Salary', 'NET PAY', 'Take Home', 'Net Amount Payable']
+GROSS_LABELS = ['Gross Pay', 'Gross Earnings', 'Total Earnings', 'Gross Salary']
+
+def _indian_format(value):
+    """85000 -> 85,000 and 120000 -> 1,20,000"""
+    text = str(value)
+    if len(text) <= 3:
+        return text
+    head, tail = text[:-3], text[-3:]
+    groups = []
+    while len(head) > 2:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    if head:
+        groups.insert(0, head)
+    return ','.join(groups + [tail])
+
+def _pdf_slip(rng, net, gross):
+    """Render a digital salary slip in one of a few common layouts"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    buffer = io.BytesIO()
+    net_label, gross_label = rng.choice(NET_LABELS), rng.choice(GROSS_LABELS)
+    amount = rng.choice([_indian_format, lambda v: f"{v:,}", lambda v: f"{v}.00"])
+    currency = rng.choice(['', 'Rs. ', 'INR '])
+    layout = rng.randrange(3)
+
+    if layout == 0:
+        c = canvas.Canvas(buffer, pagesize=A4)
+        c.drawString(72, 780, "Payslip for the month of March 2026")
+        c.drawString(72, 740, f"Basic: {currency}{amount(int(gross * 0.5))}")
+        c.drawString(72, 720, f"{gross_label}: {currency}{amount(gross)}")
+        c.drawString(72, 700, f"{net_label}: {currency}{amount(net)}")
+        c.save()
+    else:
+        styles = getSampleStyleSheet()
+        rows = [['Earnings', 'Amount'], ['Basic', amount(int(gross * 0.5))],
+                ['HRA', amount(int(gross * 0.2))], [gross_label, currency + amount(gross)],
+                ['Deductions', amount(gross - net)]]
+        story = [Paragraph("Salary Slip - March 2026", styles['Title']), Spacer(1, 12), Table(rows)]
+        if layout == 1:
+            story.append(Table([[net_label, currency + amount(net)]]))
+        else:
+            # Label and amount on separate lines, as in stacked layouts
+            story.append(Paragraph(net_label, styles['Normal']))
+            story.append(Paragraph(currency + amount(net), styles['Normal']))
+        SimpleDocTemplate(buffer, pagesize=A4).build(story)
+
+    return buffer.getvalue()
+
+def _image_slip(net):
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (1200, 1600), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((100, 100), f"Net Pay: {net:,}", fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def build_synthetic_corpus(directory, pdfs, images, seed):
+    """Write slips plus a manifest of expected salaries; returns the manifest"""
+    rng = random.Random(seed)
+    manifest = {}
+    for i in range(pdfs):
+        net = rng.randrange(25000, 250000, 50)
+        gross = int(net * rng.uniform(1.1, 1.35))
+        name = f"slip_{i:04d}.pdf"
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(_pdf_slip(rng, net, gross))
+        manifest[name] = net
+    for i in range(images):
+        net = rng.randrange(25000, 250000, 50)
+        # The demo image path reads the salary from the file name
+        name = f"photo_{i:03d}_{net}.png"
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(_image_slip(net))
+        manifest[name] = net
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run(corpus_dir, manifest):
+    agent = UnderwritingAgent()
+    per_method = {}
+    for name, expected in sorted(manifest.items()):
+        path = os.path.join(corpus_dir, name)
+        started = time.perf_counter()
+        result = extract_salary(path, name, content_hash=None, image_extractor=agent._extract_salary_from_image)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        entry = per_method.setdefault(result['method'], {'latencies_ms': [], 'correct': 0, 'total': 0, 'misses': []})
+        entry['latencies_ms'].append(elapsed_ms)
+        entry['total'] += 1
+        if result['salary'] == expected:
+            entry['correct'] += 1
+        else:
+            entry['misses'].append({'file': name, 'expected': expected, 'got': result['salary']})
+
+    report = {}
+    for method, entry in per_method.items():
+        latencies = entry['latencies_ms']
+        report[method] = {
+            'files': entry['total'],
+            'accuracy': round(entry['correct'] / entry['total'], 4),
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'max_ms': round(max(latencies), 3),
+            'misses': entry['misses'][:10],
+        }
+    overall_correct = sum(e['correct'] for e in per_method.values())
+    report['overall_accuracy'] = round(overall_correct / max(1, len(manifest)), 4)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark salary extraction accuracy and latency per path")
+    parser.add_argument('--corpus', help="Directory with slips and a manifest.json of expected salaries")
+    parser.add_argument('--pdfs', type=int, default=200, help="Synthetic PDF slips to generate")
+    parser.add_argument('--images', type=int, default=3, help="Synthetic image slips (slow path, ~1s each)")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        with open(os.path.join(args.corpus, 'manifest.json')) as f:
+            manifest = json.load(f)
+        report = run(args.corpus, manifest)
+    else:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            manifest = build_synthetic_corpus(corpus_dir, args.pdfs, args.images, args.seed)
+            report = run(corpus_dir, manifest)
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Serving benchmark: Flask development server vs gunicorn
+Starts each server as a subprocess on a free port, drives it with concurrent HTTP
+clients and reports requests/sec and latency percentiles per scenario.
+
+Usage (from the backend directory):
+    python -m benchmarks.serving                       # both servers, all scenarios
+    python -m benchmarks.serving --servers gunicorn --clients 32 --duration 15
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # What `python app.py` runs on Render (debug and the reloader off)
+    'dev': lambda port: [sys.executable, '-c',
+                         f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'gunicorn': lambda port: [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+}
+
+# Phone numbers from data/customers.py
+PHONES = ['9876543210', '9123456789', '8765432109', '7890123456', '9988776655']
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _request(base_url, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        response.read()
+
+def _health(base_url, worker_id, iteration):
+    _request(base_url, '/api/health')
+    return 1
+
+def _chat(base_url, worker_id, iteration):
+    """A conversation up to the terms review (underwriting sleeps on the mock bureau call)"""
+    session_id = f"bench_{worker_id}_{iteration}"
+    _request(base_url, '/api/chat/start', {'session_id': session_id})
+    for message in (PHONES[iteration % len(PHONES)], '2 lakh', '36'):
+        _request(base_url, '/api/chat/message', {'session_id': session_id, 'message': message})
+    return 4
+
+SCENARIOS = {'health': _health, 'chat': _chat}
+
+def _wait_until_ready(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            _request(base_url, '/api/health')
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not become ready")
+
+def _drive(base_url, scenario, clients, duration):
+    latencies = []
+    requests = [0]
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(worker_id):
+        iteration = 0
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                count = scenario(base_url, worker_id, iteration)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed / count)
+                requests[0] += count
+            iteration += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies) or [0.0]
+    return {
+        'requests': requests[0],
+        'errors': errors[0],
+        'requests_per_sec': round(requests[0] / wall, 1),
+        'p50_ms': round(statistics.median(ordered) * 1000, 2),
+        'p95_ms': round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 2),
+    }
+
+def run_server(name, scenarios, clients, duration, env_overrides=None):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', LOG_LEVEL='WARNING',
+                   STORAGE_INDEX_PATH=os.path.join(scratch, 'index.sqlite3'),
+                   SESSION_DB_PATH=os.path.join(scratch, 'sessions.sqlite3'),
+                   LETTERS_DIR=os.path.join(scratch, 'letters'),
+                   UPLOADS_DIR=os.path.join(scratch, 'uploads'))
+        env.update(env_overrides or {})
+        process = subprocess.Popen(SERVERS[name](port), cwd=BACKEND_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_until_ready(base_url, process)
+            return {scenario: _drive(base_url, SCENARIOS[scenario], clients, duration) for scenario in scenarios}
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare requests/sec of the dev server and gunicorn")
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['dev', 'gunicorn'])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=['health', 'chat'])
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent HTTP clients")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per scenario")
+    parser.add_argument('--workers', type=int, help="WEB_CONCURRENCY for gunicorn")
+    args = parser.parse_args(argv)
+
+    overrides = {'WEB_CONCURRENCY': str(args.workers)} if args.workers else {}
+    report = {name: run_server(name, args.scenarios, args.clients, args.duration, overrides) for name in args.servers}
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Virtual-time conversation simulation
+Plays synthetic conversations (the same plans as benchmarks.loadtest) straight through
+MasterAgent with AgentRuntime.virtual(), so the mock bureau and OCR latencies cost no
+wall time and every conversation is reproducible from the seed. Reports throughput, the
+virtual time each conversation would have spent waiting on external calls, and a digest
+of every response: the same seed must give the same digest.
+
+Usage (from the backend directory):
+    python -m benchmarks.simulate --conversations 2000
+    python -m benchmarks.simulate --conversations 500 --jitter 0.3 --check   # run twice, compare digests
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.loadtest import DEFAULT_MIX, parse_mix, plan_conversation, _slip_pdf
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _slip_context(scratch, salary):
+    """Upload context as /api/chat/upload builds it, for a slip written to the scratch directory"""
+    content = _slip_pdf(salary)
+    content_hash = hashlib.sha256(content).hexdigest()
+    path = os.path.join(scratch, f"slip_{content_hash[:16]}.pdf")
+    if not os.path.exists(path):
+        with open(path, 'wb') as handle:
+            handle.write(content)
+    return {'file_uploaded': True, 'file_path': path, 'file_name': 'salary_slip.pdf', 'content_hash': content_hash}
+
+def simulate_conversation(plan, runtime, scratch, session_id):
+    """Play one plan through a fresh MasterAgent; returns the list of responses"""
+    from agents.master_agent import MasterAgent
+    master = MasterAgent(session_id=session_id, runtime=runtime)
+    responses = [master.process_message('start')]
+    for message in (plan['phone'], str(plan['amount']), f"{plan['tenure']} months", 'yes'):
+        responses.append(master.process_message(message))
+    if responses[-1].get('action') == 'request_document' and plan['upload_salary']:
+        responses.append(master.process_message('', _slip_context(scratch, plan['upload_salary'])))
+    return responses
+
+def run_simulation(scratch, conversations, mix, seed=0, jitter=0.0):
+    """Storage must already point into scratch (set the environment before importing the app)"""
+    from utils.runtime import AgentRuntime, LatencyModel
+
+    rng = random.Random(seed)
+    outcomes = list(mix)
+    weights = [mix[o] for o in outcomes]
+    plans = [plan_conversation(rng.choices(outcomes, weights)[0], rng) for _ in range(conversations)]
+
+    digest = hashlib.sha256()
+    virtual_seconds = []
+    counts = {}
+    unexpected = 0
+    started = time.perf_counter()
+    for index, plan in enumerate(plans):
+        runtime = AgentRuntime.virtual(f"{seed}-{index}", LatencyModel(jitter=jitter))
+        responses = simulate_conversation(plan, runtime, scratch, f"sim_{seed}_{index}")
+        # Paths differ between scratch directories; everything else must match exactly
+        body = json.dumps(responses, sort_keys=True, default=str).replace(scratch, '$SCRATCH')
+        digest.update(body.encode('utf-8'))
+        virtual_seconds.append(runtime.clock.slept)
+        action = responses[-1].get('action')
+        counts[action] = counts.get(action, 0) + 1
+        unexpected += action != plan['expected_action']
+    wall = time.perf_counter() - started
+
+    ordered = sorted(virtual_seconds)
+    return {
+        'conversations': conversations,
+        'seed': seed,
+        'jitter': jitter,
+        'wall_seconds': round(wall, 3),
+        'conversations_per_sec': round(conversations / wall, 1),
+        'virtual_seconds_total': round(sum(ordered), 3),
+        'virtual_seconds_mean': round(sum(ordered) / len(ordered), 3),
+        'virtual_seconds_p95': round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+        'final_actions': counts,
+        'unexpected_outcomes': unexpected,
+        'digest': digest.hexdigest(),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay synthetic conversations in virtual time")
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="e.g. approve=0.6,reject=0.2,slip=0.2")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jitter', type=float, default=0.0, help="+/- fraction applied to simulated latencies")
+    parser.add_argument('--check', action='store_true', help="Run twice and fail if the digests differ")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        # Each run in its own process: letters issued by the first would collide with the second
+        command = [sys.executable, '-m', 'benchmarks.simulate'] + [a for a in (argv or sys.argv[1:]) if a != '--check']
+        reports = [json.loads(subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True,
+                                             check=True).stdout) for _ in range(2)]
+        report = dict(reports[0], deterministic=reports[0]['digest'] == reports[1]['digest'])
+        print(json.dumps(report, indent=2))
+        return 0 if report['deterministic'] else 1
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for key, name in (('STORAGE_INDEX_PATH', 'index.sqlite3'), ('LETTERS_DIR', 'letters'),
+                          ('UPLOADS_DIR', 'uploads')):
+            os.environ[key] = os.path.join(scratch, name)
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        # Virtual time: no fsyncs for the event log
+        os.environ['EVENT_LOG'] = 'off'
+        from utils.logging_config import configure_logging
+        configure_logging()
+        report = run_simulation(scratch, args.conversations, args.mix, args.seed, args.jitter)
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
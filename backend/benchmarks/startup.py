@@ -0,0 +1,119 @@
+"""
+Cold-start report
+Breaks down `python -X importtime -c "import app"` by top-level package, checks that
+heavy optional dependencies are not imported at startup, and measures the time from
+process start to the first successful /api/health response.
+
+Usage (from the backend directory):
+    python -m benchmarks.startup                          # report
+    python -m benchmarks.startup --check                  # exit 1 on a regression (CI)
+    python -m benchmarks.startup --check --max-import-ms 600 --health-runs 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.serving import SERVERS, _free_port
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use only; importing any of these at startup is a regression
+LAZY_MODULES = ('reportlab', 'PIL', 'numpy', 'pytesseract', 'cv2', 'multiprocessing')
+
+def _scratch_env(scratch, **extra):
+    return dict(os.environ, LOG_LEVEL='WARNING',
+                STORAGE_INDEX_PATH=os.path.join(scratch, 'index.sqlite3'),
+                SESSION_DB_PATH=os.path.join(scratch, 'sessions.sqlite3'),
+                LETTERS_DIR=os.path.join(scratch, 'letters'),
+                UPLOADS_DIR=os.path.join(scratch, 'uploads'), **extra)
+
+def import_report(module='app', top=15):
+    """Parse -X importtime output: totals, per-package cumulative time and imported lazy modules"""
+    code = f"import sys, json, {module}; print(json.dumps(sorted(sys.modules)))"
+    with tempfile.TemporaryDirectory() as scratch:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=BACKEND_DIR,
+                                env=_scratch_env(scratch), capture_output=True, text=True, check=True)
+
+    per_package = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        package = name.split('.')[0]
+        per_package[package] = per_package.get(package, 0) + int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    heaviest = sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'module': module,
+        'import_ms': round(total_us / 1000, 1),
+        'packages_ms': {name: round(us / 1000, 1) for name, us in heaviest},
+        'lazy_modules_loaded': [m for m in LAZY_MODULES if m in loaded],
+    }
+
+def time_to_first_health(server='dev', runs=3, timeout=60):
+    """Median seconds from spawning the server to the first 200 from /api/health"""
+    samples = []
+    for _ in range(runs):
+        port = _free_port()
+        with tempfile.TemporaryDirectory() as scratch:
+            # A SIGTERM that lands while a worker is still booting is only acted on after
+            # the graceful timeout, so keep that short here
+            env = _scratch_env(scratch, PORT=str(port), HOST='127.0.0.1', WARMUP='background',
+                               GRACEFUL_TIMEOUT='3')
+            started = time.perf_counter()
+            process = subprocess.Popen(SERVERS[server](port), cwd=BACKEND_DIR, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                while True:
+                    if process.poll() is not None or time.perf_counter() - started > timeout:
+                        raise RuntimeError(f"{server} server did not come up")
+                    try:
+                        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as r:
+                            if r.status == 200:
+                                break
+                    except OSError:
+                        time.sleep(0.01)
+                samples.append(time.perf_counter() - started)
+            finally:
+                process.terminate()
+                process.wait(timeout=60)
+    samples.sort()
+    return round(samples[len(samples) // 2], 3)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time breakdown and time to first /api/health")
+    parser.add_argument('--check', action='store_true', help="Exit non-zero on a regression")
+    parser.add_argument('--max-import-ms', type=float, help="Fail --check when importing app takes longer")
+    parser.add_argument('--health-runs', type=int, default=3, help="Server starts to time (0 to skip)")
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['dev', 'gunicorn'])
+    args = parser.parse_args(argv)
+
+    report = import_report()
+    if args.health_runs:
+        report['first_health_seconds'] = {
+            server: time_to_first_health(server, args.health_runs) for server in args.servers
+        }
+    print(json.dumps(report, indent=2))
+
+    if args.check:
+        failures = []
+        if report['lazy_modules_loaded']:
+            failures.append(f"imported at startup: {', '.join(report['lazy_modules_loaded'])}")
+        if args.max_import_ms and report['import_ms'] > args.max_import_ms:
+            failures.append(f"import app took {report['import_ms']} ms (budget {args.max_import_ms} ms)")
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 INTEREST_RATES = {
     12: 10.5,   # 1 year
     24: 10.99,  # 2 years
@@ -10,13 +12,23 @@ PROCESSING_FEE_PERCENT = 2.0
 MIN_LOAN_AMOUNT = 50000
 MAX_LOAN_AMOUNT = 2000000
 
+@lru_cache(maxsize=256)
+def _emi_growth(rate_annual, tenure_months):
+    """Monthly rate and (1 + r)^n, cached per rate-card entry"""
+    rate_monthly = rate_annual / (12 * 100)
+    return rate_monthly, (1 + rate_monthly) ** tenure_months
+
 def calculate_emi(principal, rate_annual, tenure_months):
     """Calculate EMI using reducing balance method"""
-    rate_monthly = rate_annual / (12 * 100)
-    emi = principal * rate_monthly * ((1 + rate_monthly) ** tenure_months) / \
-          (((1 + rate_monthly) ** tenure_months) - 1)
+    rate_monthly, growth = _emi_growth(rate_annual, tenure_months)
+    emi = principal * rate_monthly * growth / (growth - 1)
     return round(emi, 2)
 
+def warm_rate_card():
+    """Precompute the EMI factors for every tenure on the rate card"""
+    for tenure_months, rate in INTEREST_RATES.items():
+        _emi_growth(rate, tenure_months)
+
 def get_interest_rate(tenure_months):
     """Get interest rate based on tenure"""
     return INTEREST_RATES.get(tenure_months, 11.49)
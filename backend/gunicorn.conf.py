@@ -0,0 +1,66 @@
+"""
+Gunicorn settings for the backend (run from the backend directory):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+    WEB_CONCURRENCY=2           worker processes
+    GUNICORN_THREADS=4          threads per worker
+    GRACEFUL_TIMEOUT=30         seconds in-flight requests get to finish on SIGTERM
+    WARMUP=preload              preload | background | off (see utils/warmup.py)
+"""
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5002)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Import and warm the app once in the master; workers fork from a warm image
+preload_app = True
+
+# On SIGTERM gunicorn stops accepting connections and lets workers finish
+# in-flight requests for up to graceful_timeout before killing them
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+
+accesslog = '-' if os.environ.get('GUNICORN_ACCESS_LOG') else None
+
+# Requests for one chat session can land on any worker, so share session state
+if workers > 1:
+    os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+    # and rate-limit buckets, or each worker would grant the full budget
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+    # and stored responses for idempotent retries
+    os.environ.setdefault('IDEMPOTENCY_BACKEND', 'sqlite')
+    # A /metrics scrape reaches one worker; it sums what every worker wrote here
+    os.environ.setdefault('METRICS_DIR', 'metrics_data')
+
+def on_starting(server):
+    # Totals start from zero with the server, as a single process's would
+    from utils.metrics import clear_shared
+    clear_shared()
+
+def when_ready(server):
+    server.log.info("Serving with %d workers x %d threads", workers, threads)
+
+def post_fork(server, worker):
+    from utils.warmup import warm_up_in_background, WARMUP_MODE
+    if WARMUP_MODE == 'background':
+        warm_up_in_background()
+    from utils.metrics import start_sharing
+    start_sharing()
+    # Readiness probes start with the worker rather than on the first /api/health/ready
+    from app import sessions
+    from utils.health import get_monitor
+    get_monitor(sessions)
+
+def worker_exit(server, worker):
+    # Let background jobs (image normalization) finish and flush queued log records
+    from utils.worker_pools import all_pools
+    from utils.logging_config import shutdown_logging
+    from utils.metrics import flush
+    for pool in all_pools():
+        pool.shutdown(wait=True)
+    # What this worker counted stays in the totals after it exits
+    flush()
+    shutdown_logging()
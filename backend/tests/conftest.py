@@ -0,0 +1,20 @@
+"""
+Test environment: every store, log and index in a scratch directory, set before the app
+modules read their configuration at import time. Run from the backend directory:
+
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+SCRATCH = tempfile.mkdtemp(prefix='loan-tests-')
+
+for key, name in (('STORAGE_INDEX_PATH', 'index.sqlite3'), ('LETTERS_DIR', 'letters'),
+                  ('UPLOADS_DIR', 'uploads'), ('SESSION_DB_PATH', 'sessions.sqlite3'),
+                  ('RATE_LIMIT_DB_PATH', 'rate_limits.sqlite3'), ('IDEMPOTENCY_DB_PATH', 'idempotency.sqlite3'),
+                  ('EVENT_LOG_DIR', 'event_log'), ('TRANSCRIPTS_DIR', 'transcripts'),
+                  ('PROFILES_DIR', 'profiles')):
+    os.environ[key] = os.path.join(SCRATCH, name)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('WARMUP', 'off')
+os.environ.setdefault('RATE_LIMITS', 'off')
@@ -0,0 +1,19 @@
+import app as api
+
+def test_stream_stays_in_flight_until_closed():
+    client = api.app.test_client()
+    before = api.admission.inflight
+    response = client.get('/api/chat/stream', query_string={'session_id': 'admission-stream', 'message': 'hi'},
+                          buffered=False)
+    assert response.status_code == 200
+    assert api.admission.inflight == before + 1
+    body = b''.join(response.response)
+    response.close()
+    assert b'event:' in body or b'data:' in body
+    assert api.admission.inflight == before
+
+def test_plain_response_leaves_on_return():
+    client = api.app.test_client()
+    before = api.admission.inflight
+    client.post('/api/chat/start', json={'session_id': 'admission-plain'})
+    assert api.admission.inflight == before
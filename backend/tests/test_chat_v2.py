@@ -0,0 +1,51 @@
+import app as api
+from agents.sanction_agent import SanctionAgent
+from utils.chat_v2 import build_response, compact_sanction, delta, state_response
+
+def test_known_version_gets_only_fields_changed_since():
+    state = {}
+    first = build_response('s', state, {'stage': 'awaiting_loan_amount', 'customer_data': {'name': 'Asha'}})
+    assert first['full'] and set(first['changes']) == {'stage', 'customer'}
+
+    second = build_response('s', state, {'stage': 'reviewing_terms', 'loan_amount': 300000,
+                                         'customer_data': {'name': 'Asha'}}, first['version'])
+    assert not second['full']
+    assert second['changes'] == {'stage': 'reviewing_terms', 'loan_amount': 300000}
+
+    # A turn that changes nothing keeps the version and sends no changes
+    third = build_response('s', state, {'stage': 'reviewing_terms'}, second['version'])
+    assert third['version'] == second['version'] and third['changes'] == {}
+
+    # A client one version behind gets everything it missed
+    assert state_response('s', state, first['version'])['changes'] == second['changes']
+
+def test_unknown_or_future_versions_get_the_full_view():
+    state = {}
+    payload = build_response('s', state, {'stage': 'awaiting_loan_amount'})
+    epoch, _, number = payload['version'].partition('.')
+    view = state['client_view']
+    for known in (None, 'garbage', f"other.{number}", f"{epoch}.{int(number) + 1}", f"{epoch}.x"):
+        full, changes = delta(view, known)
+        assert full and changes == view['fields']
+
+def test_api_sends_deltas_and_resyncs():
+    client = api.app.test_client()
+    start = client.post('/api/v2/chat/start', json={'session_id': 'v2-delta'}).get_json()
+    payload = client.post('/api/v2/chat/message', json={
+        'session_id': 'v2-delta', 'message': '9876543210', 'known_version': start['version']}).get_json()
+    assert not payload['full'] and 'customer' in payload['changes']
+
+    resync = client.get('/api/v2/chat/state', query_string={'session_id': 'v2-delta',
+                                                             'known_version': payload['version']})
+    assert resync.get_json()['changes'] == {}
+
+def test_standard_letter_lists_are_sent_as_static_references():
+    agent = SanctionAgent()
+    details = {'loan_amount': 300000, 'terms': agent._generate_terms_and_conditions(),
+               'documents_required': agent._get_required_documents()}
+    compact = compact_sanction({'success': True, 'pdf_path': '/srv/letters/x.pdf', 'sanction_details': details})
+    assert 'pdf_path' not in compact
+    assert 'terms' not in compact['details'] and 'documents_required' not in compact['details']
+    response = api.app.test_client().get(f"/api/v2/static/{compact['details']['terms_ref']}")
+    assert response.status_code == 200 and response.get_json() == details['terms']
+    assert api.app.test_client().get('/api/v2/static/terms-unknown').status_code == 404
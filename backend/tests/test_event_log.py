@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import time
+
+from tests.conftest import SCRATCH
+from utils import event_log
+from utils.event_log import EventLog
+
+# Event times are seconds after this, so sessions are still inside the TTL
+NOW = time.time()
+
+def _event(t, session_id, source, target, **changes):
+    event = {'t': NOW + t, 's': session_id, 'f': source, 'to': target}
+    if changes:
+        event['d'] = changes
+    return event
+
+def _seal(log):
+    """Seal current.log now and fold it, whoever's compaction gets there first"""
+    segment_bytes, log.segment_bytes = log.segment_bytes, 1
+    try:
+        log.seal()
+    finally:
+        log.segment_bytes = segment_bytes
+    # Blocking, unlike compact(), so a fold the seal started in the background has finished
+    with event_log._compacting(log.directory):
+        event_log._fold_segments(log.directory)
+
+def test_sessions_rebuild_from_snapshot_and_tail_after_a_seal():
+    directory = tempfile.mkdtemp(dir=SCRATCH)
+    log = EventLog(directory, segment_bytes=1 << 30, fsync=False)
+    for event in [
+        _event(1, 'a', 'initial', 'awaiting_loan_amount', customer_data={'name': 'Asha'}),
+        _event(2, 'a', 'awaiting_loan_amount', 'reviewing_terms', loan_amount=300000),
+        _event(3, 'b', 'initial', 'awaiting_loan_amount', customer_data={'name': 'Ravi'}),
+    ]:
+        log.append(event)
+    _seal(log)
+    assert os.path.exists(os.path.join(directory, event_log.SNAPSHOT))
+    assert not event_log._segments(directory) and event_log._segments(directory, event_log.ARCHIVE)
+
+    # The writer reopens current.log after the seal renamed it
+    for event in [
+        _event(4, 'a', 'reviewing_terms', 'processing_underwriting'),
+        _event(5, 'a', 'processing_underwriting', 'generating_sanction', underwriting_result={'approved': True}),
+        _event(6, 'b', 'awaiting_loan_amount', 'initial'),
+        _event(7, 'b', 'initial', 'awaiting_loan_amount', customer_data={'name': 'Meera'}),
+    ]:
+        log.append(event)
+
+    sessions = event_log.rebuild(directory)
+
+    assert sessions['a'] == {'customer_data': {'name': 'Asha'}, 'loan_amount': 300000,
+                             'underwriting_result': {'approved': True},
+                             'stage': 'generating_sanction', 'stage_entered_at': NOW + 5}
+    # A restart in the tail drops what the snapshot held for the earlier conversation
+    assert sessions['b'] == {'customer_data': {'name': 'Meera'}, 'stage': 'awaiting_loan_amount',
+                             'stage_entered_at': NOW + 7}
+
+def test_audit_trail_spans_archived_segments_and_the_tail():
+    directory = tempfile.mkdtemp(dir=SCRATCH)
+    log = EventLog(directory, segment_bytes=1 << 30, fsync=False)
+    log.append(_event(1, 'a', 'processing_underwriting', 'generating_sanction', underwriting_result={'approved': True}))
+    _seal(log)
+    log.append(_event(2, 'a', 'generating_sanction', 'completed', sanction_result={'reference': 'LN-1'}))
+    log.append(_event(3, 'b', 'initial', 'awaiting_loan_amount'))
+
+    assert [event['t'] - NOW for event in event_log.audit_events(directory)] == [1, 2]
+    assert [event['t'] for event in event_log.audit_events(directory, session_id='b')] == []
+
+def test_torn_last_line_is_skipped():
+    directory = tempfile.mkdtemp(dir=SCRATCH)
+    log = EventLog(directory, segment_bytes=1 << 30, fsync=False)
+    log.append(_event(1, 'a', 'initial', 'awaiting_loan_amount', loan_amount=1))
+    with open(os.path.join(directory, event_log.CURRENT), 'ab') as handle:
+        handle.write(b'{"t": 2, "s": "a", "f": "awaiting_loa')
+    assert event_log.rebuild(directory)['a']['stage_entered_at'] == NOW + 1
+
+def test_snapshot_drops_completed_and_expired_sessions():
+    directory = tempfile.mkdtemp(dir=SCRATCH)
+    log = EventLog(directory, segment_bytes=1 << 30, fsync=False)
+    day = 86400
+    for event in [
+        _event(1, 'done', 'initial', 'awaiting_loan_amount', customer_data={'pan': 'ABCDE1234F'}),
+        _event(2, 'done', 'generating_sanction', 'completed', sanction_result={'reference': 'LN-1'}),
+        _event(-2 * day, 'idle', 'initial', 'awaiting_loan_amount', customer_data={'pan': 'FGHIJ5678K'}),
+        _event(3, 'live', 'initial', 'awaiting_loan_amount', customer_data={'name': 'Asha'}),
+    ]:
+        log.append(event)
+    _seal(log)
+
+    with open(os.path.join(directory, event_log.SNAPSHOT), encoding='utf-8') as handle:
+        assert list(json.load(handle)['sessions']) == ['live']
+    assert list(event_log.rebuild(directory)) == ['live']
+    # The archive still has every event for the audit trail
+    archived = [event for path in event_log._segments(directory, event_log.ARCHIVE)
+                for event in event_log.read_events(path)]
+    assert [event['s'] for event in archived] == ['done', 'done', 'idle', 'live']
+    # A tail event after the fold is pruned the same way on rebuild
+    log.append(_event(4, 'live', 'generating_sanction', 'completed'))
+    assert event_log.rebuild(directory) == {}
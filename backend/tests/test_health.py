@@ -0,0 +1,25 @@
+import threading
+import time
+
+from utils import health
+
+def test_report_is_starting_until_the_first_round_finishes():
+    release = threading.Event()
+    monitor = health.HealthMonitor({'slow': (lambda: (release.wait(5), (health.OK, {}))[1], health.DOWN)},
+                                   interval=60)
+    monitor.start()
+    try:
+        assert monitor.report()['status'] == health.STARTING
+        release.set()
+        deadline = time.monotonic() + 5
+        while monitor.report()['status'] == health.STARTING and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert monitor.report()['status'] == health.OK
+    finally:
+        monitor.stop()
+
+def test_bureau_probe_pings_without_pulling_a_report():
+    started = time.perf_counter()
+    status, details = health.probe_bureau()
+    assert status == health.OK and details['bureau'] == 'CIBIL'
+    assert time.perf_counter() - started < 0.5
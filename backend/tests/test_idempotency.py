@@ -0,0 +1,98 @@
+import io
+import os
+import threading
+
+import pytest
+
+import app as api
+from agents.master_agent import MasterAgent
+from tests.conftest import SCRATCH
+from utils.idempotency import KeyReused, MemoryIdempotencyStore, SqliteIdempotencyStore, StoredResponse
+
+def _message(client, session_id, message, key):
+    return client.post('/api/chat/message', json={'session_id': session_id, 'message': message},
+                       headers={'Idempotency-Key': key})
+
+def test_retried_turn_is_replayed_without_running_again(monkeypatch):
+    turns = []
+    process_message = MasterAgent.process_message
+    monkeypatch.setattr(MasterAgent, 'process_message',
+                        lambda self, *args, **kwargs: turns.append(args[0]) or process_message(self, *args, **kwargs))
+    client = api.app.test_client()
+    client.post('/api/chat/start', json={'session_id': 'idem-replay'})
+    first = _message(client, 'idem-replay', '9876543210', 'turn-1')
+
+    retry = _message(client, 'idem-replay', '9876543210', 'turn-1')
+
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.data == first.data
+    assert turns == ['start', '9876543210']
+    # A new key is a new turn
+    assert 'Idempotent-Replayed' not in _message(client, 'idem-replay', '300000', 'turn-2').headers
+
+def test_key_reused_with_a_different_body_is_rejected():
+    client = api.app.test_client()
+    client.post('/api/chat/start', json={'session_id': 'idem-reuse'})
+    first = _message(client, 'idem-reuse', '9876543210', 'turn-1')
+
+    reused = _message(client, 'idem-reuse', '300000', 'turn-1')
+
+    assert reused.status_code == 422
+    assert 'Idempotent-Replayed' not in reused.headers
+    # The original request still replays
+    assert _message(client, 'idem-reuse', '9876543210', 'turn-1').data == first.data
+
+def test_upload_fingerprint_ignores_the_multipart_boundary():
+    def fingerprint(content):
+        data = {'session_id': 'idem-upload', 'file': (io.BytesIO(content), 'slip.pdf')}
+        with api.app.test_request_context('/api/chat/upload', method='POST', data=data,
+                                          content_type='multipart/form-data'):
+            fingerprint = api._request_fingerprint()
+            # The view still reads the file from the start
+            assert api.request.files['file'].read() == content
+            return fingerprint
+
+    assert fingerprint(b'%PDF slip') == fingerprint(b'%PDF slip')
+    assert fingerprint(b'%PDF slip') != fingerprint(b'%PDF other slip')
+
+def _rejects_a_reused_key(store):
+    assert store.claim('s', 'k', 'first') is None
+    with pytest.raises(KeyReused):
+        store.claim('s', 'k', 'second', wait=0)
+    store.complete('s', 'k', StoredResponse(200, b'{}', 'application/json'))
+    with pytest.raises(KeyReused):
+        store.claim('s', 'k', 'second', wait=0)
+    assert store.claim('s', 'k', 'first', wait=0).body == b'{}'
+
+def test_memory_store_rejects_a_reused_key():
+    _rejects_a_reused_key(MemoryIdempotencyStore())
+
+def test_rejects_a_reused_key():
+    _rejects_a_reused_key(SqliteIdempotencyStore(os.path.join(SCRATCH, 'idempotency-reuse.sqlite3')))
+
+def test_key_is_scoped_to_session_and_endpoint():
+    client = api.app.test_client()
+    for session_id in ('idem-a', 'idem-b'):
+        client.post('/api/chat/start', json={'session_id': session_id}, headers={'Idempotency-Key': 'same'})
+    assert 'Idempotent-Replayed' not in _message(client, 'idem-b', '9876543210', 'same').headers
+
+def _duplicate_waits_for_the_first(store):
+    assert store.claim('s', 'k') is None
+    replies = []
+    waiter = threading.Thread(target=lambda: replies.append(store.claim('s', 'k', wait=5)))
+    waiter.start()
+    store.complete('s', 'k', StoredResponse(200, b'{"ok": true}', 'application/json'))
+    waiter.join(5)
+    assert replies and replies[0].body == b'{"ok": true}'
+
+def test_memory_store_duplicate_waits_for_the_first():
+    _duplicate_waits_for_the_first(MemoryIdempotencyStore())
+
+def test_sqlite_store_duplicate_waits_for_the_first():
+    _duplicate_waits_for_the_first(SqliteIdempotencyStore(os.path.join(SCRATCH, 'idempotency-wait.sqlite3')))
+
+def test_released_claim_runs_again():
+    store = MemoryIdempotencyStore()
+    assert store.claim('s', 'k') is None
+    store.release('s', 'k')
+    assert store.claim('s', 'k', wait=0) is None
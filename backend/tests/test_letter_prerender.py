@@ -0,0 +1,46 @@
+import threading
+
+from utils import letter_prerender
+from utils.worker_pools import get_pool
+from utils.warmup import _SAMPLE_LETTER
+
+BODY = {field: value for field, value in _SAMPLE_LETTER.items()
+        if field not in ('loan_reference_number', 'sanction_date', 'validity_date')}
+
+def _block_pool():
+    """Occupy the prerender pool's workers so later renders stay queued; returns the release event"""
+    release = threading.Event()
+    started = threading.Barrier(letter_prerender.WORKERS + 1)
+    pool = get_pool('prerender', letter_prerender.WORKERS, letter_prerender.MAX_QUEUE)
+    blockers = [pool.submit(lambda: (started.wait(), release.wait())) for _ in range(letter_prerender.WORKERS)]
+    started.wait()
+    return pool, release, blockers
+
+def test_discarding_queued_renders_frees_the_pool():
+    pool, release, blockers = _block_pool()
+    try:
+        # Several rounds of a full queue: a leak would saturate the pool after the first
+        for round_ in range(3):
+            sessions = [f"discard-{round_}-{i}" for i in range(letter_prerender.MAX_QUEUE)]
+            for session_id in sessions:
+                assert letter_prerender.prerender(session_id, BODY)
+            for session_id in sessions:
+                letter_prerender.discard(session_id, 'revised')
+            assert pool.queued == 0
+            assert not pool.saturated()
+    finally:
+        release.set()
+        for blocker in blockers:
+            blocker.result(timeout=10)
+    assert pool.stats()['queued'] == 0
+
+def test_claim_stamps_the_pre_rendered_letter():
+    assert letter_prerender.prerender('claim-hit', BODY)
+    letter_prerender._session_entries()['claim-hit'].future.result(timeout=30)
+    pdf = letter_prerender.claim('claim-hit', _SAMPLE_LETTER)
+    assert pdf.startswith(b'%PDF')
+    assert _SAMPLE_LETTER['loan_reference_number'].encode() in pdf
+
+def test_claim_for_other_terms_is_a_miss():
+    assert letter_prerender.prerender('claim-stale', BODY)
+    assert letter_prerender.claim('claim-stale', dict(_SAMPLE_LETTER, loan_amount=999999)) is None
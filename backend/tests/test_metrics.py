@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+from utils import metrics
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import sys
+from utils import metrics
+calls = metrics.Counter('test_calls_total', "Calls", ('route',))
+seconds = metrics.Histogram('test_seconds', "Latency", buckets=(0.1, 1.0))
+metrics.Gauge('test_queued', "Queued", lambda: int(sys.argv[1]))
+metrics.Gauge('test_sessions', "Shared", lambda: 7, shared=True)
+calls.inc('chat', amount=int(sys.argv[1]))
+seconds.observe(0.05)
+if sys.argv[2] == 'render':
+    print(metrics.render())
+else:
+    metrics.flush()
+"""
+
+def _worker(directory, count, action):
+    env = dict(os.environ, METRICS_DIR=directory)
+    return subprocess.run([sys.executable, '-c', WORKER, str(count), action], cwd=BACKEND, env=env,
+                          check=True, capture_output=True, text=True).stdout
+
+def test_scrape_sums_every_worker(tmp_path):
+    directory = str(tmp_path)
+    _worker(directory, 3, 'flush')  # an earlier worker that has exited
+    _worker(directory, 4, 'flush')
+    text = _worker(directory, 5, 'render')
+
+    assert 'test_calls_total{route="chat"} 12' in text
+    assert 'test_seconds_bucket{le="0.1"} 3' in text
+    assert 'test_seconds_count 3' in text
+    # Gauges: exited workers drop out, shared state is not multiplied
+    assert 'test_queued 5' in text
+    assert 'test_sessions 7' in text
+
+def test_without_a_directory_the_process_reports_itself():
+    assert metrics.METRICS_DIR is None
+    assert metrics.render().endswith('\n')
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+import app as api
+from utils import profiling
+
+def _fail():
+    raise RuntimeError("handler failed")
+
+@pytest.mark.parametrize('mode', ['memory', 'cpu'])
+def test_failed_request_releases_its_profiler(monkeypatch, mode):
+    monkeypatch.setattr(profiling, 'DEBUG_TOKEN', 'secret')
+    monkeypatch.setattr(api.app, 'testing', True)  # errors propagate, skipping after_request
+    monkeypatch.setitem(api.app.view_functions, 'storage_stats', _fail)
+    client = api.app.test_client()
+    headers = {'X-Debug-Token': 'secret', 'X-Debug-Profile': mode}
+    with pytest.raises(RuntimeError):
+        client.get('/api/storage/stats', headers=headers)
+    assert not profiling._memory_lock.locked()
+    assert not tracemalloc.is_tracing()
+    assert sys.getprofile() is None
+    # The next profiled request still gets a capture
+    assert client.get('/api/health', headers=headers).headers.get('X-Profile-Id', '').startswith(mode)
+
+def test_old_and_surplus_profiles_are_pruned(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILES_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILES_MAX_FILES', 3)
+    monkeypatch.setattr(profiling, 'PROFILES_RETENTION_HOURS', 1)
+    now = time.time()
+    ages = {'cpu-%016x.prof' % i: age for i, age in enumerate([0, 10, 20, 30, 7200])}
+    for name, age in ages.items():
+        path = tmp_path / name
+        path.write_bytes(b'')
+        os.utime(path, (now - age, now - age))
+    (tmp_path / 'notes.txt').write_text('not a profile')
+
+    assert profiling.prune_profiles() == 2
+    assert sorted(os.listdir(tmp_path)) == ['cpu-0000000000000000.prof', 'cpu-0000000000000001.prof',
+                                            'cpu-0000000000000002.prof', 'notes.txt']
+
+def test_traces_need_the_debug_token_and_a_valid_limit(monkeypatch):
+    monkeypatch.setattr(profiling, 'DEBUG_TOKEN', 'secret')
+    client = api.app.test_client()
+    assert client.get('/api/debug/trace/any').status_code == 403
+    headers = {'X-Debug-Token': 'secret'}
+    for limit in ('ten', '0', '-5'):
+        assert client.get(f'/api/debug/trace/any?limit={limit}', headers=headers).status_code == 400
+    assert client.get('/api/debug/trace/nobody?limit=1000', headers=headers).status_code == 404
@@ -0,0 +1,31 @@
+import os
+
+from flask import Flask, request
+
+from tests.conftest import SCRATCH
+from utils import rate_limit
+from utils.rate_limit import SqliteBuckets, client_ip
+
+def _client_ip(monkeypatch, hops, forwarded_for):
+    monkeypatch.setattr(rate_limit, 'TRUST_FORWARDED_FOR', hops)
+    headers = {'X-Forwarded-For': forwarded_for} if forwarded_for else {}
+    with Flask(__name__).test_request_context(headers=headers, environ_base={'REMOTE_ADDR': '10.0.0.9'}):
+        return client_ip(request)
+
+def test_client_ip_ignores_entries_the_client_sent(monkeypatch):
+    # The client sent "1.2.3.4"; our proxy appended the address it saw
+    assert _client_ip(monkeypatch, 1, '1.2.3.4, 203.0.113.7') == '203.0.113.7'
+    assert _client_ip(monkeypatch, 2, '1.2.3.4, 203.0.113.7, 10.0.0.2') == '203.0.113.7'
+
+def test_client_ip_without_trusted_proxies_is_the_peer(monkeypatch):
+    assert _client_ip(monkeypatch, 0, '1.2.3.4') == '10.0.0.9'
+    assert _client_ip(monkeypatch, 1, None) == '10.0.0.9'
+
+def test_idle_sqlite_buckets_are_purged():
+    buckets = SqliteBuckets(os.path.join(SCRATCH, 'buckets.sqlite3'), idle_seconds=60)
+    buckets.take('chat.ip:old', 1.0, 5, now=1000.0)
+    buckets.take('chat.ip:new', 1.0, 5, now=1050.0)
+    assert buckets.purge_idle(now=1070.0) == 1
+    assert buckets.count() == 1
+    # A purged bucket comes back full
+    assert buckets.take('chat.ip:old', 1.0, 5, now=1070.0) == 0
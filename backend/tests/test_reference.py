@@ -0,0 +1,34 @@
+import threading
+
+from utils.reference import is_valid_reference, new_loan_reference
+
+def _issue_from_threads(threads, per_thread, concurrent):
+    issued = []
+    lock = threading.Lock()
+
+    def issue():
+        ids = [new_loan_reference() for _ in range(per_thread)]
+        with lock:
+            issued.extend(ids)
+
+    workers = [threading.Thread(target=issue) for _ in range(threads)]
+    if concurrent:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        # One short-lived thread after another: each takes the slot the previous one gave back
+        for worker in workers:
+            worker.start()
+            worker.join()
+    return issued
+
+def test_short_lived_threads_never_repeat_an_id():
+    issued = _issue_from_threads(3000, 1, concurrent=False)
+    assert len(set(issued)) == len(issued)
+
+def test_concurrent_threads_issue_unique_valid_ids():
+    issued = _issue_from_threads(32, 500, concurrent=True)
+    assert len(set(issued)) == len(issued) == 32 * 500
+    assert all(is_valid_reference(reference) for reference in issued)
@@ -0,0 +1,74 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import zlib
+
+from tests.conftest import SCRATCH
+from utils.salary_extractor import extract_pdf_text, extract_salary, extract_salary_async
+
+def _from_name(path, name):
+    return int(re.search(r'(\d{5,})', name).group(1))
+
+async def _from_name_async(path, name):
+    return _from_name(path, name)
+
+def _slip(content):
+    path = os.path.join(SCRATCH, hashlib.sha256(content).hexdigest() + '.png')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+def test_image_results_are_not_shared_across_file_names():
+    path, content_hash = _slip(b'the same image bytes')
+    first = extract_salary(path, 'salary_slip_85000.png', content_hash, image_extractor=_from_name)
+    second = extract_salary(path, 'salary_slip_40000.png', content_hash, image_extractor=_from_name)
+    assert (first['salary'], first['cached']) == (85000, False)
+    assert (second['salary'], second['cached']) == (40000, False)
+    again = extract_salary(path, 'salary_slip_85000.png', content_hash, image_extractor=_from_name)
+    assert (again['salary'], again['cached']) == (85000, True)
+
+def test_async_image_results_are_not_shared_across_file_names():
+    path, content_hash = _slip(b'other image bytes')
+    first = asyncio.run(extract_salary_async(path, 'salary_slip_72000.png', content_hash,
+                                             image_extractor=_from_name_async))
+    second = asyncio.run(extract_salary_async(path, 'salary_slip_31000.png', content_hash,
+                                              image_extractor=_from_name_async))
+    assert (first['salary'], second['salary']) == (72000, 31000)
+    assert not second['cached']
+
+def _timed_text(data):
+    started = time.perf_counter()
+    lines = extract_pdf_text(data)
+    return lines, time.perf_counter() - started
+
+def test_text_layer_scan_stays_bounded_on_crafted_files():
+    # Each of these took the old regex scan quadratic time; 15 MB uploads are accepted
+    crafted = [
+        b'1 0 obj <<' * 200000,
+        b'1 0 obj << >> stream\n' * 100000,
+        b'>>stream>>' * 200000,
+        b'1 0 obj << /Length 3 >> stream\nBT\nendstream\n' * 50000,
+    ]
+    for body in crafted:
+        _, seconds = _timed_text(b'%PDF-1.4\n' + body)
+        assert seconds < 1.0
+
+def test_deflate_bomb_is_not_inflated():
+    bomb = zlib.compressobj(9)
+    body = bomb.compress(b'BT (Net Pay 50000) Tj ET ' + b' ' * (64 << 20)) + bomb.flush()
+    data = b'%PDF-1.4\n1 0 obj << /Filter /FlateDecode >> stream\n' + body + b'\nendstream\n'
+    lines, seconds = _timed_text(data)
+    assert lines == [] and seconds < 1.0
+
+def test_stream_lengths_and_line_ends():
+    # A direct /Length is used even when 'endstream' appears inside the data
+    content = b'BT (Net Pay: ) Tj (endstream) Tj ET'
+    direct = (b'%PDF-1.4\n1 0 obj << /Length ' + str(len(content)).encode() + b' >>\r\nstream\r\n'
+              + content + b'\r\nendstream\n')
+    assert extract_pdf_text(direct) == ['Net Pay: endstream']
+    # An indirect /Length falls back to the next 'endstream'
+    content = b'BT (Net Pay: 45,000) Tj ET'
+    indirect = b'%PDF-1.4\n1 0 obj << /Length 9 0 R >> stream\n' + content + b'\nendstream\n'
+    assert extract_pdf_text(indirect) == ['Net Pay: 45,000']
@@ -0,0 +1,68 @@
+import io
+import os
+import tempfile
+import time
+
+import pytest
+
+import app as api
+from tests.conftest import SCRATCH
+from utils.storage import FileStore, ResultCache, RETENTION_DAYS, StorageCompactor, StorageIndex
+
+DAY = 86400
+
+@pytest.fixture
+def stores():
+    root = tempfile.mkdtemp(dir=SCRATCH)
+    index = StorageIndex(os.path.join(root, 'index.sqlite3'))
+    return {kind: FileStore(kind, os.path.join(root, kind), index) for kind in ('letters', 'uploads')}
+
+def _write(store, key, age_days, session_id=None):
+    path = store.path_for(key, f"{key}.pdf")
+    with open(path, 'wb') as f:
+        f.write(b'%PDF')
+    return store.register(key, f"{key}.pdf", path, session_id=session_id,
+                          created_at=time.time() - age_days * DAY)
+
+def test_letters_are_kept_unless_a_retention_period_is_set(stores):
+    assert RETENTION_DAYS['letters'] == 0
+    old_letter = _write(stores['letters'], 'LN-OLD', 400)
+    old_upload = _write(stores['uploads'], 'old-slip', RETENTION_DAYS['uploads'] + 1)
+    new_upload = _write(stores['uploads'], 'new-slip', 1)
+
+    removed = StorageCompactor(list(stores.values()), interval=0).run_once()
+
+    assert removed == {'uploads': 1}
+    assert os.path.exists(old_letter['path']) and stores['letters'].get('LN-OLD')
+    assert not os.path.exists(old_upload['path']) and stores['uploads'].get('old-slip') is None
+    assert os.path.exists(new_upload['path'])
+
+def test_shared_upload_outlives_all_but_its_last_session(stores):
+    uploads = stores['uploads']
+    record, _ = uploads.put_stream(io.BytesIO(b'slip'), '.pdf', session_id='a')
+    _, deduplicated = uploads.put_stream(io.BytesIO(b'slip'), '.pdf', session_id='b')
+    assert deduplicated
+    assert uploads.apply_retention(session_id='a') == 0
+    assert os.path.exists(record['path'])
+    assert uploads.apply_retention(session_id='b') == 1
+    assert not os.path.exists(record['path'])
+
+def test_cached_results_go_with_the_last_upload_of_their_content(stores):
+    uploads = stores['uploads']
+    cache = ResultCache(uploads.index)
+    record, _ = uploads.put_stream(io.BytesIO(b'slip'), '.pdf', session_id='a')
+    kept, _ = uploads.put_stream(io.BytesIO(b'other slip'), '.pdf', session_id='b')
+    cache.put(record['content_hash'], 'salary', {'monthly_salary': 50000})
+    cache.put(kept['content_hash'], 'salary', {'monthly_salary': 60000})
+    # Any other file row with the same content keeps the cached result alive
+    stores['letters'].register('LN-1', 'LN-1.pdf', record['path'], size=4, content_hash=record['content_hash'])
+
+    assert uploads.apply_retention(session_id='a') == 1
+    assert cache.get(record['content_hash'], 'salary') == {'monthly_salary': 50000}
+    stores['letters'].index.delete('letters', ['LN-1'])
+    assert cache.get(record['content_hash'], 'salary') is None
+    assert cache.get(kept['content_hash'], 'salary') == {'monthly_salary': 60000}
+
+@pytest.mark.parametrize('query', ['limit=ten', 'offset=x', 'limit=0', 'offset=-1'])
+def test_pdf_status_rejects_bad_paging(query):
+    assert api.app.test_client().get(f'/api/debug/pdf-status?{query}').status_code == 400
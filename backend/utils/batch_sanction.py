@@ -0,0 +1,237 @@
+"""
+Batch sanction letter generation
+Renders approved applications across a process pool and streams the PDFs
+into a single ZIP archive as they finish
+
+CLI usage (from the backend directory):
+    python -m utils.batch_sanction applications.json -o letters.zip --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Results waiting to be written to the archive are capped at this many per worker,
+# so peak memory depends on the worker count and not on the batch size
+IN_FLIGHT_PER_WORKER = 2
+
+class BatchApplicationError(ValueError):
+    """Raised when an application in the batch cannot be sanctioned"""
+
+def prepare_application(application):
+    """
+    Normalise one approved application into customer data, loan terms and credit info
+    Accepts either a 'phone' from the customer database or a full 'customer' record
+    """
+    from data.customers import get_customer_by_phone
+    from agents.sales_agent import SalesAgent
+
+    customer = application.get('customer')
+    if customer is None:
+        phone = str(application.get('phone', '')).strip()
+        customer = get_customer_by_phone(phone)
+        if customer is None:
+            raise BatchApplicationError(f"Unknown customer phone: {phone or '<missing>'}")
+
+    loan_terms = application.get('loan_terms')
+    if loan_terms is None:
+        try:
+            amount = int(application['loan_amount'])
+            tenure = int(application['tenure_months'])
+        except (KeyError, TypeError, ValueError):
+            raise BatchApplicationError("Application needs loan_amount and tenure_months (or loan_terms)")
+        loan_terms = SalesAgent().discuss_loan_terms(customer, amount, tenure)
+
+    credit_info = application.get('credit_info') or {
+        'credit_score': customer['credit_score'],
+        'bureau': 'CIBIL'
+    }
+
+    return {
+        'customer': customer,
+        'loan_terms': loan_terms,
+        'credit_info': credit_info
+    }
+
+def _render_application(index, application):
+    """Worker process: build the sanction details and render the PDF in memory"""
+    from agents.sanction_agent import SanctionAgent
+    from utils.pdf_generator import render_sanction_letter_pdf
+
+    prepared = prepare_application(application)
+    details = SanctionAgent().build_sanction_details(
+        prepared['customer'], prepared['loan_terms'], prepared['credit_info']
+    )
+    pdf_bytes = render_sanction_letter_pdf(details)
+    return {
+        'index': index,
+        'loan_reference_number': details['loan_reference_number'],
+        'customer_name': details['customer_name'],
+        'pdf_bytes': pdf_bytes
+    }
+
+def iter_rendered_letters(applications, workers=None):
+    """
+    Render applications on a process pool, yielding (index, result, error) as each finishes
+    Only a bounded number of applications are submitted ahead of the consumer
+    """
+    workers = max(1, workers or DEFAULT_WORKERS)
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+    # multiprocessing is only needed once a batch actually runs
+    from concurrent.futures import ProcessPoolExecutor
+
+    pending = {}
+    source = iter(enumerate(applications))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            yield from _drain_pool(pool, source, pending, max_in_flight)
+        finally:
+            # Consumer went away (e.g. client disconnected): drop work not yet started
+            for future in pending:
+                future.cancel()
+
+def _drain_pool(pool, source, pending, max_in_flight):
+    """Keep the pool topped up to max_in_flight and yield results as they complete"""
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_in_flight:
+            try:
+                index, application = next(source)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[pool.submit(_render_application, index, application)] = index
+
+        if not pending:
+            break
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                yield index, None, str(e)
+
+class _ZipStreamBuffer:
+    """Write-only sink that lets zipfile stream to a non-seekable destination"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_sanction_zip(applications, workers=None, progress=None):
+    """
+    Generate a ZIP archive of sanction letters, yielding bytes as each PDF is added
+    A manifest.json listing generated letters and failures is written last
+    progress(done, total, failed) is called after every application when given
+    """
+    applications = list(applications)
+    total = len(applications)
+    buffer = _ZipStreamBuffer()
+    manifest = {'total': total, 'generated': [], 'failed': []}
+    started = time.time()
+
+    # PDFs are already compressed, so the archive stores them as-is
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        completed = 0
+        for index, result, error in iter_rendered_letters(applications, workers):
+            completed += 1
+            if error:
+                manifest['failed'].append({'index': index, 'error': error})
+            else:
+                arcname = f"{index + 1:06d}_sanction_letter_{result['loan_reference_number']}.pdf"
+                archive.writestr(arcname, result['pdf_bytes'])
+                manifest['generated'].append({
+                    'index': index,
+                    'file': arcname,
+                    'loan_reference_number': result['loan_reference_number'],
+                    'customer_name': result['customer_name']
+                })
+
+            if progress:
+                progress(completed, total, len(manifest['failed']))
+
+            chunk = buffer.drain()
+            if chunk:
+                yield chunk
+
+        manifest['generated'].sort(key=lambda item: item['index'])
+        manifest['failed'].sort(key=lambda item: item['index'])
+        manifest['elapsed_seconds'] = round(time.time() - started, 3)
+        archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+
+    chunk = buffer.drain()
+    if chunk:
+        yield chunk
+
+def write_sanction_zip(applications, output_path, workers=None, progress=None):
+    """Write the streamed archive to a file (or stdout when output_path is '-')"""
+    if output_path == '-':
+        out = sys.stdout.buffer
+        for chunk in stream_sanction_zip(applications, workers, progress):
+            out.write(chunk)
+        out.flush()
+        return
+
+    tmp_path = f"{output_path}.part"
+    with open(tmp_path, 'wb') as out:
+        for chunk in stream_sanction_zip(applications, workers, progress):
+            out.write(chunk)
+    os.replace(tmp_path, output_path)
+
+def load_applications(path):
+    """Read applications from a JSON list or a JSON-lines file"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        return json.loads(stripped)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def _print_progress(done, total, failed):
+    sys.stderr.write(f"\r[Batch Sanction] {done}/{total} letters ({failed} failed)")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sanction letters for a batch of approved applications")
+    parser.add_argument('applications', help="JSON list or JSON-lines file of approved applications")
+    parser.add_argument('-o', '--output', default='sanction_letters.zip', help="ZIP archive to write ('-' for stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help="Number of worker processes")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Do not report progress")
+    args = parser.parse_args(argv)
+
+    applications = load_applications(args.applications)
+    progress = None if args.quiet else _print_progress
+    write_sanction_zip(applications, args.output, args.workers, progress)
+
+    if args.output != '-':
+        print(f"[Batch Sanction] Wrote {len(applications)} applications to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
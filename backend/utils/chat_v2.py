@@ -0,0 +1,137 @@
+"""
+Compact v2 chat responses
+v1 responses repeat fields at the top level and under 'data' and resend the whole
+sanction letter (terms and documents included) on every completed turn. v2 keeps a
+per-session view of what the client has been sent and returns only the fields that
+changed since the client's last known version. Static blocks (terms, documents) are
+replaced by references the client fetches once from /api/v2/static/<ref> and caches.
+
+Response shape:
+    {"session_id": ..., "version": "<epoch>.<n>", "full": false,
+     "reply": "...", "action": "...", "changes": {"stage": ..., "loan_terms": {...}}}
+"""
+import hashlib
+import secrets
+
+from utils.json_codec import dumps
+
+# Fields a turn response can carry -> name in the v2 view
+STATE_FIELDS = {
+    'customer_data': 'customer',
+    'loan_amount': 'loan_amount',
+    'suggestions': 'suggestions',
+    'loan_terms': 'loan_terms',
+    'credit_info': 'credit_info',
+    'rejection_reason': 'rejection_reason',
+    'sanction_result': 'sanction',
+    'pdf_path': 'pdf',
+}
+
+# Key in conversation_state, so the view is persisted with the session
+VIEW_KEY = 'client_view'
+
+# Sanction-letter lists replaced by references: details key -> reference key
+STATIC_DETAIL_KEYS = {'terms': 'terms_ref', 'documents_required': 'documents_ref'}
+
+_static = {}
+
+def _load_static_blocks():
+    from agents.sanction_agent import SanctionAgent
+    agent = SanctionAgent()
+    blocks = {
+        'terms': agent._generate_terms_and_conditions(),
+        'documents_required': agent._get_required_documents(),
+    }
+    for key, value in blocks.items():
+        body = dumps(value)
+        ref = f"{key.split('_')[0]}-{hashlib.sha256(body).hexdigest()[:12]}"
+        _static[ref] = {'key': key, 'value': value, 'body': body}
+
+def static_block(ref):
+    """Pre-serialized JSON body of a static block, or None for an unknown reference"""
+    if not _static:
+        _load_static_blocks()
+    block = _static.get(ref)
+    return block['body'] if block else None
+
+def _ref_for(key, value):
+    if not _static:
+        _load_static_blocks()
+    for ref, block in _static.items():
+        if block['key'] == key and block['value'] == value:
+            return ref
+    return None
+
+def compact_sanction(sanction_result):
+    """Sanction result without the server-side path and with static lists as references"""
+    if not sanction_result:
+        return sanction_result
+    compact = {k: v for k, v in sanction_result.items() if k not in ('pdf_path', 'sanction_details')}
+    details = dict(sanction_result.get('sanction_details') or {})
+    for key, ref_key in STATIC_DETAIL_KEYS.items():
+        ref = _ref_for(key, details.get(key))
+        if ref:
+            # Letters with non-standard terms keep them inline
+            details.pop(key)
+            details[ref_key] = ref
+    compact['details'] = details
+    return compact
+
+def _new_view():
+    return {'epoch': secrets.token_hex(4), 'version': 0, 'fields': {}, 'changed_at': {}}
+
+def apply_turn(conversation_state, response):
+    """Fold one agent response into the session's view; returns the view"""
+    view = conversation_state.get(VIEW_KEY)
+    if view is None:
+        view = _new_view()
+        conversation_state[VIEW_KEY] = view
+
+    updates = {'stage': response.get('stage')}
+    for response_key, field in STATE_FIELDS.items():
+        if response_key in response:
+            value = response[response_key]
+            updates[field] = compact_sanction(value) if field == 'sanction' else value
+
+    changed = [f for f, v in updates.items() if f not in view['fields'] or view['fields'][f] != v]
+    if changed:
+        view['version'] += 1
+        for field in changed:
+            view['fields'][field] = updates[field]
+            view['changed_at'][field] = view['version']
+    return view
+
+def version_token(view):
+    return f"{view['epoch']}.{view['version']}"
+
+def delta(view, known_version=None):
+    """(full, changes) since known_version; unknown or stale versions get the full view"""
+    epoch, _, number = (known_version or '').partition('.')
+    if epoch != view['epoch'] or not number.isdigit() or int(number) > view['version']:
+        return True, dict(view['fields'])
+    since = int(number)
+    return False, {f: view['fields'][f] for f, at in view['changed_at'].items() if at > since}
+
+def build_response(session_id, conversation_state, response, known_version=None, **extra):
+    """Apply a turn and build the v2 payload for it"""
+    view = apply_turn(conversation_state, response)
+    full, changes = delta(view, known_version)
+    payload = {
+        'session_id': session_id,
+        'version': version_token(view),
+        'full': full,
+        'reply': response.get('response'),
+        'action': response.get('action'),
+        'changes': changes,
+    }
+    payload.update(extra)
+    return payload
+
+def state_response(session_id, conversation_state, known_version=None):
+    """Payload for a resync request without a new turn"""
+    view = conversation_state.get(VIEW_KEY)
+    if view is None:
+        view = _new_view()
+        conversation_state[VIEW_KEY] = view
+    full, changes = delta(view, known_version)
+    return {'session_id': session_id, 'version': version_token(view), 'full': full, 'changes': changes}
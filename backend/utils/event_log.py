@@ -0,0 +1,338 @@
+"""
+Event-sourced conversation log
+With EVENT_LOG=on every stage transition (and reset) is appended to a log as one compact
+JSON line: time, session, from and to stage, and the fields the stage left behind
+(customer, amount, terms, underwriting result, sanction). Concurrent requests share
+fsyncs: a background writer takes whatever is queued, writes it in one go and fsyncs
+once, and each request waits only for the commit of its own batch (group commit).
+
+    EVENT_LOG=on                     off by default
+    EVENT_LOG_DIR=event_log
+    EVENT_LOG_SEGMENT_BYTES=16777216 current.log is sealed as a segment past this size
+    EVENT_LOG_FSYNC=1                0 leaves flushing to the OS
+
+Sealed segments are folded into snapshot.json (the latest state of every live session)
+and moved to archive/, so a restart rebuilds sessions from the snapshot plus the tail
+(the segments not folded yet and current.log) instead of the whole history. Completed
+conversations and ones idle past SESSION_TTL_SECONDS are left out of the snapshot, so
+customer details do not outlive the session there; the archive and the tail together
+stay the full audit trail of every underwriting decision and sanction:
+
+    python -m utils.event_log rebuild                       # sessions rebuilt, and how fast
+    python -m utils.event_log audit --session <session_id>  # underwriting decisions and sanctions
+    python -m utils.event_log compact                       # fold sealed segments now
+
+Several worker processes can share one directory: appends take a shared lock on
+log.lock and sealing takes it exclusively, so no write lands in a sealed segment.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development only
+    fcntl = None
+
+from utils.json_codec import dumps
+from utils.session_store import SESSION_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOG_DIR = os.environ.get('EVENT_LOG_DIR', 'event_log')
+SEGMENT_BYTES = int(os.environ.get('EVENT_LOG_SEGMENT_BYTES', 16 * 1024 * 1024))
+FSYNC = os.environ.get('EVENT_LOG_FSYNC', '1') == '1'
+
+ENABLED = os.environ.get('EVENT_LOG', 'off').lower() in ('on', '1', 'true')
+
+CURRENT = 'current.log'
+SNAPSHOT = 'snapshot.json'
+ARCHIVE = 'archive'
+SEGMENT_PREFIX = 'segment-'
+
+# Transitions out of these stages carry the decisions compliance asks about
+AUDITED_STAGES = ('processing_underwriting', 'generating_sanction')
+
+class _FileLock:
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl:
+            try:
+                fcntl.flock(self.fd, self.mode)
+            except BaseException:
+                os.close(self.fd)
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)  # closing releases the lock
+
+def _shared(directory):
+    return _FileLock(os.path.join(directory, 'log.lock'), fcntl.LOCK_SH if fcntl else None)
+
+def _exclusive(directory):
+    return _FileLock(os.path.join(directory, 'log.lock'), fcntl.LOCK_EX if fcntl else None)
+
+def _compacting(directory, blocking=True):
+    """Held while folding segments into the snapshot, and while reading them back"""
+    mode = (fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB) if fcntl else None
+    return _FileLock(os.path.join(directory, 'compact.lock'), mode)
+
+class EventLog:
+    """Appends events to <directory>/current.log from a group-committing writer thread"""
+
+    def __init__(self, directory=EVENT_LOG_DIR, segment_bytes=SEGMENT_BYTES, fsync=FSYNC):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        os.makedirs(os.path.join(directory, ARCHIVE), exist_ok=True)
+        self._fd = None
+        self._changed = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._committed = 0
+        self.batches = 0
+        self._writer = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._writer.start()
+
+    def append(self, event, wait=True):
+        """Queue an event; with wait, return once it is written (and fsynced)"""
+        line = dumps(event) + b'\n'
+        with self._changed:
+            self._pending.append(line)
+            self._appended += 1
+            ticket = self._appended
+            self._changed.notify_all()
+            while wait and self._committed < ticket:
+                self._changed.wait()
+        return ticket
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+                batch, self._pending = self._pending, []
+                last = self._appended
+            try:
+                size = self._write(b''.join(batch))
+            except Exception:
+                # Release the callers anyway rather than hang every request on a broken disk
+                logger.exception("Event log write failed", extra={'events': len(batch)})
+                size = 0
+            with self._changed:
+                self._committed = last
+                self.batches += 1
+                self._changed.notify_all()
+            if size >= self.segment_bytes:
+                try:
+                    self.seal()
+                except Exception:
+                    logger.exception("Event log segment seal failed")
+
+    def _write(self, data):
+        path = os.path.join(self.directory, CURRENT)
+        with _shared(self.directory):
+            # Another process may have sealed current.log since our last batch
+            if self._fd is not None and os.fstat(self._fd).st_ino != _inode(path):
+                os.close(self._fd)
+                self._fd = None
+            if self._fd is None:
+                self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.fsync:
+                os.fsync(self._fd)
+            return os.fstat(self._fd).st_size
+
+    def seal(self):
+        """Rename current.log to a segment and fold sealed segments into the snapshot"""
+        path = os.path.join(self.directory, CURRENT)
+        with _exclusive(self.directory):
+            try:
+                if os.stat(path).st_size < self.segment_bytes:
+                    return  # sealed by another process already
+            except FileNotFoundError:
+                return
+            os.rename(path, os.path.join(self.directory, f"{SEGMENT_PREFIX}{time.time_ns():020d}.log"))
+        threading.Thread(target=compact, args=(self.directory,), name='event-log-compact', daemon=True).start()
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+def _segments(directory, sub=''):
+    folder = os.path.join(directory, sub)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+            if name.startswith(SEGMENT_PREFIX) and name.endswith('.log')]
+
+def read_events(path):
+    """Events in a log file; a line torn by a crash mid-write is skipped"""
+    with open(path, 'rb') as handle:
+        for line in handle:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning("Skipping unreadable event log line", extra={'path': path})
+
+def apply_event(sessions, event):
+    session_id = event['s']
+    if event['f'] == 'initial' or event['to'] == 'initial':
+        # A conversation (re)starting: nothing from the previous one carries over
+        state = sessions[session_id] = {}
+    else:
+        state = sessions.setdefault(session_id, {})
+    state.update(event.get('d') or {})
+    state['stage'] = event['to']
+    state['stage_entered_at'] = event['t']
+
+def _prune(sessions, ttl_seconds):
+    """Drop completed conversations and ones idle past ttl_seconds; returns how many"""
+    cutoff = time.time() - ttl_seconds
+    finished = [session_id for session_id, state in sessions.items()
+                if state.get('stage') == 'completed' or (state.get('stage_entered_at') or 0) < cutoff]
+    for session_id in finished:
+        del sessions[session_id]
+    return len(finished)
+
+def _load_snapshot(directory):
+    path = os.path.join(directory, SNAPSHOT)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle)['sessions']
+
+def rebuild(directory=EVENT_LOG_DIR, ttl_seconds=SESSION_TTL_SECONDS):
+    """Latest conversation_state fields per live session: snapshot, then sealed segments, then current.log"""
+    if not os.path.isdir(directory):
+        return {}
+    with _compacting(directory):
+        sessions = _load_snapshot(directory)
+        tail = _segments(directory) + [os.path.join(directory, CURRENT)]
+        for path in tail:
+            if os.path.exists(path):
+                for event in read_events(path):
+                    apply_event(sessions, event)
+    _prune(sessions, ttl_seconds)
+    return sessions
+
+def compact(directory=EVENT_LOG_DIR, ttl_seconds=SESSION_TTL_SECONDS):
+    """Fold sealed segments into snapshot.json and archive them; returns the number folded"""
+    try:
+        with _compacting(directory, blocking=False):
+            return _fold_segments(directory, ttl_seconds)
+    except BlockingIOError:
+        return 0  # another process is compacting
+
+def _fold_segments(directory, ttl_seconds=SESSION_TTL_SECONDS):
+    segments = _segments(directory)
+    if not segments:
+        return 0
+    started = time.perf_counter()
+    sessions = _load_snapshot(directory)
+    for path in segments:
+        for event in read_events(path):
+            apply_event(sessions, event)
+    pruned = _prune(sessions, ttl_seconds)
+    snapshot_path = os.path.join(directory, SNAPSHOT)
+    temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as handle:
+        handle.write(dumps({'through': os.path.basename(segments[-1]), 'sessions': sessions}))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, snapshot_path)
+    for path in segments:
+        os.rename(path, os.path.join(directory, ARCHIVE, os.path.basename(path)))
+    logger.info("Event log compacted", extra={
+        'segments': len(segments), 'sessions': len(sessions), 'pruned': pruned,
+        'seconds': round(time.perf_counter() - started, 3)
+    })
+    return len(segments)
+
+def audit_events(directory=EVENT_LOG_DIR, session_id=None):
+    """Underwriting decisions and sanctions, oldest first, from the archive and the tail"""
+    paths = _segments(directory, ARCHIVE) + _segments(directory) + [os.path.join(directory, CURRENT)]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for event in read_events(path):
+            if event['f'] in AUDITED_STAGES and (session_id is None or event['s'] == session_id):
+                yield event
+
+def restore_sessions(store, factory, max_age_seconds=None):
+    """Put rebuilt sessions missing from store back into it; returns how many"""
+    started = time.perf_counter()
+    restored = 0
+    for session_id, state in rebuild(ttl_seconds=max_age_seconds or SESSION_TTL_SECONDS).items():
+        if session_id in store:
+            continue
+        master = factory(session_id=session_id)
+        master.conversation_state.update(state)
+        store.save(master)
+        restored += 1
+    logger.info("Sessions restored from the event log", extra={
+        'sessions': restored, 'seconds': round(time.perf_counter() - started, 3)
+    })
+    return restored
+
+_log = None
+_pid = None
+_lock = threading.Lock()
+
+def get_log():
+    """Process-wide log; after a fork the child starts its own writer thread"""
+    global _log, _pid
+    with _lock:
+        if _pid != os.getpid():
+            _log = EventLog()
+            _pid = os.getpid()
+        return _log
+
+def record_transition(agent, source, target, changes):
+    """conversation_flow hook; the turn waits for the group commit but never fails on the log"""
+    try:
+        event = {'t': agent.conversation_state.get('stage_entered_at'), 's': agent.session_id,
+                 'f': source, 'to': target}
+        if changes:
+            event['d'] = changes
+        get_log().append(event)
+    except Exception:
+        logger.exception("Event log append failed", extra={'session_id': agent.session_id})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild, audit and compact the conversation event log")
+    parser.add_argument('command', choices=['rebuild', 'audit', 'compact'])
+    parser.add_argument('--dir', default=EVENT_LOG_DIR)
+    parser.add_argument('--session', help="Only this session")
+    args = parser.parse_args(argv)
+
+    if args.command == 'compact':
+        print(f"{compact(args.dir)} segments folded into the snapshot")
+    elif args.command == 'audit':
+        for event in audit_events(args.dir, args.session):
+            print(json.dumps(event, default=str))
+    else:
+        started = time.perf_counter()
+        sessions = rebuild(args.dir)
+        seconds = time.perf_counter() - started
+        if args.session:
+            print(json.dumps(sessions.get(args.session), indent=2, default=str))
+        else:
+            print(f"{len(sessions)} sessions rebuilt in {seconds:.3f} s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Concurrent fan-out of independent steps
+Runs a handful of independent, I/O-bound steps (credit pull, salary-slip extraction) on
+a shared worker pool and waits for all of them, each with its own timeout, so a turn
+takes as long as its slowest step instead of the sum. A step that times out keeps
+running in the background (threads cannot be cancelled); its result is discarded.
+fan_out_async does the same for coroutines on the running event loop, where a waiting
+step holds no thread and a step that times out is cancelled.
+
+    FANOUT_WORKERS=8
+    FANOUT_MAX_QUEUE=64
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from utils.worker_pools import get_pool, PoolSaturated
+
+WORKERS = int(os.environ.get('FANOUT_WORKERS', 8))
+MAX_QUEUE = int(os.environ.get('FANOUT_MAX_QUEUE', 64))
+
+class StepTimeout(TimeoutError):
+    def __init__(self, step, seconds):
+        super().__init__(f"{step} did not finish within {seconds}s")
+        self.step = step
+        self.seconds = seconds
+
+def _call(fn):
+    try:
+        return fn()
+    except Exception as e:
+        return e
+
+def fan_out(steps, concurrent=True):
+    """
+    steps: name -> (zero-argument callable, timeout in seconds)
+    Returns name -> result, or the exception the step raised (StepTimeout when it ran out
+    of time). With concurrent=False, or when the pool is saturated, steps run inline in
+    order and timeouts are not enforced.
+    """
+    if not concurrent:
+        return {name: _call(fn) for name, (fn, _) in steps.items()}
+    pool = get_pool('fanout', WORKERS, MAX_QUEUE)
+    futures = {}
+    for name, (fn, _) in steps.items():
+        try:
+            # Each step sees the caller's context (trace, session) on the worker thread
+            futures[name] = pool.submit(contextvars.copy_context().run, fn)
+        except PoolSaturated:
+            futures[name] = None
+    started = time.monotonic()
+    results = {}
+    for name, (fn, timeout) in steps.items():
+        future = futures[name]
+        if future is None:
+            results[name] = _call(fn)
+            continue
+        try:
+            results[name] = future.result(timeout=max(0.0, timeout - (time.monotonic() - started)))
+        except FutureTimeout:
+            results[name] = StepTimeout(name, timeout)
+        except Exception as e:
+            results[name] = e
+    return results
+
+async def _await_step(name, fn, timeout):
+    try:
+        return await asyncio.wait_for(fn(), timeout)
+    except asyncio.TimeoutError:
+        return StepTimeout(name, timeout)
+    except Exception as e:
+        return e
+
+async def fan_out_async(steps, concurrent=True):
+    """
+    fan_out for coroutines: steps map name -> (zero-argument coroutine function, timeout)
+    With concurrent=False steps are awaited one after another, in order.
+    """
+    if not concurrent:
+        return {name: await _await_step(name, fn, timeout) for name, (fn, timeout) in steps.items()}
+    results = await asyncio.gather(*(_await_step(name, fn, timeout) for name, (fn, timeout) in steps.items()))
+    return dict(zip(steps, results))
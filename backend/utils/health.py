@@ -0,0 +1,162 @@
+"""
+Readiness probes
+A background thread checks the instance's dependencies every HEALTH_PROBE_INTERVAL
+seconds and keeps the latest report, so /api/health/ready only reads a snapshot and
+health-check polling adds no load. Each probe returns 'ok', 'degraded' (still serving,
+details say what is wrong) or 'down' (the instance cannot serve and should get no traffic).
+
+    disk        letters and uploads directories writable, free space above HEALTH_MIN_FREE_MB
+    sessions    the session backend answers a query
+    bureau      the credit bureau answers a ping (no report is pulled), within HEALTH_BUREAU_SLOW_SECONDS
+    pools       no background worker pool is saturated
+
+    HEALTH_PROBE_INTERVAL=10
+    HEALTH_MIN_FREE_MB=100
+    HEALTH_BUREAU_SLOW_SECONDS=2
+
+The monitor is started when a worker starts (gunicorn post_fork, or before the dev
+server runs); until its first round of probes finishes the report's status is 'starting'.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+
+from utils.storage import STORE_ROOTS
+from utils.worker_pools import all_pools
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 10))
+HEALTH_MIN_FREE_MB = int(os.environ.get('HEALTH_MIN_FREE_MB', 100))
+HEALTH_BUREAU_SLOW_SECONDS = float(os.environ.get('HEALTH_BUREAU_SLOW_SECONDS', 2))
+
+OK, DEGRADED, DOWN = 'ok', 'degraded', 'down'
+STARTING = 'starting'
+_SEVERITY = {OK: 0, DEGRADED: 1, DOWN: 2}
+
+# A report older than this many intervals means the probe thread is stuck
+STALE_INTERVALS = 3
+
+def probe_disk():
+    details = {}
+    status = OK
+    for kind, root in STORE_ROOTS.items():
+        os.makedirs(root, exist_ok=True)
+        # Write and remove a file: catches read-only mounts and full disks that os.access misses
+        path = os.path.join(root, f".health-{os.getpid()}")
+        with open(path, 'wb') as handle:
+            handle.write(b'ok')
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.remove(path)
+        free_mb = shutil.disk_usage(root).free // (1024 * 1024)
+        details[kind] = {'path': root, 'free_mb': free_mb}
+        if free_mb < HEALTH_MIN_FREE_MB:
+            status = DEGRADED
+            details[kind]['error'] = f"less than {HEALTH_MIN_FREE_MB} MB free"
+    return status, details
+
+def session_probe(store):
+    def probe_sessions():
+        return OK, {'backend': store.backend, 'sessions': store.count()}
+    return probe_sessions
+
+def probe_bureau():
+    from agents.underwriting_agent import UnderwritingAgent
+    started = time.perf_counter()
+    bureau = UnderwritingAgent().ping_bureau()
+    seconds = time.perf_counter() - started
+    details = {'bureau': bureau, 'seconds': round(seconds, 3)}
+    if seconds > HEALTH_BUREAU_SLOW_SECONDS:
+        details['error'] = f"slower than {HEALTH_BUREAU_SLOW_SECONDS}s"
+        return DEGRADED, details
+    return OK, details
+
+def probe_pools():
+    details = {pool.name: pool.stats() for pool in all_pools()}
+    saturated = [name for name, stats in details.items() if stats['queued'] >= stats['max_queue']]
+    if saturated:
+        return DEGRADED, dict(details, error=f"saturated: {', '.join(saturated)}")
+    return OK, details
+
+class HealthMonitor(threading.Thread):
+    """Runs the probes on an interval and keeps the latest report"""
+
+    def __init__(self, probes, interval=HEALTH_PROBE_INTERVAL):
+        super().__init__(name='health-monitor', daemon=True)
+        self.probes = probes
+        self.interval = interval
+        self._report = None
+        self._started_at = None
+        self._stop_event = threading.Event()
+
+    def run_once(self):
+        checks = {}
+        for name, (probe, failure) in self.probes.items():
+            started = time.perf_counter()
+            try:
+                status, details = probe()
+            except Exception as e:
+                status, details = failure, {'error': f"{type(e).__name__}: {e}"}
+            checks[name] = dict(details, status=status, probe_ms=round((time.perf_counter() - started) * 1000, 1))
+        status = max((check['status'] for check in checks.values()), key=_SEVERITY.get, default=OK)
+        previous = self._report
+        self._report = {'status': status, 'checked_at': time.time(), 'checks': checks}
+        if previous is None or previous['status'] != status:
+            log = logger.info if status == OK else logger.warning
+            log("Readiness %s", status, extra={'checks': {name: c['status'] for name, c in checks.items()}})
+        return self._report
+
+    def report(self):
+        """Latest report with its age; 'down' if the probe thread has stopped refreshing it"""
+        report = self._report
+        if report is None:
+            waited = time.time() - (self._started_at or time.time())
+            if self._started_at is None or waited > STALE_INTERVALS * self.interval:
+                return {'status': DOWN, 'error': 'probes have not run yet', 'checks': {}}
+            return {'status': STARTING, 'checks': {}}
+        age = time.time() - report['checked_at']
+        report = dict(report, age_seconds=round(age, 1))
+        if age > STALE_INTERVALS * self.interval:
+            report.update(status=DOWN, error=f"probe report is {age:.0f}s old")
+        return report
+
+    def start(self):
+        self._started_at = time.time()
+        super().start()
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Health probes failed")
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+
+_monitor = None
+_pid = None
+_lock = threading.Lock()
+
+def get_monitor(session_store):
+    """Process-wide monitor; the first call starts its thread, which runs the first probes at once"""
+    global _monitor, _pid
+    with _lock:
+        if _pid != os.getpid():
+            # Threads do not survive fork, so each worker starts its own
+            _monitor = HealthMonitor({
+                # name -> (probe, status when it raises)
+                'disk': (probe_disk, DOWN),
+                'sessions': (session_probe(session_store), DOWN),
+                # Every instance shares the bureau: pulling them all out would not help
+                'bureau': (probe_bureau, DEGRADED),
+                'pools': (probe_pools, DEGRADED),
+            })
+            _monitor.start()
+            _pid = os.getpid()
+        return _monitor
@@ -0,0 +1,216 @@
+"""
+Idempotency keys for chat turns and uploads
+Clients retrying after a timeout send the same Idempotency-Key header. The first request
+for a (session, key) runs and its response is kept for IDEMPOTENCY_TTL_SECONDS; a retry
+gets the stored response without the agents running again (no second underwriting pass,
+no second sanction letter). A duplicate that arrives while the first is still running
+waits for it, up to IDEMPOTENCY_WAIT_SECONDS, then gets 409. The key is stored with a
+fingerprint of the request (method, path and body); reusing it for a different request
+gets 422 instead of the first request's response.
+
+    IDEMPOTENCY_BACKEND=memory | sqlite    sqlite is the default under gunicorn.conf.py
+    IDEMPOTENCY_DB_PATH=idempotency.sqlite3
+    IDEMPOTENCY_TTL_SECONDS=86400
+    IDEMPOTENCY_MAX_ENTRIES=10000          memory backend only; oldest dropped first
+    IDEMPOTENCY_WAIT_SECONDS=60
+
+Only successful responses are stored, so a retry of a failed request runs again.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_DB_PATH = os.environ.get('IDEMPOTENCY_DB_PATH', 'idempotency.sqlite3')
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 60))
+
+MAX_KEY_LENGTH = 255
+# A claim whose request died without releasing it frees up after this long
+PENDING_TTL_SECONDS = 300
+SQLITE_POLL_SECONDS = 0.05
+PURGE_EVERY = 1000
+
+class InProgress(Exception):
+    """The first request with this key is still running after the wait"""
+
+class KeyReused(Exception):
+    """The key was first used for a request with a different fingerprint"""
+
+class StoredResponse:
+    __slots__ = ('status', 'body', 'content_type')
+
+    def __init__(self, status, body, content_type):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+class MemoryIdempotencyStore:
+    """Responses kept in this process; fine for a single worker"""
+
+    backend = 'memory'
+
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # (session_id, key) -> (expires_at, StoredResponse or None while running, fingerprint)
+        self._entries = OrderedDict()
+        self._changed = threading.Condition()
+
+    def claim(self, session_id, key, fingerprint=None, wait=IDEMPOTENCY_WAIT_SECONDS):
+        """
+        The stored response for a completed request, or None when the caller now owns the
+        key and must complete() or release() it; raises InProgress after waiting `wait`,
+        and KeyReused when the key was claimed with another fingerprint
+        """
+        scope = (session_id, key)
+        deadline = time.monotonic() + wait
+        with self._changed:
+            while True:
+                now = time.time()
+                entry = self._entries.get(scope)
+                if entry is None or entry[0] < now:
+                    self._entries.pop(scope, None)
+                    self._entries[scope] = (now + PENDING_TTL_SECONDS, None, fingerprint)
+                    self._trim()
+                    return None
+                if fingerprint and entry[2] and entry[2] != fingerprint:
+                    raise KeyReused(key)
+                if entry[1] is not None:
+                    return entry[1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise InProgress(key)
+                self._changed.wait(remaining)
+
+    def complete(self, session_id, key, stored):
+        with self._changed:
+            entry = self._entries.pop((session_id, key), None)
+            fingerprint = entry[2] if entry else None
+            self._entries[(session_id, key)] = (time.time() + self.ttl_seconds, stored, fingerprint)
+            self._trim()
+            self._changed.notify_all()
+
+    def release(self, session_id, key):
+        """Give up a claim without storing anything; a waiting duplicate takes it over"""
+        with self._changed:
+            self._entries.pop((session_id, key), None)
+            self._changed.notify_all()
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def count(self):
+        with self._changed:
+            return len(self._entries)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    session_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status INTEGER,
+    body BLOB,
+    content_type TEXT,
+    fingerprint TEXT,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (session_id, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at);
+"""
+
+class SqliteIdempotencyStore:
+    """Responses shared by all worker processes; duplicates on other workers poll for the result"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path=IDEMPOTENCY_DB_PATH, ttl_seconds=IDEMPOTENCY_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._completed = 0
+        conn = self.connection()
+        conn.executescript(_SCHEMA)
+        if 'fingerprint' not in [column[1] for column in conn.execute("PRAGMA table_info(idempotency)")]:
+            conn.execute("ALTER TABLE idempotency ADD COLUMN fingerprint TEXT")  # created before fingerprints
+        self.purge_expired()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork, so reopen in a child process
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def claim(self, session_id, key, fingerprint=None, wait=IDEMPOTENCY_WAIT_SECONDS):
+        conn = self.connection()
+        deadline = time.monotonic() + wait
+        while True:
+            now = time.time()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT status, body, content_type, expires_at, fingerprint FROM idempotency "
+                    "WHERE session_id = ? AND key = ?",
+                    (session_id, key)
+                ).fetchone()
+                if row is None or row[3] < now:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO idempotency (session_id, key, fingerprint, expires_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (session_id, key, fingerprint, now + PENDING_TTL_SECONDS)
+                    )
+                    row = None
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if row is None:
+                return None
+            if fingerprint and row[4] and row[4] != fingerprint:
+                raise KeyReused(key)
+            if row[0] is not None:
+                return StoredResponse(row[0], row[1], row[2])
+            if time.monotonic() >= deadline:
+                raise InProgress(key)
+            time.sleep(SQLITE_POLL_SECONDS)
+
+    def complete(self, session_id, key, stored):
+        # UPDATE keeps the fingerprint the claim stored
+        self.connection().execute(
+            "UPDATE idempotency SET status = ?, body = ?, content_type = ?, expires_at = ? "
+            "WHERE session_id = ? AND key = ?",
+            (stored.status, stored.body, stored.content_type, time.time() + self.ttl_seconds, session_id, key)
+        )
+        self._completed += 1
+        if self._completed % PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def release(self, session_id, key):
+        self.connection().execute(
+            "DELETE FROM idempotency WHERE session_id = ? AND key = ? AND status IS NULL", (session_id, key)
+        )
+
+    def purge_expired(self):
+        cursor = self.connection().execute("DELETE FROM idempotency WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+def create_idempotency_store(backend=None):
+    backend = (backend or os.environ.get('IDEMPOTENCY_BACKEND', 'memory')).lower()
+    if backend == 'sqlite':
+        return SqliteIdempotencyStore()
+    if backend == 'memory':
+        return MemoryIdempotencyStore()
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {backend}")
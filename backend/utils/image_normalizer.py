@@ -0,0 +1,184 @@
+"""
+Salary-slip image normalization
+Phone photos arrive as multi-megabyte colour PNGs/JPEGs. Before extraction they are
+downscaled to an OCR-friendly size, converted to grayscale, stripped of metadata and
+re-encoded compactly on a background worker pool. The original upload is kept.
+"""
+import io
+import logging
+import os
+import threading
+import time
+
+from utils.storage import get_store
+from utils.worker_pools import get_pool, PoolSaturated
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Long edge in pixels; about 200 dpi for an A4 slip, plenty for OCR
+MAX_SIDE = int(os.environ.get('NORMALIZE_MAX_SIDE', 2000))
+JPEG_QUALITY = int(os.environ.get('NORMALIZE_JPEG_QUALITY', 85))
+WORKERS = int(os.environ.get('NORMALIZE_WORKERS', 2))
+MAX_QUEUE = int(os.environ.get('NORMALIZE_MAX_QUEUE', 50))
+
+# How long extraction waits for an in-flight normalization before using the original
+WAIT_SECONDS = float(os.environ.get('NORMALIZE_WAIT_SECONDS', 5))
+
+_stats_lock = threading.Lock()
+_stats = {
+    'jobs': 0,
+    'failures': 0,
+    'skipped_saturated': 0,
+    'original_bytes': 0,
+    'normalized_bytes': 0,
+    'normalize_seconds': 0.0,
+    'extractions': {},
+}
+_in_flight = {}
+
+def _record(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+def record_extraction(source, seconds):
+    """Extraction timing by source ('pdf_text', 'normalized', 'original' or 'cache')"""
+    with _stats_lock:
+        entry = _stats['extractions'].setdefault(source, {'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+
+def normalization_stats():
+    """Storage savings and timing, suitable for the stats endpoints"""
+    with _stats_lock:
+        stats = dict(_stats)
+        stats['extractions'] = {
+            source: dict(entry, avg_seconds=round(entry['seconds'] / entry['count'], 4))
+            for source, entry in _stats['extractions'].items()
+        }
+    stats['bytes_saved'] = stats['original_bytes'] - stats['normalized_bytes']
+    if stats['original_bytes']:
+        stats['size_ratio'] = round(stats['normalized_bytes'] / stats['original_bytes'], 4)
+    if stats['jobs']:
+        stats['avg_normalize_seconds'] = round(stats['normalize_seconds'] / stats['jobs'], 4)
+    return stats
+
+def normalize_image_bytes(data, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    """
+    Downscale, grayscale and re-encode an image without any metadata
+    Returns (encoded_bytes, extension)
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        # Apply camera rotation before the EXIF block is dropped
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # Transparent areas become white paper, not black
+            rgba = image.convert('RGBA')
+            background = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, rgba)
+
+        gray = image.convert('L')
+        gray.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        # A fresh image carries no EXIF/ICC/text chunks
+        clean = Image.frombytes('L', gray.size, gray.tobytes())
+
+    jpeg = io.BytesIO()
+    clean.save(jpeg, format='JPEG', quality=quality, optimize=True)
+    best, extension = jpeg.getvalue(), '.jpg'
+
+    # Screenshots and scans of flat text compress better losslessly
+    png = io.BytesIO()
+    clean.save(png, format='PNG', optimize=True)
+    if len(png.getvalue()) < len(best):
+        best, extension = png.getvalue(), '.png'
+
+    return best, extension
+
+def _normalized_key(content_hash):
+    return f"{content_hash}.normalized"
+
+def find_normalized(content_hash):
+    """Index record of the normalized copy, if one exists on disk"""
+    record = get_store('uploads').get(_normalized_key(content_hash))
+    if record and os.path.exists(record['path']):
+        return record
+    return None
+
+def _normalize_upload(record):
+    store = get_store('uploads')
+    content_hash = record['content_hash']
+    started = time.perf_counter()
+    try:
+        with open(record['path'], 'rb') as f:
+            original = f.read()
+        normalized, extension = normalize_image_bytes(original)
+
+        key = _normalized_key(content_hash)
+        name = f"{content_hash}.normalized{extension}"
+        path = store.path_for(key, name)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(normalized)
+        os.replace(tmp_path, path)
+        store.register(key, name, path, size=len(normalized),
+                       session_id=record.get('session_id'), content_hash=content_hash)
+
+        elapsed = time.perf_counter() - started
+        _record(jobs=1, original_bytes=len(original), normalized_bytes=len(normalized), normalize_seconds=elapsed)
+        logger.info("Normalized %s: %d -> %d bytes in %.2fs", content_hash[:12], len(original), len(normalized), elapsed)
+        return path
+    except Exception as e:
+        _record(failures=1)
+        logger.warning("Normalization failed for %s: %s", content_hash[:12], e)
+        raise
+    finally:
+        with _stats_lock:
+            _in_flight.pop(content_hash, None)
+
+def schedule_normalization(record):
+    """
+    Queue background normalization for an uploaded image record
+    Returns the future, or None when the file is not an image, already done or the pool is full
+    """
+    content_hash = record.get('content_hash')
+    extension = os.path.splitext(record['name'])[1].lower()
+    if not content_hash or extension not in IMAGE_EXTENSIONS:
+        return None
+    if find_normalized(content_hash):
+        return None
+
+    with _stats_lock:
+        future = _in_flight.get(content_hash)
+        if future is not None:
+            return future
+        try:
+            future = get_pool('normalizer', WORKERS, MAX_QUEUE).submit(_normalize_upload, record)
+        except PoolSaturated:
+            _stats['skipped_saturated'] += 1
+            return None
+        _in_flight[content_hash] = future
+    return future
+
+def path_for_extraction(content_hash, original_path, wait=WAIT_SECONDS):
+    """
+    Path extraction should read: the normalized copy when ready (waiting briefly
+    for an in-flight job), otherwise the original upload. Returns (path, source).
+    """
+    if content_hash:
+        with _stats_lock:
+            future = _in_flight.get(content_hash)
+        if future is not None:
+            try:
+                future.result(timeout=wait)
+            except Exception:
+                pass
+        record = find_normalized(content_hash)
+        if record:
+            return record['path'], 'normalized'
+    return original_path, 'original'
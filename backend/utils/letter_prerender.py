@@ -0,0 +1,159 @@
+"""
+Speculative sanction letter pre-rendering
+Most customers shown in-limit terms accept them and are approved, yet the letter was laid
+out only after underwriting finished. Once terms are shown, the letter body (customer,
+loan, terms and documents) is rendered on a low-priority background thread with
+fixed-width placeholders for the reference number and dates. At approval those are
+stamped into the rendered PDF instead of laying the letter out again; credit fields are
+not printed and come from the approval as before. A pre-rendered letter is thrown away
+when the terms are revised, the application is rejected or the conversation restarts.
+
+    LETTER_PRERENDER=on               off renders letters only at approval
+    LETTER_PRERENDER_WORKERS=1
+    LETTER_PRERENDER_MAX_QUEUE=16     terms shown while this many renders wait are not pre-rendered
+    LETTER_PRERENDER_MAX_ENTRIES=256  the oldest unclaimed letters are dropped past this
+    LETTER_PRERENDER_NICE=10          niceness of the render threads (Linux)
+
+Pre-rendered letters stay in the worker process that showed the terms; an approval
+handled by another worker renders the letter as before and counts as a miss. Hit rate
+and wasted work are in loan_letter_prerender_claims_total{result},
+loan_letter_prerender_discarded_total{reason} and loan_letter_prerender_wasted_seconds_total.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from utils.metrics import LETTER_PRERENDER_CLAIMS, LETTER_PRERENDER_DISCARDED, LETTER_PRERENDER_WASTED_SECONDS
+from utils.pdf_generator import render_sanction_letter_template, stamp_sanction_letter
+from utils.worker_pools import get_pool, PoolSaturated
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('LETTER_PRERENDER', 'on').lower() in ('on', '1', 'true')
+WORKERS = int(os.environ.get('LETTER_PRERENDER_WORKERS', 1))
+MAX_QUEUE = int(os.environ.get('LETTER_PRERENDER_MAX_QUEUE', 16))
+MAX_ENTRIES = int(os.environ.get('LETTER_PRERENDER_MAX_ENTRIES', 256))
+NICE = int(os.environ.get('LETTER_PRERENDER_NICE', 10))
+
+# Stage entered -> why a pre-rendered letter no longer applies
+DISCARD_ON = {
+    'awaiting_loan_amount': 'revised',
+    'completed': 'rejected',  # an approval claims the letter before completing
+    'initial': 'reset',
+}
+
+# body: the sanction details the letter was rendered from; future: (template, seconds)
+_Speculation = namedtuple('_Speculation', ['body', 'future'])
+
+_entries = OrderedDict()
+_pid = None
+_lock = threading.Lock()
+_thread_state = threading.local()
+
+def _session_entries():
+    """Pre-rendered letters by session; a forked child starts without the parent's"""
+    global _pid
+    if _pid != os.getpid():
+        _entries.clear()
+        _pid = os.getpid()
+    return _entries
+
+def _lower_priority():
+    if getattr(_thread_state, 'niced', False):
+        return
+    _thread_state.niced = True
+    try:
+        # On Linux a thread id is accepted here and renices just this thread
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), NICE)
+    except (AttributeError, OSError):
+        pass
+
+def _render(body):
+    _lower_priority()
+    started = time.perf_counter()
+    template = render_sanction_letter_template(body)
+    return template, time.perf_counter() - started
+
+def _count_waste(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    LETTER_PRERENDER_WASTED_SECONDS.inc(amount=future.result()[1])
+
+def _discard(entry, reason):
+    LETTER_PRERENDER_DISCARDED.inc(reason)
+    # A render still queued costs nothing; one already running is counted when it ends
+    if not entry.future.cancel():
+        entry.future.add_done_callback(_count_waste)
+
+def prerender(session_id, body):
+    """Start rendering the letter for body in the background, replacing the session's previous one"""
+    with _lock:
+        entries = _session_entries()
+        previous = entries.pop(session_id, None)
+    if previous is not None:
+        _discard(previous, 'revised')
+    try:
+        future = get_pool('prerender', WORKERS, MAX_QUEUE).submit(_render, body)
+    except PoolSaturated:
+        return False
+    evicted = []
+    with _lock:
+        entries = _session_entries()
+        entries[session_id] = _Speculation(body, future)
+        while len(entries) > MAX_ENTRIES:
+            evicted.append(entries.popitem(last=False)[1])
+    for entry in evicted:
+        _discard(entry, 'evicted')
+    return True
+
+def discard(session_id, reason):
+    with _lock:
+        entry = _session_entries().pop(session_id, None)
+    if entry is not None:
+        _discard(entry, reason)
+
+def claim(session_id, details):
+    """
+    The session's pre-rendered letter stamped with details' reference and dates, or None
+    when there is none, it was rendered for other terms or it has not finished yet
+    """
+    with _lock:
+        entry = _session_entries().pop(session_id, None)
+    if entry is None:
+        LETTER_PRERENDER_CLAIMS.inc('none')
+        return None
+    if any(details.get(field) != value for field, value in entry.body.items()):
+        LETTER_PRERENDER_CLAIMS.inc('stale')
+        _discard(entry, 'stale')
+        return None
+    if not entry.future.done():
+        LETTER_PRERENDER_CLAIMS.inc('unfinished')
+        _discard(entry, 'unfinished')
+        return None
+    try:
+        template, _ = entry.future.result()
+        pdf_bytes = stamp_sanction_letter(template, details)
+    except Exception:
+        logger.warning("Pre-rendered letter unusable, rendering again", exc_info=True,
+                       extra={'session_id': session_id})
+        LETTER_PRERENDER_CLAIMS.inc('failed')
+        _discard(entry, 'failed')
+        return None
+    LETTER_PRERENDER_CLAIMS.inc('hit')
+    return pdf_bytes
+
+def on_transition(agent, source, target, changes):
+    """conversation_flow hook: pre-render once terms are shown, discard when they no longer hold"""
+    if agent.session_id is None or agent.runtime.is_virtual:
+        return  # virtual replays stay single-threaded and deterministic
+    try:
+        if target == 'reviewing_terms':
+            state = agent.conversation_state
+            prerender(agent.session_id,
+                      agent.sanction_agent.build_letter_body(state['customer_data'], state['loan_terms']))
+        elif target in DISCARD_ON:
+            discard(agent.session_id, DISCARD_ON[target])
+    except Exception:
+        logger.exception("Letter pre-render failed", extra={'session_id': agent.session_id})
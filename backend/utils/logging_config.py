@@ -0,0 +1,199 @@
+"""
+Structured, leveled, asynchronous logging
+Request threads only put records on a bounded queue; a QueueListener thread does the
+formatting, PII redaction and I/O. Configure with environment variables:
+
+    LOG_LEVEL=INFO                                   default level
+    LOG_LEVELS=agents.master_agent=DEBUG,utils.pdf_generator=WARNING
+    LOG_FORMAT=json | text                           json by default on Render
+    LOG_DEBUG_SAMPLE_RATE=1.0                        fraction of DEBUG records kept
+    LOG_QUEUE_SIZE=10000                             records dropped (and counted) beyond this
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+_PAN_RE = re.compile(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b')
+_EMAIL_RE = re.compile(r'\b([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})\b')
+# Indian mobile numbers, not digits inside longer ids such as session_1760616581258
+_PHONE_RE = re.compile(r'(?<![\d])(?:\+?91[\s-]?)?[6-9]\d{4}[\s-]?\d{5}(?![\d])')
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Arguments of these types are safe to format later on the listener thread
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+def redact(text):
+    """Mask PAN, e-mail addresses and phone numbers in a string"""
+    text = _PAN_RE.sub(lambda m: 'XXXXX' + m.group(0)[5:9] + 'X', text)
+    text = _EMAIL_RE.sub(lambda m: f"{m.group(1)}***@{m.group(2)}", text)
+    text = _PHONE_RE.sub(lambda m: 'XXXXXX' + re.sub(r'\D', '', m.group(0))[-4:], text)
+    return text
+
+def _redact_value(value):
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {k: _redact_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(v) for v in value]
+    return value
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with extra= fields included, PII redacted"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact(record.getMessage()),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = _redact_value(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = redact(record.exc_text)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line format for local development, PII redacted"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s [%(name)s] %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        extras = {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and not k.startswith('_')}
+        if extras:
+            text += ' ' + json.dumps(extras, default=str, ensure_ascii=False)
+        return redact(text)
+
+class DebugSampler(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records before they are queued
+    A call can override the rate with extra={'sample_rate': 0.01}
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = getattr(record, 'sample_rate', self.rate)
+        return rate >= 1 or random.random() < rate
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller and defers formatting when it is safe"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting is deferred to the listener thread unless an argument is
+        # mutable (a dict could change before the listener gets to it)
+        if record.args and not all(isinstance(a, _IMMUTABLE_TYPES) for a in _iter_args(record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and record.exc_text is None:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _iter_args(args):
+    return args.values() if isinstance(args, dict) else args
+
+_state = {'listener': None, 'handler': None}
+_lock = threading.Lock()
+
+def _parse_levels(spec):
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _build_formatter(fmt):
+    formatter = JsonFormatter() if fmt == 'json' else TextFormatter()
+    formatter.converter = time.gmtime
+    return formatter
+
+def configure_logging(force=False):
+    """Install the queue handler on the root logger and start the listener (idempotent)"""
+    with _lock:
+        if _state['listener'] is not None and not force:
+            return _state['handler']
+
+        root = logging.getLogger()
+        if _state['handler'] is not None:
+            root.removeHandler(_state['handler'])
+        if _state['listener'] is not None:
+            try:
+                _state['listener'].stop()
+            except Exception:
+                pass
+
+        log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+        handler = AsyncQueueHandler(log_queue)
+        handler.addFilter(DebugSampler(float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))))
+
+        output = logging.StreamHandler(sys.stdout)
+        default_format = 'json' if os.environ.get('RENDER') else 'text'
+        output.setFormatter(_build_formatter(os.environ.get('LOG_FORMAT', default_format).lower()))
+
+        listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        listener.start()
+
+        root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        root.addHandler(handler)
+        for name, level in _parse_levels(os.environ.get('LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _state['listener'] = listener
+        _state['handler'] = handler
+        return handler
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    with _lock:
+        listener = _state['listener']
+        _state['listener'] = None
+    if listener is not None:
+        listener.stop()
+
+def dropped_records():
+    handler = _state['handler']
+    return handler.dropped if handler else 0
+
+def _reconfigure_after_fork():
+    # The listener thread does not exist in a forked child; start a fresh one
+    global _lock
+    _lock = threading.Lock()
+    if _state['listener'] is not None:
+        _state['listener'] = None
+        configure_logging(force=True)
+
+atexit.register(shutdown_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reconfigure_after_fork)
@@ -0,0 +1,336 @@
+"""
+In-process metrics in the Prometheus text format
+Histograms for conversation stages, worker-agent calls and HTTP requests, counters for
+actions and underwriting reasons, and gauges read at scrape time. Recording is a dict
+lookup, a bisect and an increment under a per-metric lock, so it stays on in production.
+
+A scrape reaches one process. With METRICS_DIR set (gunicorn.conf.py sets it when
+there is more than one worker) every process writes its series to a file there every
+METRICS_FLUSH_SECONDS, and the process answering /metrics sums the files: counters and
+histograms over every process since the directory was cleared at server start (so a
+worker that exits keeps its counts in the totals), gauges over live processes or, for
+state every worker shares, from the answering process alone.
+
+    METRICS_DIR=metrics_data          unset: the metrics of the process scraped
+    METRICS_FLUSH_SECONDS=5           how stale another worker's series can be
+"""
+import glob
+import inspect
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+
+# Seconds; covers NLP parsing (sub-millisecond) up to OCR and PDF rendering
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, values):
+        for label_values, value in values.items():
+            total[label_values] = total.get(label_values, 0) + value
+
+    def render(self, values=None):
+        items = sorted((self.collect() if values is None else values).items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, k)} {v}" for k, v in items]
+
+class Gauge(_Metric):
+    """
+    Read when scraped: collect() returns {label_values: value}
+    shared=True for state every process sees the same (a shared store), which is not summed across processes
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, collect, labels=(), shared=False):
+        super().__init__(name, documentation, labels)
+        self._collect = collect
+        self.shared = shared
+
+    def collect(self):
+        values = self._collect()
+        return values if isinstance(values, dict) else {(): values}
+
+    merge = staticmethod(Counter.merge)
+
+    def render(self, values=None):
+        values = self.collect() if values is None else values
+        return self.header() + [f"{self.name}{_label_text(self.labels, k)} {v}" for k, v in sorted(values.items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, seconds, *label_values):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def snapshot(self, *label_values):
+        """(bucket counts, sum) for one series, or None if it has no observations"""
+        with self._lock:
+            series = self._series.get(label_values)
+            return (list(series[0]), series[1]) if series else None
+
+    def collect(self):
+        with self._lock:
+            return {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for label_values, (counts, seconds) in values.items():
+            merged = total.get(label_values)
+            if merged is None:
+                total[label_values] = (list(counts), seconds)
+            else:
+                total[label_values] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + seconds)
+
+    def render(self, values=None):
+        items = sorted((self.collect() if values is None else values).items())
+        lines = self.header()
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, label_values, le)} {cumulative}")
+            labels = _label_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def render():
+    """Every registered metric in the Prometheus text exposition format, summed over processes with METRICS_DIR"""
+    if not METRICS_DIR:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    flush()
+    totals = {metric.name: {} for metric in _registry}
+    for state in _process_states():
+        live = state['pid'] == os.getpid() or _alive(state['pid'])
+        for metric in _registry:
+            if isinstance(metric, Gauge) and (metric.shared or not live):
+                continue
+            values = {tuple(labels): value for labels, value in state['metrics'].get(metric.name, [])}
+            metric.merge(totals[metric.name], values)
+    lines = []
+    for metric in _registry:
+        if isinstance(metric, Gauge) and metric.shared:
+            lines.extend(metric.render())
+        else:
+            lines.extend(metric.render(totals[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+_process_file = None
+_process_pid = None
+_flusher = None
+_flush_lock = threading.Lock()
+
+def _own_file():
+    """This process's file; a forked child (or a new process reusing a pid) gets a new one"""
+    global _process_file, _process_pid
+    if _process_pid != os.getpid():
+        _process_file = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}-{secrets.token_hex(4)}.json")
+        _process_pid = os.getpid()
+    return _process_file
+
+def flush():
+    """Write this process's series to METRICS_DIR (no-op without it)"""
+    if not METRICS_DIR:
+        return
+    with _flush_lock:
+        path = _own_file()
+        state = {'pid': os.getpid(), 'metrics': {}}
+        for metric in _registry:
+            if isinstance(metric, Gauge) and metric.shared:
+                continue
+            try:
+                values = metric.collect()
+            except Exception:
+                continue  # a gauge callback failing must not stop the others
+            state['metrics'][metric.name] = [[list(labels), value] for labels, value in values.items()]
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as handle:
+            json.dump(state, handle)
+        os.replace(temp_path, path)
+
+def _process_states():
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        try:
+            with open(path) as handle:
+                yield json.load(handle)
+        except (OSError, ValueError):
+            continue
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def clear_shared():
+    """Remove every process's file; gunicorn calls this once at server start"""
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json*')):
+            os.remove(path)
+
+def start_sharing():
+    """
+    Call in each worker after fork: drops the series inherited from the master (warm-up), which
+    every worker would otherwise add to the totals again, and flushes every METRICS_FLUSH_SECONDS
+    """
+    global _flusher
+    if not METRICS_DIR or (_flusher is not None and _flusher[0] == os.getpid()):
+        return
+    for metric in _registry:
+        if isinstance(metric, Counter):
+            with metric._lock:
+                metric._values.clear()
+        elif isinstance(metric, Histogram):
+            with metric._lock:
+                metric._series.clear()
+
+    def run():
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                flush()
+            except Exception:
+                logger.exception("Writing metrics to %s failed", METRICS_DIR)
+
+    thread = threading.Thread(target=run, name='metrics-flush', daemon=True)
+    thread.start()
+    _flusher = (os.getpid(), thread)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = Histogram(
+    'loan_stage_seconds', "Time to handle one message, by conversation stage", ('stage',))
+AGENT_CALL_SECONDS = Histogram(
+    'loan_agent_call_seconds', "Worker agent and helper call latency", ('agent', 'method'))
+HTTP_REQUEST_SECONDS = Histogram(
+    'loan_http_request_seconds', "HTTP request latency until the response is returned",
+    ('endpoint', 'method', 'status'))
+STAGE_TRANSITIONS = Counter(
+    'loan_stage_transitions_total', "Conversation stage transitions", ('from_stage', 'to_stage'))
+STAGE_DWELL_SECONDS = Histogram(
+    'loan_stage_dwell_seconds', "Time a conversation spent in a stage before leaving it", ('stage',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 900.0, 3600.0))
+ACTIONS = Counter('loan_chat_actions_total', "Chat turns by resulting action", ('action',))
+UNDERWRITING_DECISIONS = Counter(
+    'loan_underwriting_decisions_total', "Underwriting outcomes by reason code", ('reason', 'approved'))
+ADMISSION_REJECTED = Counter(
+    'loan_admission_rejected_total', "Requests refused by rate limits or overload shedding", ('rule',))
+LETTER_PRERENDER_CLAIMS = Counter(
+    'loan_letter_prerender_claims_total', "Sanction letters by whether a pre-rendered letter was used", ('result',))
+LETTER_PRERENDER_DISCARDED = Counter(
+    'loan_letter_prerender_discarded_total', "Pre-rendered letters thrown away unused", ('reason',))
+LETTER_PRERENDER_WASTED_SECONDS = Counter(
+    'loan_letter_prerender_wasted_seconds_total', "Render time spent on pre-rendered letters thrown away unused")
+
+def instrumented(agent):
+    """
+    Decorator recording each call of a function or method in AGENT_CALL_SECONDS and as a trace span
+    A coroutine function is timed until it returns, including the time it spends awaiting
+    """
+    def decorate(fn):
+        labels = (agent, fn.__name__)
+        span_name = f"{agent}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    with span(span_name):
+                        return await fn(*args, **kwargs)
+                finally:
+                    AGENT_CALL_SECONDS.observe(time.perf_counter() - started, *labels)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span(span_name):
+                    return fn(*args, **kwargs)
+            finally:
+                AGENT_CALL_SECONDS.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorate
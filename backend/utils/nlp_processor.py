@@ -1,5 +1,47 @@
 import re
 
+from utils.metrics import instrumented
+
+# Intent patterns
+INTENT_PATTERNS = {
+    'loan_amount': [
+        r'(\d+)\s*(?:thousand|k|lac|lakh|lacs|lakhs)?',
+        r'(?:loan|borrow|need)\s+(?:of\s+)?(?:rs\.?|₹)?\s*(\d+)',
+        r'(?:rs\.?|₹)\s*(\d+)',
+    ],
+    'tenure': [
+        r'(\d+)\s*(?:months?|mon|mo)',
+        r'(\d+)\s*(?:years?|yr)',
+        r'for\s+(\d+)\s+(?:months?|years?)',
+    ],
+    'affirmative': [
+        r'\b(?:yes|yeah|yep|sure|ok|okay|correct|right|proceed|continue|go ahead|fine|alright)\b',
+    ],
+    'negative': [
+        r'\b(?:no|nope|nah|not|cancel|stop|dont|don\'t)\b',
+    ],
+    'help': [
+        r'\b(?:help|assist|support|guide|confused|what|how)\b',
+    ],
+    'restart': [
+        r'\b(?:restart|reset|start over|new|begin again)\b',
+    ]
+}
+
+# Compiled once at import; these run on every chat turn
+_INTENT_REGEXES = {
+    intent: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for intent, patterns in INTENT_PATTERNS.items()
+}
+_CRORE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:crore|crores|cr)')
+_LAKH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:lac|lakh|lacs|lakhs|l)')
+_THOUSAND_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:thousand|k)')
+_NUMBER_RE = re.compile(r'\d+')
+_YEARS_RE = re.compile(r'(\d+)\s*(?:years?|yrs?|yr)')
+_MONTHS_RE = re.compile(r'(\d+)\s*(?:months?|mon|mo|m)')
+_WORD_NUMBER_RE = re.compile(r'\b(\d+)\b')
+_NON_DIGIT_RE = re.compile(r'\D')
+
 class NLPProcessor:
     """
     NLP utility for processing natural language inputs
@@ -9,32 +51,10 @@ class NLPProcessor:
     def __init__(self):
         self.name = "NLP Processor"
         
-        # Intent patterns
-        self.intents = {
-            'loan_amount': [
-                r'(\d+)\s*(?:thousand|k|lac|lakh|lacs|lakhs)?',
-                r'(?:loan|borrow|need)\s+(?:of\s+)?(?:rs\.?|₹)?\s*(\d+)',
-                r'(?:rs\.?|₹)\s*(\d+)',
-            ],
-            'tenure': [
-                r'(\d+)\s*(?:months?|mon|mo)',
-                r'(\d+)\s*(?:years?|yr)',
-                r'for\s+(\d+)\s+(?:months?|years?)',
-            ],
-            'affirmative': [
-                r'\b(?:yes|yeah|yep|sure|ok|okay|correct|right|proceed|continue|go ahead|fine|alright)\b',
-            ],
-            'negative': [
-                r'\b(?:no|nope|nah|not|cancel|stop|dont|don\'t)\b',
-            ],
-            'help': [
-                r'\b(?:help|assist|support|guide|confused|what|how)\b',
-            ],
-            'restart': [
-                r'\b(?:restart|reset|start over|new|begin again)\b',
-            ]
-        }
+        # Intent patterns (compiled once at module level)
+        self.intents = INTENT_PATTERNS
     
+    @instrumented('nlp')
     def extract_loan_amount(self, text):
         """
         Extract loan amount from natural language
@@ -50,30 +70,31 @@ class NLPProcessor:
         text = text.replace(',', '')
         
         # Check for crores
-        crore_match = re.search(r'(\d+(?:\.\d+)?)\s*(?:crore|crores|cr)', text)
+        crore_match = _CRORE_RE.search(text)
         if crore_match:
             amount = float(crore_match.group(1)) * 10000000
             return int(amount)
         
         # Check for lakhs/lacs
-        lakh_match = re.search(r'(\d+(?:\.\d+)?)\s*(?:lac|lakh|lacs|lakhs|l)', text)
+        lakh_match = _LAKH_RE.search(text)
         if lakh_match:
             amount = float(lakh_match.group(1)) * 100000
             return int(amount)
         
         # Check for thousands
-        thousand_match = re.search(r'(\d+(?:\.\d+)?)\s*(?:thousand|k)', text)
+        thousand_match = _THOUSAND_RE.search(text)
         if thousand_match:
             amount = float(thousand_match.group(1)) * 1000
             return int(amount)
         
         # Check for plain numbers
-        number_match = re.search(r'\d+', text)
+        number_match = _NUMBER_RE.search(text)
         if number_match:
             return int(number_match.group(0))
         
         return None
     
+    @instrumented('nlp')
     def extract_tenure(self, text):
         """
         Extract tenure from natural language
@@ -85,18 +106,18 @@ class NLPProcessor:
         text = text.lower().strip()
         
         # Check for years
-        year_match = re.search(r'(\d+)\s*(?:years?|yrs?|yr)', text)
+        year_match = _YEARS_RE.search(text)
         if year_match:
             years = int(year_match.group(1))
             return years * 12
         
         # Check for months
-        month_match = re.search(r'(\d+)\s*(?:months?|mon|mo|m)', text)
+        month_match = _MONTHS_RE.search(text)
         if month_match:
             return int(month_match.group(1))
         
         # Check for plain numbers (assume months if 12-60, years if 1-5)
-        number_match = re.search(r'\b(\d+)\b', text)
+        number_match = _WORD_NUMBER_RE.search(text)
         if number_match:
             num = int(number_match.group(1))
             # If number is between 1-5, likely years
@@ -108,6 +129,7 @@ class NLPProcessor:
         
         return None
     
+    @instrumented('nlp')
     def detect_intent(self, text):
         """
         Detect user intent from text
@@ -115,9 +137,9 @@ class NLPProcessor:
         """
         text = text.lower()
         
-        for intent, patterns in self.intents.items():
+        for intent, patterns in _INTENT_REGEXES.items():
             for pattern in patterns:
-                if re.search(pattern, text, re.IGNORECASE):
+                if pattern.search(text):
                     return intent
         
         return None
@@ -130,10 +152,11 @@ class NLPProcessor:
         """Check if response is no/negative"""
         return self.detect_intent(text) == 'negative'
     
+    @instrumented('nlp')
     def clean_phone_number(self, text):
         """Extract and clean phone number"""
         # Remove all non-digit characters
-        digits = re.sub(r'\D', '', text)
+        digits = _NON_DIGIT_RE.sub('', text)
         
         # Indian mobile numbers are 10 digits
         if len(digits) == 10:
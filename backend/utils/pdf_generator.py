@@ -1,23 +1,104 @@
+import io
+import logging
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+from utils.storage import get_store
+from utils.metrics import instrumented
+from utils.reference import REFERENCE_LENGTH
 
-def generate_sanction_letter_pdf(details):
-    """Generate a professional sanction letter PDF"""
-    output_dir = 'generated_letters'
-    os.makedirs(output_dir, exist_ok=True)
+logger = logging.getLogger(__name__)
+
+# Printed fields known only at approval: (placeholder character, width of the slot)
+# Dates are "%d %B %Y", at most 17 characters ("30 September 2026")
+STAMPED_FIELDS = {
+    'loan_reference_number': ('@', REFERENCE_LENGTH),
+    'sanction_date': ('#', 17),
+    'validity_date': ('~', 17),
+}
+
+@instrumented('pdf')
+def generate_sanction_letter_pdf(details, session_id=None, pdf_bytes=None):
+    """
+    Generate a professional sanction letter PDF
+    pdf_bytes: the letter already rendered (a stamped template), written as is
+    """
+    store = get_store('letters')
+    loan_ref = details['loan_reference_number']
+    name = f"sanction_letter_{loan_ref}.pdf"
+    filename = store.path_for(loan_ref, name)
     
-    filename = f"{output_dir}/sanction_letter_{details['loan_reference_number']}.pdf"
+    # Never replace a letter that was already issued
+    if os.path.exists(filename):
+        raise FileExistsError(f"Sanction letter already exists: {filename}")
+    
+    if pdf_bytes is None:
+        build_sanction_letter(details, filename)
+    else:
+        with open(filename, 'xb') as handle:
+            handle.write(pdf_bytes)
     
-    print(f"[PDF Generator] Creating PDF at: {filename}")
+    # Verify file was created
+    if os.path.exists(filename):
+        file_size = os.path.getsize(filename)
+        store.register(loan_ref, name, filename, size=file_size, session_id=session_id)
+        logger.debug("PDF created", extra={'path': os.path.abspath(filename), 'size': file_size})
+    else:
+        logger.error("PDF creation failed", extra={'path': filename})
     
-    doc = SimpleDocTemplate(filename, pagesize=A4,
+    return filename
+
+@instrumented('pdf')
+def render_sanction_letter_pdf(details):
+    """Render a sanction letter in memory and return the PDF bytes"""
+    buffer = io.BytesIO()
+    build_sanction_letter(details, buffer)
+    return buffer.getvalue()
+
+@instrumented('pdf')
+def render_sanction_letter_template(body):
+    """
+    Render a letter with fixed-width placeholders where the STAMPED_FIELDS go
+    body: the sanction details without those fields. Page streams are left uncompressed
+    so stamp_sanction_letter can find the placeholders.
+    """
+    placeholders = {field: char * width for field, (char, width) in STAMPED_FIELDS.items()}
+    buffer = io.BytesIO()
+    build_sanction_letter(dict(body, **placeholders), buffer, compress=False)
+    return buffer.getvalue()
+
+def stamp_sanction_letter(template, details):
+    """
+    Write the STAMPED_FIELDS of details over the placeholders of a rendered template
+    Each value is padded to its slot, so no byte offset in the PDF moves. Raises
+    ValueError when a value does not fit or a placeholder is not found exactly once.
+    """
+    pdf = template
+    for field, (char, width) in STAMPED_FIELDS.items():
+        value = str(details[field])
+        placeholder = (char * width).encode('latin-1')
+        if len(value) > width or not value.isascii() or any(c in value for c in '()\\'):
+            raise ValueError(f"{field} does not fit its placeholder: {value!r}")
+        if pdf.count(placeholder) != 1:
+            raise ValueError(f"Placeholder for {field} not found exactly once")
+        pdf = pdf.replace(placeholder, value.ljust(width).encode('latin-1'))
+    return pdf
+
+def build_sanction_letter(details, output, compress=True):
+    """
+    Lay out the sanction letter and write it to output
+    output can be a filename or a writable file-like object
+    """
+    # ReportLab is imported on first use; most sessions never reach sanction
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+    
+    doc = SimpleDocTemplate(output, pagesize=A4,
                             rightMargin=0.75*inch, leftMargin=0.75*inch,
-                            topMargin=0.75*inch, bottomMargin=0.75*inch)
+                            topMargin=0.75*inch, bottomMargin=0.75*inch,
+                            pageCompression=None if compress else 0)
     
     story = []
     styles = getSampleStyleSheet()
@@ -131,16 +212,4 @@ def generate_sanction_letter_pdf(details):
     story.append(Paragraph(footer_text, normal_style))
     
     # Build PDF
-    doc.build(story)
-    
-    # Verify file was created
-    if os.path.exists(filename):
-        file_size = os.path.getsize(filename)
-        abs_path = os.path.abspath(filename)
-        print(f"[PDF Generator] ✅ PDF created successfully!")
-        print(f"[PDF Generator] Path: {abs_path}")
-        print(f"[PDF Generator] Size: {file_size} bytes")
-    else:
-        print(f"[PDF Generator] ❌ PDF creation failed!")
-    
-    return filename
\ No newline at end of file
+    doc.build(story)
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""
+On-demand per-request profiling
+An authorized request (X-Debug-Token matching DEBUG_TOKEN) can ask for a profile with
+X-Debug-Profile: cpu runs the request under cProfile and saves pstats data (open it
+with `python -m pstats` or snakeviz); memory records allocations with tracemalloc
+and saves the top allocation sites as text. The response carries X-Profile-Id and
+the file is downloadable from /api/debug/profile/<profile_id>.
+
+    DEBUG_TOKEN=...          profiling is off when unset
+    PROFILES_DIR=...         where results are written (default: <tmp>/loan-profiles)
+    PROFILES_MAX_FILES=50    the oldest profiles past this many are removed
+    PROFILES_RETENTION_HOURS=24   profiles older than this are removed (0 keeps them)
+
+tracemalloc is process-wide, so a memory profile also sees allocations of concurrent
+requests; only one memory profile runs at a time.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
+PROFILES_DIR = os.environ.get('PROFILES_DIR', os.path.join(tempfile.gettempdir(), 'loan-profiles'))
+PROFILES_MAX_FILES = int(os.environ.get('PROFILES_MAX_FILES', 50))
+PROFILES_RETENTION_HOURS = float(os.environ.get('PROFILES_RETENTION_HOURS', 24))
+
+MODES = {'cpu': '.prof', 'memory': '.txt'}
+TOP_ALLOCATIONS = 50
+
+_PROFILE_ID_RE = re.compile(r'^(cpu|memory)-[0-9a-f]{16}$')
+_memory_lock = threading.Lock()
+
+def authorized(token):
+    """True when debug access is configured and token matches it"""
+    return bool(DEBUG_TOKEN) and bool(token) and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+class RequestProfile:
+    """One capture: start() before the request is handled, stop() after; stop() returns the profile id"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.profile_id = f"{mode}-{secrets.token_hex(8)}"
+        self._profiler = None
+        self._memory = False
+
+    def start(self):
+        if self.mode == 'cpu':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already active in this interpreter
+                logger.warning("CPU profile skipped: a profiler is already running")
+                return False
+            self._profiler = profiler
+            return True
+        if not _memory_lock.acquire(blocking=False):
+            logger.warning("Memory profile skipped: another one is running")
+            return False
+        self._memory = True
+        tracemalloc.start()
+        return True
+
+    def stop(self):
+        """Ends the capture and writes it out; a second call does nothing"""
+        path = profile_path(self.profile_id)
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            profiler.disable()
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            profiler.dump_stats(path)
+        elif self._memory:
+            self._memory = False
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+                _memory_lock.release()
+            stats = snapshot.statistics('lineno')
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            with open(path, 'w') as handle:
+                handle.write(f"current={current} bytes peak={peak} bytes\n\n")
+                for stat in stats[:TOP_ALLOCATIONS]:
+                    handle.write(f"{stat}\n")
+        else:
+            return None
+        prune_profiles()
+        return self.profile_id
+
+def prune_profiles():
+    """Remove profiles past PROFILES_RETENTION_HOURS, then the oldest past PROFILES_MAX_FILES; returns how many"""
+    try:
+        names = os.listdir(PROFILES_DIR)
+    except FileNotFoundError:
+        return 0
+    profiles = []
+    for name in names:
+        if not _PROFILE_ID_RE.match(os.path.splitext(name)[0]):
+            continue  # only files this module wrote
+        path = os.path.join(PROFILES_DIR, name)
+        try:
+            profiles.append((os.stat(path).st_mtime, path))
+        except FileNotFoundError:
+            continue
+    profiles.sort(reverse=True)
+    cutoff = time.time() - PROFILES_RETENTION_HOURS * 3600
+    removed = 0
+    for rank, (mtime, path) in enumerate(profiles):
+        if rank >= PROFILES_MAX_FILES or (PROFILES_RETENTION_HOURS > 0 and mtime < cutoff):
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass  # pruned by another worker
+    return removed
+
+def profile_path(profile_id):
+    """File for a profile id, or None for ids this module did not issue"""
+    if not _PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    return os.path.join(PROFILES_DIR, profile_id + MODES[profile_id.split('-')[0]])
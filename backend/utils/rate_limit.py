@@ -0,0 +1,214 @@
+"""
+Admission control for the expensive chat endpoints
+Token buckets per session and per client IP, per route, plus one for the turns that can
+run underwriting (bureau call, OCR, PDF). A request over a limit gets 429 with
+Retry-After. Under overload (too many expensive requests in flight in this worker) new
+sessions are turned away with 503 first, so conversations already under way keep their
+latency.
+
+    RATE_LIMIT_BACKEND=memory | sqlite     sqlite shares buckets between gunicorn workers
+    RATE_LIMIT_DB_PATH=rate_limits.sqlite3
+    RATE_LIMITS=chat.session=2/10,underwriting.ip=0.5/5      rule=tokens per second/burst
+    RATE_LIMITS=off                        disable the limits (shedding stays on)
+    SHED_INFLIGHT=16                       in-flight expensive requests before shedding
+    TRUST_FORWARDED_FOR=1                  proxies in front of the app that append to X-Forwarded-For
+                                           (1 by default on Render); the client IP is the entry the
+                                           outermost one added, as the ones before it are client-supplied
+    RATE_LIMIT_IDLE_SECONDS=3600           sqlite buckets untouched this long are deleted (never before
+                                           the slowest bucket would have refilled)
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# rule -> (tokens per second, burst)
+DEFAULT_LIMITS = {
+    'chat.session': (2.0, 10),
+    'chat.ip': (20.0, 60),
+    'upload.session': (0.2, 3),
+    'upload.ip': (1.0, 10),
+    'underwriting.ip': (0.5, 5),
+    'batch.ip': (0.1, 2),
+}
+
+# Stages whose next message can run underwriting and render a letter
+UNDERWRITING_STAGES = ('reviewing_terms', 'awaiting_salary_slip', 'processing_underwriting', 'generating_sanction')
+
+RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', 'rate_limits.sqlite3')
+SHED_INFLIGHT = int(os.environ.get('SHED_INFLIGHT', 16))
+TRUST_FORWARDED_FOR = int(os.environ.get('TRUST_FORWARDED_FOR', '1' if os.environ.get('RENDER') else '0'))
+RATE_LIMIT_IDLE_SECONDS = float(os.environ.get('RATE_LIMIT_IDLE_SECONDS', 3600))
+
+MAX_MEMORY_BUCKETS = 100000
+PURGE_EVERY = 1000
+
+def parse_limits(text):
+    """'chat.session=2/10,upload.ip=1/10' -> {rule: (rate, burst)} on top of the defaults"""
+    limits = dict(DEFAULT_LIMITS)
+    if not text:
+        return limits
+    if text.strip().lower() == 'off':
+        return {}
+    for part in text.split(','):
+        rule, _, spec = part.strip().partition('=')
+        rate, _, burst = spec.partition('/')
+        if rule not in DEFAULT_LIMITS or not rate:
+            raise ValueError(f"Bad RATE_LIMITS entry: {part!r}")
+        limits[rule] = (float(rate), float(burst or rate))
+    return limits
+
+class MemoryBuckets:
+    """Buckets in this process; least recently used buckets are dropped past MAX_MEMORY_BUCKETS"""
+
+    backend = 'memory'
+
+    def __init__(self, max_buckets=MAX_MEMORY_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0, now=None):
+        """Take cost tokens; returns 0 when allowed, else seconds until they are available"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate if rate > 0 else math.inf
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                # A dropped bucket comes back full, which errs on the side of admitting
+                self._buckets.popitem(last=False)
+            return wait
+
+class SqliteBuckets:
+    """Buckets shared by all worker processes on the host"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH, idle_seconds=RATE_LIMIT_IDLE_SECONDS):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self._local = threading.local()
+        self._taken = 0
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+        self.purge_idle()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, cost=1.0, now=None):
+        # Wall clock: monotonic clocks are not comparable across processes
+        now = time.time() if now is None else now
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate if rate > 0 else math.inf
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._taken += 1
+        if self._taken % PURGE_EVERY == 0:
+            self.purge_idle(now)
+        return wait
+
+    def purge_idle(self, now=None):
+        """Delete buckets idle for idle_seconds; one recreated later starts full, as it would be by then"""
+        now = time.time() if now is None else now
+        cursor = self.connection().execute("DELETE FROM buckets WHERE updated < ?", (now - self.idle_seconds,))
+        return cursor.rowcount
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+class Rejected(Exception):
+    """Request refused by admission control; status is 429 or 503"""
+
+    def __init__(self, rule, status, retry_after):
+        super().__init__(f"{rule}: retry after {retry_after}s")
+        self.rule = rule
+        self.status = status
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self, buckets, limits, shed_inflight=SHED_INFLIGHT):
+        self.buckets = buckets
+        self.limits = limits
+        self.shed_inflight = shed_inflight
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def check(self, rule, key, cost=1.0):
+        """Raise Rejected when the bucket for rule and key is empty"""
+        limit = self.limits.get(rule)
+        if limit is None or key is None:
+            return
+        wait = self.buckets.take(f"{rule}:{key}", limit[0], limit[1], cost)
+        if wait:
+            raise Rejected(rule, 429, max(1, math.ceil(wait)))
+
+    def overloaded(self):
+        return self.inflight >= self.shed_inflight
+
+    def enter(self, new_session):
+        """Count an expensive request in flight; new sessions are shed while overloaded"""
+        with self._lock:
+            if new_session and self.inflight >= self.shed_inflight:
+                raise Rejected('shed', 503, 2)
+            self.inflight += 1
+
+    def leave(self):
+        with self._lock:
+            self.inflight -= 1
+
+def client_ip(request):
+    """
+    Address of the client as seen by the outermost trusted proxy; X-Forwarded-For entries
+    to the left of the ones our proxies appended are whatever the client sent
+    """
+    if TRUST_FORWARDED_FOR:
+        hops = [hop.strip() for hop in ','.join(request.headers.getlist('X-Forwarded-For')).split(',')]
+        hops = [hop for hop in hops if hop]
+        if len(hops) >= TRUST_FORWARDED_FOR:
+            return hops[-TRUST_FORWARDED_FOR]
+    return request.remote_addr
+
+def _idle_seconds(limits):
+    # A bucket idle longer than burst / rate is full again, so dropping it changes nothing
+    refills = [burst / rate for rate, burst in limits.values() if rate > 0]
+    return max([RATE_LIMIT_IDLE_SECONDS] + refills)
+
+def create_admission_controller(backend=None):
+    backend = (backend or os.environ.get('RATE_LIMIT_BACKEND', 'memory')).lower()
+    limits = parse_limits(os.environ.get('RATE_LIMITS'))
+    if backend == 'sqlite':
+        buckets = SqliteBuckets(idle_seconds=_idle_seconds(limits))
+    elif backend == 'memory':
+        buckets = MemoryBuckets()
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+    return AdmissionController(buckets, limits)
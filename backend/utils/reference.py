@@ -0,0 +1,175 @@
+"""
+Loan reference number generator
+Snowflake-style ids that are unique across threads and processes, sort by issue time
+and end in a check character, e.g. TCPL19472HHP00090W0000D
+
+Layout of the 90-bit id (18 Crockford base32 characters):
+    41 bits  milliseconds since REFERENCE_EPOCH_MS
+     5 bits  node id (LOAN_REF_NODE_ID, one per host/instance)
+    22 bits  process id
+    10 bits  thread slot within the process
+    12 bits  sequence within the millisecond
+Every thread owns its generator, so issuing an id never takes a lock; a finished
+thread's generator (and the last millisecond it issued) goes to the next new thread.
+"""
+import base64
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+REFERENCE_PREFIX = 'TCPL'
+
+# 2024-01-01T00:00:00Z; 41 bits of milliseconds lasts until 2093
+REFERENCE_EPOCH_MS = 1704067200000
+
+CROCKFORD_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_RFC4648_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+_TO_CROCKFORD = bytes.maketrans(_RFC4648_ALPHABET.encode(), CROCKFORD_ALPHABET.encode())
+_CROCKFORD_VALUES = {char: value for value, char in enumerate(CROCKFORD_ALPHABET)}
+
+TIMESTAMP_BITS = 41
+NODE_BITS = 5
+PROCESS_BITS = 22
+SLOT_BITS = 10
+SEQUENCE_BITS = 12
+
+BODY_LENGTH = 18
+REFERENCE_LENGTH = len(REFERENCE_PREFIX) + BODY_LENGTH + 1
+
+_SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+_SLOT_SHIFT = SEQUENCE_BITS
+_PROCESS_SHIFT = _SLOT_SHIFT + SLOT_BITS
+_NODE_SHIFT = _PROCESS_SHIFT + PROCESS_BITS
+_TIMESTAMP_SHIFT = _NODE_SHIFT + NODE_BITS
+
+# Luhn mod 32: value of a doubled digit folded back into one base32 digit
+_LUHN_DOUBLED = [(2 * d) // 32 + (2 * d) % 32 for d in range(32)]
+
+def _node_id():
+    """Instance id from the environment, so several hosts can share the id space"""
+    node = int(os.environ.get('LOAN_REF_NODE_ID', 0))
+    if not 0 <= node < (1 << NODE_BITS):
+        raise ValueError(f"LOAN_REF_NODE_ID must be between 0 and {(1 << NODE_BITS) - 1}")
+    return node
+
+class _GeneratorPool:
+    """
+    Hands out one generator per thread slot; only touched when a thread needs its generator
+    A slot given back by a finished thread keeps its generator, and with it the last
+    millisecond and sequence issued, so the next thread to take it cannot repeat an id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = []
+        self._next = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            if self._next >= (1 << SLOT_BITS):
+                raise RuntimeError("Too many threads issuing loan references in one process")
+            slot = self._next
+            self._next += 1
+        return ReferenceGenerator(_node_id(), os.getpid(), slot)
+
+    def release(self, generator):
+        with self._lock:
+            self._free.append(generator)
+
+class _Lease:
+    """A thread's hold on a pooled generator; the generator goes back when this is collected"""
+
+    def __init__(self, pool):
+        self.generator = pool.acquire()
+        weakref.finalize(self, pool.release, self.generator)
+
+class ReferenceGenerator:
+    """Issues monotonically increasing ids for a single thread"""
+
+    def __init__(self, node_id, process_id, slot):
+        self.worker_bits = (
+            (node_id << _NODE_SHIFT)
+            | ((process_id & ((1 << PROCESS_BITS) - 1)) << _PROCESS_SHIFT)
+            | (slot << _SLOT_SHIFT)
+        )
+        self.last_ms = -1
+        self.sequence = 0
+
+    def next_id(self):
+        now_ms = time.time_ns() // 1_000_000 - REFERENCE_EPOCH_MS
+        if now_ms > self.last_ms:
+            self.last_ms = now_ms
+            self.sequence = 0
+        else:
+            # Same millisecond, or the wall clock stepped back: keep counting from
+            # the last issued time so ids stay unique and ordered
+            self.sequence += 1
+            if self.sequence > _SEQUENCE_MASK:
+                self.last_ms += 1
+                self.sequence = 0
+        return (self.last_ms << _TIMESTAMP_SHIFT) | self.worker_bits | self.sequence
+
+_generators = _GeneratorPool()
+_local = threading.local()
+
+def _reset_after_fork():
+    """A forked child has a new pid and must not reuse the parent's generators"""
+    global _generators, _local
+    _generators = _GeneratorPool()
+    _local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _thread_generator():
+    lease = getattr(_local, 'lease', None)
+    if lease is None:
+        # Collected with the thread's locals when the thread ends
+        lease = _local.lease = _Lease(_generators)
+    return lease.generator
+
+def encode_body(value):
+    """Encode a 90-bit id as 18 Crockford base32 characters"""
+    # 15 bytes -> 24 base32 chars; the first 6 only carry the 30 zero padding bits
+    encoded = base64.b32encode(value.to_bytes(15, 'big'))[6:]
+    return encoded.translate(_TO_CROCKFORD).decode('ascii')
+
+def luhn_check_character(body):
+    """Luhn mod 32 check character over a Crockford base32 string"""
+    total = 0
+    double = True
+    for char in reversed(body):
+        value = _CROCKFORD_VALUES[char]
+        total += _LUHN_DOUBLED[value] if double else value
+        double = not double
+    return CROCKFORD_ALPHABET[(32 - total % 32) % 32]
+
+def new_loan_reference():
+    """Return a new unique, time-sortable loan reference number"""
+    body = encode_body(_thread_generator().next_id())
+    return f"{REFERENCE_PREFIX}{body}{luhn_check_character(body)}"
+
+def is_valid_reference(reference):
+    """Check the prefix, length, alphabet and check character of a reference"""
+    if not isinstance(reference, str) or len(reference) != REFERENCE_LENGTH:
+        return False
+    if not reference.startswith(REFERENCE_PREFIX):
+        return False
+    body = reference[len(REFERENCE_PREFIX):-1]
+    if any(char not in _CROCKFORD_VALUES for char in body):
+        return False
+    return luhn_check_character(body) == reference[-1]
+
+def reference_issued_at(reference):
+    """Decode the issue time embedded in a reference (UTC datetime)"""
+    if not is_valid_reference(reference):
+        raise ValueError(f"Invalid loan reference: {reference}")
+    value = 0
+    for char in reference[len(REFERENCE_PREFIX):-1]:
+        value = (value << 5) | _CROCKFORD_VALUES[char]
+    millis = (value >> _TIMESTAMP_SHIFT) + REFERENCE_EPOCH_MS
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
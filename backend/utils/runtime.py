@@ -0,0 +1,122 @@
+"""
+Clock, randomness and simulated latency for the agents
+The agents take these from an AgentRuntime instead of calling time.sleep, datetime.now
+and the global random module directly:
+
+    AgentRuntime()                  production: real clock and sleeps, global random (as before)
+    AgentRuntime.virtual(seed)      virtual time: sleeps advance a counter and return at once,
+                                    a seeded RNG and reproducible loan references
+
+A virtual runtime makes a conversation a pure function of its seed and messages, so
+thousands can be replayed in seconds with identical responses, and the virtual time
+spent shows what the simulated bureau and OCR latencies would have cost.
+"""
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+
+from utils.reference import REFERENCE_PREFIX, encode_body, luhn_check_character, new_loan_reference
+
+# Simulated latency in seconds of the mock external calls
+DEFAULT_LATENCIES = {
+    'credit_bureau': 0.5,
+    'credit_bureau_ping': 0.02,
+    'ocr': 1.0,
+}
+
+# 2026-01-01 10:00 local time; virtual clocks start here so dates on letters are stable
+VIRTUAL_EPOCH = datetime(2026, 1, 1, 10, 0).timestamp()
+
+class SystemClock:
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        await asyncio.sleep(seconds)
+
+class VirtualClock:
+    """Time only moves when something sleeps; sleeping returns immediately"""
+
+    def __init__(self, start=VIRTUAL_EPOCH):
+        self._now = start
+        self.slept = 0.0
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def now(self):
+        return datetime.fromtimestamp(self._now)
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += seconds
+            self.slept += seconds
+
+    async def sleep_async(self, seconds):
+        self.sleep(seconds)
+
+class LatencyModel:
+    """Delays of the simulated external calls; jitter is a +/- fraction drawn from the runtime RNG"""
+
+    def __init__(self, latencies=None, jitter=0.0):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.jitter = jitter
+
+    def delay(self, operation, rng):
+        base = self.latencies.get(operation, 0.0)
+        if self.jitter:
+            base *= 1 + rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+class AgentRuntime:
+    def __init__(self, clock=None, rng=None, latency=None, references=None):
+        self.clock = clock or SystemClock()
+        self.rng = rng or random
+        self.latency = latency or LatencyModel()
+        self._references = references or new_loan_reference
+
+    @classmethod
+    def virtual(cls, seed=0, latency=None):
+        rng = random.Random(seed)
+        # References drawn from a separate stream so adding a reference does not shift other draws
+        reference_rng = random.Random(f"references-{seed}")
+
+        def reference():
+            body = encode_body(reference_rng.getrandbits(90))
+            return f"{REFERENCE_PREFIX}{body}{luhn_check_character(body)}"
+
+        return cls(VirtualClock(), rng, latency, reference)
+
+    @property
+    def is_virtual(self):
+        return isinstance(self.clock, VirtualClock)
+
+    def wait(self, operation):
+        """Stand-in for the network or OCR time of a mock external call"""
+        seconds = self.latency.delay(operation, self.rng)
+        if seconds > 0:
+            self.clock.sleep(seconds)
+
+    async def wait_async(self, operation):
+        """wait() for coroutines: yields to the event loop instead of blocking the thread"""
+        seconds = self.latency.delay(operation, self.rng)
+        if seconds > 0:
+            await self.clock.sleep_async(seconds)
+
+    def new_loan_reference(self):
+        return self._references()
+
+_production = AgentRuntime()
+
+def default_runtime():
+    """The shared production runtime"""
+    return _production
@@ -0,0 +1,398 @@
+"""
+Salary extraction pipeline for uploaded salary slips
+Digital PDFs are read from their text layer in milliseconds; images (and PDFs
+without a usable text layer) fall back to the slower image path. Results are
+cached against the file's content hash (and, for the image path, its name) so a slip is
+only ever processed once.
+"""
+import asyncio
+import base64
+import os
+import re
+import time
+import zlib
+
+from utils.storage import get_result_cache
+from utils.image_normalizer import path_for_extraction, record_extraction
+
+CACHE_KIND = 'salary'
+
+_LENGTH_RE = re.compile(rb'/Length\s+(\d{1,12})(\s+\d+\s+R)?')
+_FILTER_RE = re.compile(rb'/Filter\s*(\[[^\]]*\]|/[A-Za-z0-9]+)')
+_NUMBER_RE = re.compile(rb'[-+]?(?:\d+\.?\d*|\.\d+)')
+_NAME_RE = re.compile(rb'/[^\s/\[\]()<>{}%]+')
+_OPERATOR_RE = re.compile(rb"[A-Za-z'\"*]+")
+
+_ESCAPES = {
+    ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b',
+    ord('f'): b'\f', ord('('): b'(', ord(')'): b')', ord('\\'): b'\\',
+}
+
+# Gaps in a TJ array wider than this (thousandths of an em) are word breaks
+_TJ_SPACE_THRESHOLD = 200
+
+# Amounts like 85,000 / 1,20,000.00 / 72500 / Rs. 72,500 / ₹72,500
+_AMOUNT_RE = re.compile(r'(?:₹|rs\.?|inr)?\s*(\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d{4,}(?:\.\d{1,2})?)', re.I)
+_NET_RE = re.compile(r'\b(?:net\s+(?:pay|salary|amount|earnings|payable)|take[\s-]*home)\b', re.I)
+_GROSS_RE = re.compile(r'\b(?:gross\s+(?:pay|salary|earnings|total)|total\s+earnings)\b', re.I)
+
+# Monthly salaries outside this range are almost certainly a misread
+MIN_PLAUSIBLE_SALARY = 5000
+MAX_PLAUSIBLE_SALARY = 10000000
+
+# Bounds on the text layer scan, so a crafted upload cannot hold a worker thread: a slip's
+# content streams decode to a few KB, and text past these limits is not read
+MAX_PDF_STREAMS = 256
+MAX_STREAM_KEYWORDS = 8 * MAX_PDF_STREAMS  # 'stream' occurrences looked at, 'endstream' included
+MAX_STREAM_BYTES = 256 * 1024        # decoded size of one stream
+MAX_TEXT_BYTES = 256 * 1024          # decoded bytes tokenized across the file
+MAX_DICT_BYTES = 4096                # how far before 'stream' its dictionary is looked for
+
+_WHITESPACE = b' \t\r\n\x0c\x00'
+
+def _decode_stream(header, data):
+    """Apply the stream's filters; returns None for filters we do not handle"""
+    match = _FILTER_RE.search(header)
+    filters = re.findall(rb'/([A-Za-z0-9]+)', match.group(1)) if match else []
+    for name in filters:
+        if name in (b'ASCII85Decode', b'A85'):
+            data = data.strip()
+            if data.startswith(b'<~'):
+                data = data[2:]
+            if not data.endswith(b'~>'):
+                data += b'~>'
+            data = base64.a85decode(b'<~' + data, adobe=True)
+        elif name in (b'FlateDecode', b'Fl'):
+            inflater = zlib.decompressobj()
+            data = inflater.decompress(data, MAX_STREAM_BYTES)
+            if inflater.unconsumed_tail:
+                return None  # inflates past MAX_STREAM_BYTES
+        else:
+            return None
+    return data
+
+def _read_literal(content, i):
+    """Parse a (literal string) starting at content[i] == '('; returns (bytes, next index)"""
+    out = bytearray()
+    depth = 1
+    i += 1
+    while i < len(content) and depth:
+        c = content[i]
+        if c == 0x5C:  # backslash
+            i += 1
+            if i >= len(content):
+                break
+            c = content[i]
+            if c in _ESCAPES:
+                out += _ESCAPES[c]
+            elif 0x30 <= c <= 0x37:
+                digits = content[i:i + 3]
+                octal = re.match(rb'[0-7]{1,3}', digits).group(0)
+                out.append(int(octal, 8) & 0xFF)
+                i += len(octal) - 1
+            elif c in (0x0A, 0x0D):
+                if c == 0x0D and content[i + 1:i + 2] == b'\n':
+                    i += 1
+            else:
+                out.append(c)
+        elif c == 0x28:
+            depth += 1
+            out.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if depth:
+                out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return bytes(out), i
+
+def _text_from_content(content):
+    """Pull text out of a page content stream, one line per text line"""
+    lines = []
+    current = []
+    operands = []
+    i = 0
+    length = len(content)
+
+    def newline():
+        if current:
+            lines.append(''.join(current).strip())
+            current.clear()
+
+    while i < length:
+        c = content[i]
+        if c in b' \t\r\n\x0c\x00':
+            i += 1
+        elif c == 0x25:  # % comment
+            end = content.find(b'\n', i)
+            i = length if end < 0 else end + 1
+        elif c == 0x28:
+            value, i = _read_literal(content, i)
+            operands.append(value)
+        elif content.startswith(b'<<', i) or content.startswith(b'>>', i):
+            i += 2
+        elif c == 0x3C:
+            end = content.find(b'>', i)
+            if end < 0:
+                break
+            hex_digits = re.sub(rb'\s', b'', content[i + 1:end])
+            if len(hex_digits) % 2:
+                hex_digits += b'0'
+            operands.append(bytes.fromhex(hex_digits.decode('ascii')))
+            i = end + 1
+        elif c == 0x5B:  # [ array for TJ
+            operands.append('[')
+            i += 1
+        elif c == 0x5D:
+            items = []
+            while operands and operands[-1] != '[':
+                items.append(operands.pop())
+            if operands:
+                operands.pop()
+            operands.append(list(reversed(items)))
+            i += 1
+        elif c in b'<>{}':
+            i += 1
+        else:
+            match = _NUMBER_RE.match(content, i)
+            if match:
+                operands.append(float(match.group(0)))
+                i = match.end()
+                continue
+            match = _NAME_RE.match(content, i)
+            if match:
+                operands.append(match.group(0).decode('latin-1'))
+                i = match.end()
+                continue
+            match = _OPERATOR_RE.match(content, i)
+            if not match:
+                i += 1
+                continue
+            op = match.group(0)
+            i = match.end()
+
+            if op in (b'Tj', b"'", b'"'):
+                if op != b'Tj':
+                    newline()
+                strings = [o for o in operands if isinstance(o, bytes)]
+                if strings:
+                    current.append(strings[-1].decode('cp1252', errors='replace'))
+            elif op == b'TJ':
+                array = operands[-1] if operands and isinstance(operands[-1], list) else []
+                for item in array:
+                    if isinstance(item, bytes):
+                        current.append(item.decode('cp1252', errors='replace'))
+                    elif isinstance(item, float) and item < -_TJ_SPACE_THRESHOLD:
+                        current.append(' ')
+            elif op in (b'Td', b'TD'):
+                numbers = [o for o in operands if isinstance(o, float)]
+                if len(numbers) >= 2 and numbers[-1] != 0:
+                    newline()
+                elif current:
+                    current.append(' ')
+            elif op in (b'T*', b'Tm', b'ET'):
+                newline()
+            operands = []
+
+    newline()
+    return [line for line in lines if line]
+
+def _streams(data):
+    """
+    (dictionary, raw bytes) of the PDF's streams, found in one forward pass
+    A stream ends at its direct /Length when that lands on 'endstream', else at the next
+    'endstream'; scanning stops after MAX_PDF_STREAMS streams or MAX_STREAM_KEYWORDS keywords
+    """
+    position = 0
+    next_end = -1
+    keywords = 0
+    for _ in range(MAX_PDF_STREAMS):
+        # A stream starts at '>> stream' followed by an end of line
+        while True:
+            keyword = data.find(b'stream', position)
+            keywords += 1
+            if keyword < 0 or keywords > MAX_STREAM_KEYWORDS:
+                return
+            position = keyword + 6
+            close = keyword
+            while close > 0 and keyword - close < MAX_DICT_BYTES and data[close - 1] in _WHITESPACE:
+                close -= 1
+            if data.endswith(b'>>', 0, close) and data[position:position + 1] in (b'\r', b'\n'):
+                break
+        body = position + (2 if data.startswith(b'\r\n', position) else 1)
+        start = data.rfind(b'obj', max(0, close - MAX_DICT_BYTES), close)
+        header = data[start + 3 if start >= 0 else max(0, close - MAX_DICT_BYTES):close - 2]
+
+        end = -1
+        length = _LENGTH_RE.search(header)
+        if length and not length.group(2):  # '/Length 12 0 R' points elsewhere
+            end = body + int(length.group(1))
+            after = end
+            while after < len(data) and after - end < 4 and data[after] in _WHITESPACE:
+                after += 1
+            if not data.startswith(b'endstream', after):
+                end = -1
+        if end < 0:
+            if next_end < body:
+                next_end = data.find(b'endstream', body)
+                if next_end < 0:
+                    return
+            end = next_end
+            if data.endswith(b'\n', body, end):
+                end -= 1
+            if data.endswith(b'\r', body, end):
+                end -= 1
+        position = max(position, end)
+        yield header, data[body:end]
+
+def extract_pdf_text(data):
+    """
+    Text layer of a PDF as a list of lines
+    Handles the common ASCII85/Flate content streams with simple (non-CID) fonts;
+    anything else yields few or no lines and the caller falls back to the image path.
+    Work is linear in the file size and capped by the MAX_* limits above
+    """
+    lines = []
+    tokenized = 0
+    for header, raw in _streams(data):
+        if b'/Subtype /Image' in header or b'/Subtype/Image' in header:
+            continue
+        try:
+            content = _decode_stream(header, raw)
+            if content and (b'Tj' in content or b'TJ' in content):
+                # Fonts and other binary streams are decoded but never tokenized
+                tokenized += len(content)
+                if tokenized > MAX_TEXT_BYTES:
+                    break
+                lines.extend(_text_from_content(content))
+        except (ValueError, zlib.error):
+            continue
+    return lines
+
+def _amounts(text):
+    values = []
+    for match in _AMOUNT_RE.finditer(text):
+        value = float(match.group(1).replace(',', ''))
+        if MIN_PLAUSIBLE_SALARY <= value <= MAX_PLAUSIBLE_SALARY:
+            values.append(int(round(value)))
+    return values
+
+def find_pay_lines(lines):
+    """
+    Find gross and net pay amounts in text lines
+    The amount is taken from the same line, or the next line for tabular layouts
+    """
+    found = {'gross': None, 'net': None}
+    for index, line in enumerate(lines):
+        for field, pattern in (('net', _NET_RE), ('gross', _GROSS_RE)):
+            if found[field] is not None or not pattern.search(line):
+                continue
+            after_label = line[pattern.search(line).end():]
+            amounts = _amounts(after_label)
+            if not amounts and index + 1 < len(lines):
+                amounts = _amounts(lines[index + 1])
+            if amounts:
+                found[field] = amounts[0]
+    return found
+
+def extract_from_pdf_text(path):
+    """Fast path: salary from the PDF text layer, or None when it cannot be read"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(b'%PDF'):
+        return None
+    pay = find_pay_lines(extract_pdf_text(data))
+    # Affordability is judged on take-home pay; gross is the fallback
+    salary = pay['net'] or pay['gross']
+    if salary is None:
+        return None
+    return {'salary': salary, 'gross': pay['gross'], 'net': pay['net']}
+
+def _image_kind(name):
+    # The image path is handed the file name too (and falls back to reading the salary
+    # from it), so its results are reused only for the same content under the same name
+    return f"{CACHE_KIND}:{name}"
+
+def _cached_result(cache, content_hash, kind, started):
+    if not cache:
+        return None
+    cached = cache.get(content_hash, kind)
+    # Entries under the bare kind from before image results were keyed by name are not reused
+    if cached is None or (kind == CACHE_KIND and cached.get('method') != 'pdf_text'):
+        return None
+    elapsed = time.perf_counter() - started
+    record_extraction('cache', elapsed)
+    return dict(cached, cached=True, seconds=elapsed)
+
+def _text_layer_result(path, name):
+    if os.path.splitext(name)[1].lower() != '.pdf':
+        return None
+    try:
+        result = extract_from_pdf_text(path)
+    except OSError:
+        return None
+    if result:
+        result['method'] = 'pdf_text'
+    return result
+
+def _finish(result, started, cache, content_hash, kind):
+    result['seconds'] = time.perf_counter() - started
+    record_extraction(result.get('source', result['method']), result['seconds'])
+    if cache:
+        cache.put(content_hash, kind, result)
+    result['cached'] = False
+    return result
+
+def extract_salary(path, name=None, content_hash=None, image_extractor=None):
+    """
+    Run the extraction pipeline for one slip
+    image_extractor(path, name) is the slow path for images and unreadable PDFs
+    Returns a dict with 'salary' (or None), 'method' ('pdf_text' or 'image'),
+    'seconds' and 'cached'
+    """
+    started = time.perf_counter()
+    cache = get_result_cache() if content_hash else None
+    cached = _cached_result(cache, content_hash, CACHE_KIND, started)
+    if cached is not None:
+        return cached
+
+    name = name or os.path.basename(path)
+    result = _text_layer_result(path, name)
+    if result is not None:
+        return _finish(result, started, cache, content_hash, CACHE_KIND)
+
+    kind = _image_kind(name)
+    cached = _cached_result(cache, content_hash, kind, started)
+    if cached is not None:
+        return cached
+    # Slow path reads the normalized (downscaled, grayscale) copy when there is one
+    image_path, source = path_for_extraction(content_hash, path)
+    salary = image_extractor(image_path, name) if image_extractor else None
+    result = {'salary': salary, 'method': 'image', 'source': source}
+    return _finish(result, started, cache, content_hash, kind)
+
+async def extract_salary_async(path, name=None, content_hash=None, image_extractor=None):
+    """
+    extract_salary for coroutines: the cache, file reads and parsing run on threads and
+    image_extractor(path, name) is a coroutine function, so a slip waiting on OCR holds no thread
+    """
+    started = time.perf_counter()
+    cache = get_result_cache() if content_hash else None
+    cached = await asyncio.to_thread(_cached_result, cache, content_hash, CACHE_KIND, started)
+    if cached is not None:
+        return cached
+
+    name = name or os.path.basename(path)
+    result = await asyncio.to_thread(_text_layer_result, path, name)
+    if result is not None:
+        return await asyncio.to_thread(_finish, result, started, cache, content_hash, CACHE_KIND)
+
+    kind = _image_kind(name)
+    cached = await asyncio.to_thread(_cached_result, cache, content_hash, kind, started)
+    if cached is not None:
+        return cached
+    image_path, source = await asyncio.to_thread(path_for_extraction, content_hash, path)
+    salary = await image_extractor(image_path, name) if image_extractor else None
+    result = {'salary': salary, 'method': 'image', 'source': source}
+    return await asyncio.to_thread(_finish, result, started, cache, content_hash, kind)
@@ -0,0 +1,138 @@
+"""
+Conversation session storage
+The development server keeps MasterAgent objects in memory. Under several worker
+processes a session's requests can land on any worker, so the 'sqlite' backend keeps
+each conversation_state as JSON in a shared database and rebuilds the agent per request.
+
+    SESSION_BACKEND=memory | sqlite        sqlite is the default under gunicorn.conf.py
+    SESSION_DB_PATH=sessions.sqlite3
+    SESSION_TTL_SECONDS=86400              idle sessions older than this are dropped
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.sqlite3')
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', 86400))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at);
+"""
+
+class MemorySessionStore:
+    """Agents kept in this process; fine for a single worker"""
+
+    backend = 'memory'
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def save(self, master):
+        with self._lock:
+            self._sessions[master.session_id] = master
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+class SqliteSessionStore:
+    """
+    Conversation state shared by all worker processes through SQLite
+    Requests for the same session are sequential in practice (one chat window),
+    so the last write wins
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, factory, path=SESSION_DB_PATH, ttl_seconds=SESSION_TTL_SECONDS):
+        self.factory = factory
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self.connection().executescript(_SCHEMA)
+        self.purge_expired()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork, so reopen in a child process
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, session_id):
+        row = self.connection().execute(
+            "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds and time.time() - row[1] > self.ttl_seconds:
+            self.delete(session_id)
+            return None
+        master = self.factory(session_id=session_id)
+        master.conversation_state = json.loads(row[0])
+        return master
+
+    def save(self, master):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (master.session_id, json.dumps(master.conversation_state, default=str), time.time())
+            )
+
+    def delete(self, session_id):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        if not self.ttl_seconds:
+            return 0
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+        return cursor.rowcount
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id):
+        return self.connection().execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone() is not None
+
+def create_session_store(factory, backend=None):
+    """Session store selected by SESSION_BACKEND; factory(session_id=...) builds an agent"""
+    backend = (backend or os.environ.get('SESSION_BACKEND', 'memory')).lower()
+    if backend == 'sqlite':
+        return SqliteSessionStore(factory)
+    if backend == 'memory':
+        return MemorySessionStore(factory)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
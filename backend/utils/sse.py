@@ -0,0 +1,69 @@
+"""
+Server-Sent Events for long-running chat turns
+A confirmed loan runs the credit pull, salary extraction and PDF rendering in one
+request. Streaming runs the turn on a worker pool and forwards the agents' progress
+callbacks as events, so the client sees the first bytes immediately:
+
+    event: accepted     the turn was queued
+    event: progress     {"step": "fetching_credit_score", "message": "...", ...}
+    event: result       the same payload /api/chat/message returns
+    event: error        {"error": "..."} when the turn failed
+
+Idle periods are filled with comment lines so proxies do not time the stream out.
+"""
+import contextvars
+import logging
+import os
+import queue
+
+from utils.json_codec import dumps
+from utils.worker_pools import get_pool
+
+logger = logging.getLogger(__name__)
+
+STREAM_WORKERS = int(os.environ.get('STREAM_WORKERS', 8))
+STREAM_MAX_QUEUE = int(os.environ.get('STREAM_MAX_QUEUE', 32))
+HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',  # nginx and Render's proxy would otherwise buffer the stream
+}
+
+def format_event(event, data):
+    return b'event: ' + event.encode('ascii') + b'\ndata: ' + dumps(data) + b'\n\n'
+
+def stream_job(job, accepted=None):
+    """
+    Run job(progress) on the stream pool and return a generator of SSE chunks
+    job returns the payload of the final 'result' event. Raises PoolSaturated before
+    anything is sent, so the caller can still answer 503.
+    """
+    events = queue.Queue()
+
+    def progress(step, message, data):
+        events.put(('progress', dict(data, step=step, message=message)))
+
+    def run():
+        try:
+            events.put(('result', job(progress)))
+        except Exception as e:
+            logger.exception("Streamed chat turn failed")
+            events.put(('error', {'error': str(e)}))
+
+    # The turn runs in the caller's context so it joins the request's trace
+    get_pool('chat_stream', STREAM_WORKERS, STREAM_MAX_QUEUE).submit(contextvars.copy_context().run, run)
+
+    def generate():
+        yield format_event('accepted', accepted or {})
+        while True:
+            try:
+                event, data = events.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield b': keep-alive\n\n'
+                continue
+            yield format_event(event, data)
+            if event != 'progress':
+                return
+
+    return generate()
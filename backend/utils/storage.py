@@ -0,0 +1,469 @@
+"""
+File storage for sanction letters and uploaded documents
+Files live in hash-sharded subdirectories (root/ab/cd/name) and their metadata in a
+small SQLite index, so stats and listings never walk the directory tree
+
+CLI usage (from the backend directory):
+    python -m utils.storage stats
+    python -m utils.storage migrate                 # index files left in the old flat layout
+    python -m utils.storage purge --kind uploads --older-than-days 30
+    python -m utils.storage purge --session session_1760616581258
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = os.environ.get('STORAGE_INDEX_PATH', 'storage_index.sqlite3')
+
+STORE_ROOTS = {
+    'letters': os.environ.get('LETTERS_DIR', 'generated_letters'),
+    'uploads': os.environ.get('UPLOADS_DIR', 'uploads'),
+}
+
+# Age-based retention per store in days (0 keeps files forever). Sanction letters are
+# records of a loan decision, so they are only purged when a retention period is set
+RETENTION_DAYS = {
+    'letters': float(os.environ.get('LETTER_RETENTION_DAYS', 0)),
+    'uploads': float(os.environ.get('UPLOAD_RETENTION_DAYS', 30)),
+}
+
+COMPACT_INTERVAL_SECONDS = float(os.environ.get('STORAGE_COMPACT_INTERVAL', 3600))
+
+# Rows removed per retention pass, so one pass never holds the index for long
+RETENTION_BATCH = 500
+
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+class FileTooLarge(ValueError):
+    """Raised when a streamed file goes over the size cap"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"File exceeds the maximum size of {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    session_id TEXT,
+    content_hash TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (kind, name);
+CREATE INDEX IF NOT EXISTS files_by_age ON files (kind, created_at);
+CREATE INDEX IF NOT EXISTS files_by_session ON files (session_id);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (content_hash);
+CREATE TABLE IF NOT EXISTS file_refs (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    name TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, key, session_id)
+);
+CREATE INDEX IF NOT EXISTS file_refs_by_session ON file_refs (session_id);
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (content_hash, kind)
+);
+"""
+
+_COLUMNS = ('kind', 'key', 'name', 'path', 'size', 'session_id', 'content_hash', 'created_at')
+
+class StorageIndex:
+    """SQLite metadata index shared by all stores, with one connection per thread"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(_SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork, so reopen in a child process
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def upsert(self, record):
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO files ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [record.get(column) for column in _COLUMNS]
+            )
+
+    def query(self, sql, params=()):
+        return [dict(row) for row in self.connection().execute(sql, params)]
+
+    def execute(self, sql, params=()):
+        conn = self.connection()
+        with conn:
+            conn.execute(sql, params)
+
+    def delete(self, kind, keys):
+        """Drop file rows, their refs and any cached results no other file shares a hash with"""
+        conn = self.connection()
+        with conn:
+            params = [(kind, key) for key in keys]
+            conn.executemany(
+                "DELETE FROM results WHERE content_hash = "
+                "(SELECT content_hash FROM files WHERE kind = ?1 AND key = ?2) "
+                "AND NOT EXISTS (SELECT 1 FROM files f WHERE f.content_hash = results.content_hash "
+                "AND NOT (f.kind = ?1 AND f.key = ?2))",
+                params
+            )
+            conn.executemany("DELETE FROM files WHERE kind = ? AND key = ?", params)
+            conn.executemany("DELETE FROM file_refs WHERE kind = ? AND key = ?", params)
+
+    def compact(self):
+        """Fold the WAL back into the database and refresh query planner stats"""
+        conn = self.connection()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('PRAGMA optimize')
+
+class FileStore:
+    """One logical store (letters or uploads) rooted at a directory"""
+
+    def __init__(self, kind, root, index):
+        self.kind = kind
+        self.root = root
+        self.index = index
+
+    def path_for(self, key, name):
+        """Sharded location for a file, creating the shard directories"""
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        directory = os.path.join(self.root, digest[:2], digest[2:4])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def register(self, key, name, path, size=None, session_id=None, content_hash=None, created_at=None):
+        """Record a file that has been written at path"""
+        record = {
+            'kind': self.kind,
+            'key': key,
+            'name': name,
+            'path': path,
+            'size': os.path.getsize(path) if size is None else size,
+            'session_id': session_id,
+            'content_hash': content_hash,
+            'created_at': time.time() if created_at is None else created_at,
+        }
+        self.index.upsert(record)
+        return record
+
+    def get(self, key):
+        rows = self.index.query("SELECT * FROM files WHERE kind = ? AND key = ?", (self.kind, key))
+        return rows[0] if rows else None
+
+    def add_ref(self, key, session_id, name=None):
+        """Note that a session uses a (possibly shared) file, and restart its age clock"""
+        now = time.time()
+        self.index.execute(
+            "INSERT OR REPLACE INTO file_refs (kind, key, session_id, name, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self.kind, key, session_id, name, now)
+        )
+        self.index.execute("UPDATE files SET created_at = ? WHERE kind = ? AND key = ?", (now, self.kind, key))
+
+    def put_stream(self, stream, extension='', session_id=None, name=None,
+                   max_bytes=None, chunk_size=STREAM_CHUNK_BYTES):
+        """
+        Store a stream under its SHA-256 content hash, reading it in chunks
+        Identical content is kept once; returns (record, deduplicated)
+        Raises FileTooLarge as soon as more than max_bytes have been read
+        """
+        incoming = os.path.join(self.root, '.incoming')
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+
+        tmp = tempfile.NamedTemporaryFile(dir=incoming, delete=False)
+        try:
+            with tmp:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise FileTooLarge(max_bytes)
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            content_hash = digest.hexdigest()
+            existing = self.get(content_hash)
+            if existing and os.path.exists(existing['path']):
+                os.remove(tmp.name)
+                deduplicated = True
+                record = existing
+            else:
+                stored_name = f"{content_hash}{extension.lower()}"
+                path = self.path_for(content_hash, stored_name)
+                os.chmod(tmp.name, 0o644)  # temp files are created owner-only
+                os.replace(tmp.name, path)
+                deduplicated = False
+                record = self.register(content_hash, stored_name, path, size=size,
+                                       session_id=session_id, content_hash=content_hash)
+        except BaseException:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+
+        if session_id:
+            self.add_ref(content_hash, session_id, name)
+        return record, deduplicated
+
+    def find_by_name(self, name):
+        rows = self.index.query(
+            "SELECT * FROM files WHERE kind = ? AND name = ? ORDER BY created_at DESC LIMIT 1",
+            (self.kind, name)
+        )
+        return rows[0] if rows else None
+
+    def list(self, limit=100, offset=0, session_id=None):
+        """Newest files first, straight from the index"""
+        if session_id:
+            return self.index.query(
+                "SELECT * FROM files WHERE kind = ? AND session_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (self.kind, session_id, limit, offset)
+            )
+        return self.index.query(
+            "SELECT * FROM files WHERE kind = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (self.kind, limit, offset)
+        )
+
+    def stats(self):
+        row = self.index.query(
+            "SELECT COUNT(*) AS count, COALESCE(SUM(size), 0) AS total_bytes, "
+            "MIN(created_at) AS oldest, MAX(created_at) AS newest FROM files WHERE kind = ?",
+            (self.kind,)
+        )[0]
+        row['kind'] = self.kind
+        row['root'] = self.root
+        return row
+
+    def remove(self, rows):
+        """Delete files and their index rows"""
+        for row in rows:
+            try:
+                os.remove(row['path'])
+            except FileNotFoundError:
+                pass
+            self._prune_empty_dirs(os.path.dirname(row['path']))
+        self.index.delete(self.kind, [row['key'] for row in rows])
+        return len(rows)
+
+    def apply_retention(self, max_age_seconds=None, session_id=None, batch=RETENTION_BATCH):
+        """
+        Remove files older than max_age_seconds and/or belonging to session_id
+        Works in batches and returns the number of files removed
+        """
+        if max_age_seconds is None and session_id is None:
+            return 0
+
+        clauses = ["kind = ?"]
+        params = [self.kind]
+        if max_age_seconds is not None:
+            clauses.append("created_at < ?")
+            params.append(time.time() - max_age_seconds)
+        if session_id is not None:
+            # A shared (deduplicated) file only goes once no other session refers to it
+            clauses.append(
+                "(session_id = ? OR key IN (SELECT key FROM file_refs WHERE kind = files.kind AND session_id = ?))"
+            )
+            clauses.append(
+                "NOT EXISTS (SELECT 1 FROM file_refs r "
+                "WHERE r.kind = files.kind AND r.key = files.key AND r.session_id != ?)"
+            )
+            params.extend([session_id, session_id, session_id])
+
+        removed = 0
+        while True:
+            rows = self.index.query(
+                f"SELECT * FROM files WHERE {' AND '.join(clauses)} ORDER BY created_at LIMIT ?",
+                params + [batch]
+            )
+            if not rows:
+                break
+            removed += self.remove(rows)
+
+        if session_id is not None:
+            self.index.execute("DELETE FROM file_refs WHERE kind = ? AND session_id = ?", (self.kind, session_id))
+        return removed
+
+    def migrate_flat_files(self, key_for_name=None):
+        """
+        Move files left directly under root (the old flat layout) into shards and index them
+        This is the only operation that lists the directory
+        """
+        if not os.path.isdir(self.root):
+            return 0
+
+        migrated = 0
+        for name in os.listdir(self.root):
+            flat_path = os.path.join(self.root, name)
+            if not os.path.isfile(flat_path):
+                continue
+            key = key_for_name(name) if key_for_name else name
+            stat = os.stat(flat_path)
+            sharded_path = self.path_for(key, name)
+            shutil.move(flat_path, sharded_path)
+            self.register(key, name, sharded_path, size=stat.st_size, created_at=stat.st_mtime)
+            migrated += 1
+        return migrated
+
+    def _prune_empty_dirs(self, directory):
+        root = os.path.abspath(self.root)
+        directory = os.path.abspath(directory)
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+class StorageCompactor(threading.Thread):
+    """Background thread applying age retention and compacting the index"""
+
+    def __init__(self, stores, interval=COMPACT_INTERVAL_SECONDS):
+        super().__init__(name='storage-compactor', daemon=True)
+        self.stores = stores
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run_once(self):
+        removed = {}
+        for store in self.stores:
+            days = RETENTION_DAYS.get(store.kind, 0)
+            if days > 0:
+                removed[store.kind] = store.apply_retention(max_age_seconds=days * 86400)
+        if self.stores:
+            self.stores[0].index.compact()
+        return removed
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                removed = self.run_once()
+                if any(removed.values()):
+                    logger.info("Retention removed files", extra={'removed': removed})
+            except Exception:
+                logger.exception("Compaction failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+class ResultCache:
+    """Processing results (OCR, salary extraction) cached against a file's content hash"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def get(self, content_hash, kind):
+        rows = self.index.query(
+            "SELECT value FROM results WHERE content_hash = ? AND kind = ?", (content_hash, kind)
+        )
+        return json.loads(rows[0]['value']) if rows else None
+
+    def put(self, content_hash, kind, value):
+        self.index.execute(
+            "INSERT OR REPLACE INTO results (content_hash, kind, value, created_at) VALUES (?, ?, ?, ?)",
+            (content_hash, kind, json.dumps(value), time.time())
+        )
+
+_index = None
+_stores = {}
+_compactor = None
+_pid = None
+_lock = threading.Lock()
+
+def get_store(kind):
+    """Process-wide store for 'letters' or 'uploads'; starts the compactor on first use"""
+    global _index, _compactor, _pid
+    with _lock:
+        if _pid != os.getpid():
+            # First use in this process (or after a fork): threads do not survive fork
+            _index = StorageIndex(INDEX_PATH)
+            _stores.clear()
+            _compactor = None
+            _pid = os.getpid()
+
+        if kind not in _stores:
+            _stores[kind] = FileStore(kind, STORE_ROOTS[kind], _index)
+
+        if _compactor is None and COMPACT_INTERVAL_SECONDS > 0:
+            _compactor = StorageCompactor([
+                _stores.setdefault(k, FileStore(k, root, _index)) for k, root in STORE_ROOTS.items()
+            ])
+            _compactor.start()
+
+        return _stores[kind]
+
+def get_result_cache():
+    """Process-wide result cache backed by the storage index"""
+    get_store('uploads')
+    return ResultCache(_index)
+
+def letter_key_for_name(name):
+    """Letters are keyed by loan reference, taken from sanction_letter_<ref>.pdf"""
+    base = os.path.splitext(name)[0]
+    prefix = 'sanction_letter_'
+    return base[len(prefix):] if base.startswith(prefix) else base
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage indexed letter and upload storage")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Show per-store counts and sizes from the index")
+    sub.add_parser('migrate', help="Shard and index files left in the old flat layout")
+    purge = sub.add_parser('purge', help="Apply a retention policy now")
+    purge.add_argument('--kind', choices=sorted(STORE_ROOTS), help="Store to purge (default: all)")
+    purge.add_argument('--older-than-days', type=float)
+    purge.add_argument('--session')
+    args = parser.parse_args(argv)
+
+    global COMPACT_INTERVAL_SECONDS
+    COMPACT_INTERVAL_SECONDS = 0  # no background thread for one-off commands
+
+    kinds = [args.kind] if getattr(args, 'kind', None) else sorted(STORE_ROOTS)
+    stores = [get_store(kind) for kind in kinds]
+
+    if args.command == 'stats':
+        print(json.dumps([store.stats() for store in stores], indent=2))
+    elif args.command == 'migrate':
+        for store in stores:
+            key_for_name = letter_key_for_name if store.kind == 'letters' else None
+            print(f"[Storage] {store.kind}: migrated {store.migrate_flat_files(key_for_name)} files")
+    elif args.command == 'purge':
+        if args.older_than_days is None and args.session is None:
+            parser.error("purge needs --older-than-days and/or --session")
+        max_age = args.older_than_days * 86400 if args.older_than_days is not None else None
+        for store in stores:
+            removed = store.apply_retention(max_age_seconds=max_age, session_id=args.session)
+            print(f"[Storage] {store.kind}: removed {removed} files")
+
+if __name__ == '__main__':
+    main()
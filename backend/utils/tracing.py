@@ -0,0 +1,150 @@
+"""
+Request tracing
+Each API request gets a trace id (the caller's X-Trace-Id, or a new one) that follows it
+through MasterAgent.process_message into every worker-agent call as nested timing spans.
+Finished traces go into a bounded in-memory ring buffer, per process, where
+/api/debug/trace/<session_id> (behind the debug token) finds them.
+
+    TRACE_BUFFER_SIZE=500     traces kept
+    TRACE_MAX_SPANS=200       spans kept per trace; the rest are counted as dropped
+
+Spans carry stage and method names and timings only, never message contents.
+"""
+import contextvars
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 500))
+TRACE_MAX_SPANS = int(os.environ.get('TRACE_MAX_SPANS', 200))
+
+_TRACE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+_current = contextvars.ContextVar('loan_trace_span', default=None)
+_buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+
+class Trace:
+    def __init__(self, name, trace_id=None, session_id=None):
+        self.trace_id = trace_id if trace_id and _TRACE_ID_RE.match(trace_id) else secrets.token_hex(8)
+        self.name = name
+        self.session_id = session_id
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+        self.dropped_spans = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _add(self, record):
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            self.spans.append(record)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s['start_ms'])
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'session_id': self.session_id,
+            'started_at': round(self.started_at, 3),
+            'duration_ms': self.duration_ms,
+            'spans': spans,
+            'dropped_spans': self.dropped_spans,
+        }
+
+class _Frame:
+    """Position in a trace: the trace and the id of the enclosing span"""
+    __slots__ = ('trace', 'span_id', 'depth')
+
+    def __init__(self, trace, span_id, depth):
+        self.trace = trace
+        self.span_id = span_id
+        self.depth = depth
+
+class span:
+    """Context manager timing a nested span; free when no trace is active"""
+    __slots__ = ('name', 'attrs', '_parent', '_token', '_started', '_id')
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self._parent = None
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is None:
+            return self
+        self._parent = parent
+        trace = parent.trace
+        with trace._lock:
+            self._id = trace._next_id
+            trace._next_id += 1
+        self._token = _current.set(_Frame(trace, self._id, parent.depth + 1))
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        parent = self._parent
+        if parent is None:
+            return False
+        ended = time.perf_counter()
+        _current.reset(self._token)
+        trace = parent.trace
+        record = {
+            'id': self._id,
+            'parent': parent.span_id,
+            'depth': parent.depth + 1,
+            'name': self.name,
+            'start_ms': round((self._started - trace._started) * 1000, 3),
+            'duration_ms': round((ended - self._started) * 1000, 3),
+        }
+        if self.attrs:
+            record['attrs'] = self.attrs
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        trace._add(record)
+        return False
+
+def start_trace(name, trace_id=None, session_id=None):
+    """Begin a trace in the current context; returns (trace, token) for finish_trace"""
+    trace = Trace(name, trace_id, session_id)
+    return trace, _current.set(_Frame(trace, 0, 0))
+
+def finish_trace(trace, token=None):
+    """Close a trace and keep it in the ring buffer"""
+    if token is not None:
+        _current.reset(token)
+    trace.duration_ms = round((time.perf_counter() - trace._started) * 1000, 3)
+    with _buffer_lock:
+        _buffer.append(trace)
+
+def current_trace():
+    frame = _current.get()
+    return frame.trace if frame else None
+
+def set_session(session_id):
+    """Attach the active trace to a session, so it can be found by session id"""
+    frame = _current.get()
+    if frame is not None and frame.trace.session_id is None:
+        frame.trace.session_id = session_id
+
+def traces_for_session(session_id, limit=10):
+    """Most recent traces of a session, newest first"""
+    with _buffer_lock:
+        matches = [t for t in reversed(_buffer) if t.session_id == session_id]
+    return [t.to_dict() for t in matches[:limit]]
+
+def find_trace(trace_id):
+    with _buffer_lock:
+        for trace in reversed(_buffer):
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+    return None
@@ -0,0 +1,300 @@
+"""
+Conversation transcripts and replay
+With TRANSCRIPTS=on every MasterAgent turn is appended to a per-session JSON-lines file:
+the message, the upload context, the resulting stage and action, and a hash of the
+normalized reply. Phone numbers become keyed pseudonyms (<phone:...>, HMAC with
+TRANSCRIPT_KEY) so replays can map them back to test customers; PAN numbers and e-mail
+addresses are masked; file names and paths are dropped. The bureau score and the
+salary used are kept so replays reproduce the same decisions.
+
+    TRANSCRIPTS=on                      off by default
+    TRANSCRIPT_KEY=...                  required; recording stays off without it
+    TRANSCRIPTS_DIR=transcripts
+    TRANSCRIPT_SAMPLE_RATE=1.0          fraction of sessions recorded (chosen by session id)
+
+Replay feeds the transcripts back into MasterAgent in virtual time across processes and
+reports every conversation whose stages, actions or replies differ from the recording:
+
+    python -m utils.transcripts replay transcripts/ --workers 4
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from utils.logging_config import redact
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPTS_DIR = os.environ.get('TRANSCRIPTS_DIR', 'transcripts')
+TRANSCRIPT_KEY = os.environ.get('TRANSCRIPT_KEY', '')
+SAMPLE_RATE = float(os.environ.get('TRANSCRIPT_SAMPLE_RATE', 1.0))
+
+_PHONE_RE = re.compile(r'(?<!\d)(?:\+?91[\s-]?)?[6-9]\d{4}[\s-]?\d{5}(?!\d)')
+_REFERENCE_RE = re.compile(r'TCPL[0-9A-Z]{19}')
+_DATE_RE = re.compile(r'\b\d{2} (?:January|February|March|April|May|June|July|August|September|October|November|December) \d{4}\b')
+_SAFE_NAME_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+# Response fields kept besides stage and action
+RESPONSE_FIELDS = ('pdf_available', 'rejection_reason', 'loan_amount')
+
+def _enabled_from_env():
+    if os.environ.get('TRANSCRIPTS', 'off').lower() not in ('on', '1', 'true'):
+        return False
+    if not TRANSCRIPT_KEY:
+        logger.warning("TRANSCRIPTS=on without TRANSCRIPT_KEY; transcripts are not recorded")
+        return False
+    return True
+
+ENABLED = _enabled_from_env()
+
+def phone_token(phone, key=None):
+    digits = re.sub(r'\D', '', phone)[-10:]
+    digest = hmac.new((key or TRANSCRIPT_KEY).encode(), digits.encode(), hashlib.sha256).hexdigest()
+    return f"<phone:{digest[:12]}>"
+
+def scrub(text, key=None):
+    """Pseudonymize phone numbers and mask other PII in a message"""
+    if not text:
+        return text
+    return redact(_PHONE_RE.sub(lambda m: phone_token(m.group(0), key), text))
+
+def _scrub_message(stage_before, message):
+    # Whatever is typed at the phone prompt is a phone number, whatever its format
+    if stage_before == 'awaiting_phone' and message and len(re.sub(r'\D', '', message)) >= 10:
+        return phone_token(message)
+    return scrub(message)
+
+def reply_hash(text):
+    """Hash of a reply with loan references and dates normalized away"""
+    normalized = _DATE_RE.sub('<DATE>', _REFERENCE_RE.sub('<REF>', text or ''))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+
+def _sampled(session_id):
+    if SAMPLE_RATE >= 1:
+        return True
+    bucket = int(hashlib.sha1(str(session_id).encode()).hexdigest()[:8], 16) / 0x100000000
+    return bucket < SAMPLE_RATE
+
+def _salary_used(result):
+    if 'verified_salary' in result:
+        return result['verified_salary']
+    if 'max_affordable_emi' in result:
+        return result['max_affordable_emi'] * 2
+    return None
+
+class TranscriptWriter:
+    """Appends one JSON line per turn to <directory>/<session>.jsonl"""
+
+    def __init__(self, directory=TRANSCRIPTS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, session_id):
+        return os.path.join(self.directory, _SAFE_NAME_RE.sub('_', str(session_id))[:100] + '.jsonl')
+
+    def record_turn(self, master, stage_before, message, context, response, underwriting_before):
+        if not _sampled(master.session_id):
+            return
+        turn = {
+            't': round(time.time(), 3),
+            'stage_before': stage_before,
+            'message': _scrub_message(stage_before, message),
+            'stage': response.get('stage'),
+            'action': response.get('action'),
+            'reply': reply_hash(response.get('response')),
+        }
+        turn.update({field: response[field] for field in RESPONSE_FIELDS if response.get(field) is not None})
+        if context and context.get('file_uploaded'):
+            turn['context'] = {'file_uploaded': True, 'content_hash': context.get('content_hash')}
+        result = master.conversation_state.get('underwriting_result')
+        if result is not None and result is not underwriting_before:
+            turn['bureau_score'] = (result.get('credit_info') or {}).get('credit_score')
+            salary = _salary_used(result)
+            if salary is not None:
+                turn['salary'] = salary
+
+        line = json.dumps(turn, default=str, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.path_for(master.session_id), 'a', encoding='utf-8') as handle:
+                handle.write(line)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TranscriptWriter()
+        return _writer
+
+def record_turn(master, stage_before, message, context, response, underwriting_before):
+    """Called by MasterAgent after every turn when ENABLED; never fails the turn"""
+    try:
+        get_writer().record_turn(master, stage_before, message, context, response, underwriting_before)
+    except Exception:
+        logger.exception("Transcript write failed", extra={'session_id': master.session_id})
+
+# ---- replay ----
+
+class _ScriptedRNG:
+    """Bureau score variation taken from the recording instead of drawn"""
+
+    def __init__(self):
+        self.variation = 0
+
+    def randint(self, low, high):
+        return self.variation
+
+    def uniform(self, low, high):
+        return 0.0
+
+def load_conversations(path):
+    """Split a session transcript into conversations; each starts at stage 'initial'"""
+    conversations = []
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            turn = json.loads(line)
+            if turn['stage_before'] == 'initial' or not conversations:
+                conversations.append([])
+            conversations[-1].append(turn)
+    # A conversation recorded from the middle cannot be replayed
+    return [c for c in conversations if c[0]['stage_before'] == 'initial']
+
+def replay_conversation(turns, phones, session_id):
+    """Replay one conversation; returns None or the first difference"""
+    from agents.master_agent import MasterAgent
+    from utils.runtime import AgentRuntime, LatencyModel
+
+    runtime = AgentRuntime.virtual(session_id, LatencyModel({'credit_bureau': 0.0, 'ocr': 0.0}))
+    rng = _ScriptedRNG()
+    runtime.rng = rng
+    master = MasterAgent(session_id=session_id, runtime=runtime)
+    salary = {}
+    master.underwriting_agent.extract_salary_from_slip = lambda slip: salary.get('value')
+
+    for index, turn in enumerate(turns):
+        message = re.sub(r'<phone:[0-9a-f]{12}>', lambda m: phones.get(m.group(0), '0000000000'), turn['message'] or '')
+        customer = master.conversation_state.get('customer_data') or {}
+        if turn.get('bureau_score') is not None and customer:
+            rng.variation = turn['bureau_score'] - customer['credit_score']
+        salary['value'] = turn.get('salary')
+        context = dict(turn['context'], file_name='salary_slip.pdf') if turn.get('context') else None
+
+        if master.conversation_state['stage'] != turn['stage_before']:
+            return {'turn': index, 'field': 'stage_before', 'expected': turn['stage_before'],
+                    'actual': master.conversation_state['stage']}
+        response = master.process_message(message, context)
+        actual = {'stage': response.get('stage'), 'action': response.get('action'),
+                  'reply': reply_hash(response.get('response'))}
+        actual.update({field: response[field] for field in RESPONSE_FIELDS if response.get(field) is not None})
+        for field in ('stage', 'action') + RESPONSE_FIELDS + ('reply',):
+            if turn.get(field) != actual.get(field):
+                difference = {'turn': index, 'field': field, 'expected': turn.get(field), 'actual': actual.get(field)}
+                if field == 'reply':
+                    difference['actual_reply'] = scrub(response.get('response'))
+                return difference
+    return None
+
+def _replay_files(paths, key):
+    from data.customers import CUSTOMER_DATABASE
+    phones = {phone_token(phone, key): phone for phone in CUSTOMER_DATABASE}
+    results = []
+    for path in paths:
+        for number, turns in enumerate(load_conversations(path)):
+            name = f"{os.path.basename(path)}#{number}"
+            difference = replay_conversation(turns, phones, f"replay_{number}_{os.path.basename(path)}")
+            results.append({'conversation': name, 'turns': len(turns), 'difference': difference})
+    return results
+
+def _init_worker(scratch):
+    os.environ['LETTERS_DIR'] = os.path.join(scratch, 'letters')
+    os.environ['UPLOADS_DIR'] = os.path.join(scratch, 'uploads')
+    os.environ['STORAGE_INDEX_PATH'] = os.path.join(scratch, f"index-{os.getpid()}.sqlite3")
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from utils.logging_config import configure_logging
+    configure_logging(force=True)
+
+def replay(paths, workers=1, key=None):
+    """Replay transcript files, spread over worker processes; returns a report"""
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    key = key or TRANSCRIPT_KEY
+    # Workers inherit the environment; a replay must not record transcripts or events of its own
+    os.environ['TRANSCRIPTS'] = 'off'
+    os.environ['EVENT_LOG'] = 'off'
+    chunks = [paths[i::workers] for i in range(workers)]
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as scratch:
+        # spawn: workers import the agents afresh with storage pointed at the scratch directory
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(scratch,)) as pool:
+            results = [r for chunk in pool.map(_replay_files, chunks, [key] * workers) for r in chunk]
+    wall = time.perf_counter() - started
+
+    mismatches = [r for r in results if r['difference']]
+    by_field = {}
+    for result in mismatches:
+        field = result['difference']['field']
+        by_field[field] = by_field.get(field, 0) + 1
+    return {
+        'files': len(paths),
+        'conversations': len(results),
+        'turns': sum(r['turns'] for r in results),
+        'mismatched': len(mismatches),
+        'mismatches_by_field': by_field,
+        'wall_seconds': round(wall, 2),
+        'mismatches': mismatches,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded transcripts and diff against the recording")
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay_parser = sub.add_parser('replay')
+    replay_parser.add_argument('paths', nargs='+', help="Transcript files or directories")
+    replay_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    replay_parser.add_argument('--limit', type=int, help="Replay at most this many session files")
+    replay_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if not TRANSCRIPT_KEY:
+        print("TRANSCRIPT_KEY must match the key used when recording", file=sys.stderr)
+        return 2
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.jsonl'))
+        else:
+            files.append(path)
+    files = files[:args.limit] if args.limit else files
+    if not files:
+        print("No transcripts found", file=sys.stderr)
+        return 2
+
+    report = replay(files, max(1, min(args.workers, len(files))))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['conversations']} conversations ({report['turns']} turns) from {report['files']} files "
+              f"in {report['wall_seconds']} s: {report['mismatched']} differ")
+        for result in report['mismatches'][:50]:
+            d = result['difference']
+            print(f"  {result['conversation']} turn {d['turn']} {d['field']}: "
+                  f"expected {d['expected']!r}, got {d['actual']!r}")
+    return 1 if report['mismatched'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Start-up warm-up
+Exercises the expensive first-use paths once so real requests do not pay for them: ReportLab
+font metrics and paragraph styles, the NLP extractors and the rate-card EMI factors.
+
+    WARMUP=preload      in the gunicorn master before workers fork, so every worker inherits it
+    WARMUP=background   in a thread in each worker after fork; the first /api/health is not delayed
+    WARMUP=off
+"""
+import logging
+import os
+import threading
+import time
+
+from data.offers import warm_rate_card
+from utils.nlp_processor import NLPProcessor
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODE = os.environ.get('WARMUP', 'preload').lower()
+
+_SAMPLE_LETTER = {
+    'loan_reference_number': 'TCPL0000000000000000000',
+    'sanction_date': '01 January 2026',
+    'validity_date': '31 January 2026',
+    'expected_disbursal_date': '04 January 2026',
+    'customer_name': 'Warm Up',
+    'customer_address': 'Mumbai',
+    'customer_pan': 'AAAAA0000A',
+    'customer_email': 'warmup@example.com',
+    'loan_amount': 100000,
+    'tenure_months': 12,
+    'interest_rate': 10.5,
+    'emi_amount': 8815.00,
+    'processing_fee': 2000.0,
+    'total_interest': 5780.0,
+    'total_payable': 105780.0,
+    'credit_score': 750,
+    'credit_bureau': 'CIBIL',
+    'terms': ['Warm-up'],
+    'documents_required': ['Warm-up'],
+}
+
+def _warm_pdf():
+    from utils.pdf_generator import render_sanction_letter_pdf
+    render_sanction_letter_pdf(_SAMPLE_LETTER)
+
+def _warm_nlp():
+    nlp = NLPProcessor()
+    nlp.extract_loan_amount('2.5 lakh')
+    nlp.extract_tenure('3 years')
+    nlp.detect_intent('yes please')
+    nlp.clean_phone_number('+91 98765 43210')
+
+STEPS = (
+    ('rate_card', warm_rate_card),
+    ('nlp', _warm_nlp),
+    ('pdf', _warm_pdf),
+)
+
+def warm_up():
+    """Run every warm-up step; a failing step is logged and skipped. Returns seconds per step."""
+    timings = {}
+    for name, step in STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+            continue
+        timings[name] = round(time.perf_counter() - started, 4)
+    logger.info("Warm-up complete", extra={'seconds': timings})
+    return timings
+
+def warm_up_in_background():
+    """Warm up on a daemon thread so the server can answer health checks meanwhile"""
+    thread = threading.Thread(target=warm_up, name='warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,104 @@
+"""
+Named background worker pools
+Thin wrapper over ThreadPoolExecutor that bounds the queue and keeps counters,
+so callers can fall back when a pool is saturated and others can report depths
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class PoolSaturated(RuntimeError):
+    """Raised when a pool's queue is full and the caller should not wait"""
+
+class WorkerPool:
+    """Thread pool with a bounded backlog and queued/active counters"""
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(f"{self.name} pool is saturated ({self.queued} queued)")
+            self.queued += 1
+        future = self._executor.submit(self._run, fn, args, kwargs)
+        future.add_done_callback(self._cancelled)
+        return future
+
+    def _cancelled(self, future):
+        # A job cancelled while queued never reaches _run, which is where queued goes down
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+                self.cancelled += 1
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+        return result
+
+    def saturated(self):
+        return self.queued >= self.max_queue
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+_pools = {}
+_pid = None
+_lock = threading.Lock()
+
+def get_pool(name, max_workers=2, max_queue=100):
+    """Process-wide pool by name; created on first use (and again after a fork)"""
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            # Worker threads do not survive fork, so a child starts with fresh pools
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(name)
+        if pool is None:
+            pool = WorkerPool(name, max_workers, max_queue)
+            _pools[name] = pool
+        return pool
+
+def all_pools():
+    with _lock:
+        if _pid != os.getpid():
+            return []
+        return list(_pools.values())
@@ -0,0 +1,12 @@
+"""
+Production WSGI entrypoint
+    gunicorn -c gunicorn.conf.py wsgi:app
+The agent modules are imported here; with preload_app the master does this once.
+Warm-up runs here too (WARMUP=preload) or per worker after fork (WARMUP=background,
+see gunicorn.conf.py), which keeps cold starts fast on the free tier.
+"""
+from app import app
+from utils.warmup import warm_up, WARMUP_MODE
+
+if WARMUP_MODE == 'preload':
+    warm_up()